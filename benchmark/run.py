@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark dataset converters on synthetic data.
+
+Each case runs in its own process, so its peak memory is measured alone.
+Results are saved as json, and can be compared with an earlier run:
+
+    python benchmark/run.py --images 200 --output new.json --compare old.json
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+import json
+import glob
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(_here)
+sys.path.append(os.path.join(_here, '../pedestrian/dataset'))
+sys.path.append(os.path.join(_here, '../humanparsing/dataset'))
+sys.path.append(os.path.join(_here, '../surreal'))
+import synthetic
+from stats import peak_rss
+
+
+def clean(root):
+    """Remove outputs and caches of earlier runs under root"""
+    for pattern in ('*_voc', 'set*/frame', '.imsize.json', '*/*.npz', '*/*/*.npz', '*_cache', '*.idx'):
+        for f in glob.glob(os.path.join(root, pattern)):
+            if os.path.isdir(f):
+                shutil.rmtree(f)
+            else:
+                os.remove(f)
+
+
+def _voc_report(root, name):
+    report = os.path.join(root, name + '_voc', 'convert_report.json')
+    if os.path.exists(report):
+        with open(report, 'r') as fid:
+            return json.load(fid)['stages']
+    return None
+
+
+# ---- cases, each returns (number of items, unit, extra info) ----
+
+def case_readvbb(args, data):
+    from vbb import SeqVbb
+    clean(data['caltech'])
+    vbbs = sorted(glob.glob(os.path.join(data['caltech'], 'annotations/*/*.vbb')))
+    parser = SeqVbb()
+    start = time.time()
+    n = sum(len(parser.readvbb(x, 'set00')) for x in vbbs)
+    cold = time.time() - start
+    n = sum(len(parser.readvbb(x, 'set00')) for x in vbbs)
+    return n, 'frames', {'cold_seconds': cold, 'cached_seconds': time.time() - start - cold}
+
+
+def case_readseq(args, data):
+    from vbb import SeqVbb
+    clean(data['caltech'])
+    seqs = sorted(glob.glob(os.path.join(data['caltech'], 'set*/*.seq')))
+    parser = SeqVbb()
+    n, nbytes = 0, 0
+    for seq in seqs:
+        for key, frame in parser.readseq(seq, 'set00', stream=True, raw=args.raw_seq):
+            n += 1
+            nbytes += len(frame) if args.raw_seq else frame.nbytes
+    return n, 'frames', {'bytes': nbytes, 'raw': bool(args.raw_seq)}
+
+
+def case_check_anno(args, data):
+    from base import Pedestrian, clip_bboxes
+    rng = np.random.RandomState(0)
+    images = args.images * 10
+    boxes = [synthetic.fake_boxes(rng, args.boxes, 480, 640) for _ in range(images)]
+    ds = Pedestrian('bench', os.path.join(data['workdir'], 'check_anno'))
+    start = time.time()
+    for b in boxes:
+        ds.check_anno(b, hw=(480, 640))
+    per_image = time.time() - start
+    start = time.time()
+    clip_bboxes(np.concatenate(boxes), np.tile([[480, 640]], (images * args.boxes, 1)))
+    return images * args.boxes, 'boxes', {'per_image_seconds': per_image, 'dataset_seconds': time.time() - start}
+
+
+def case_anno2xml(args, data):
+    from base import Pedestrian
+    import cv2
+    rng = np.random.RandomState(0)
+    outdir = os.path.join(data['workdir'], 'anno2xml')
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    synthetic.mkdir(outdir)
+    imgfile = os.path.join(outdir, 'img.jpg')
+    cv2.imwrite(imgfile, synthetic.fake_image(rng, 480, 640))
+    n = args.images * 10
+    annos = [{'id': '{:0>6}'.format(i),
+              'bboxes': [{'name': 'person', 'xyxy': b.tolist()} for b in synthetic.fake_boxes(rng, args.boxes, 480, 640)]}
+             for i in range(n)]
+    extra = {}
+    for kind in ('lxml', 'fast'):
+        ds = Pedestrian('bench', outdir)
+        ds.set_xml_writer(kind, args.workers)
+        start = time.time()
+        for anno in annos:
+            ds.write_xml(imgfile, anno, os.path.join(outdir, '{}_{}.xml'.format(anno['id'], kind)))
+        ds.close_xml_writer()
+        extra[kind + '_seconds'] = time.time() - start
+    return n, 'xml', extra
+
+
+def _convert(cls, root, args, ds=None):
+    clean(root)
+    ds = cls(root) if ds is None else ds
+    ds.set_xml_writer(args.xml_writer, args.workers)
+    ds.set_outputs(*args.outputs.split(','))
+    if hasattr(ds, 'set_workers'):
+        ds.set_workers(args.workers)
+    ds.convert2voc()
+    n = len(os.listdir(os.path.join(root, ds.voc_name, 'JPEGImages')))
+    return n, 'images', {'stages': _voc_report(root, ds.name)}
+
+
+def case_caltech(args, data):
+    from caltech import Caltech
+    return _convert(Caltech, data['caltech'], args)
+
+
+def case_caltech_tar(args, data):
+    from caltech import Caltech
+    ds = Caltech(data['caltech_tar'])
+    ds.set_from_archive()
+    return _convert(Caltech, data['caltech_tar'], args, ds)
+
+
+def case_kitti(args, data):
+    from kitti import Kitti
+    return _convert(Kitti, data['kitti'], args)
+
+
+def case_citypersons(args, data):
+    from citypersons import CityPersons
+    return _convert(CityPersons, data['citypersons'], args)
+
+
+def case_inria(args, data):
+    from inria import INRIAPerson
+    return _convert(INRIAPerson, data['inria'], args)
+
+
+def case_lip(args, data):
+    from cvpr2018_lip_single import LIPsingle
+    ds = LIPsingle('bench_lip', data['lip'])
+    ds.save_path = os.path.join(data['workdir'], 'lip_out')
+    if os.path.exists(ds.save_path):
+        shutil.rmtree(ds.save_path)
+    os.makedirs(ds.save_path)
+    start = time.time()
+    ds.unzip()
+    unzip = time.time() - start
+    ds.convert2voc()
+    n = len(os.listdir(os.path.join(ds.save_path, ds.voc_name, 'JPEGImages')))
+    # same layout straight from the nested zips
+    ds.save_path = os.path.join(data['workdir'], 'lip_out_archive')
+    if os.path.exists(ds.save_path):
+        shutil.rmtree(ds.save_path)
+    os.makedirs(ds.save_path)
+    start = time.time()
+    ds.convert2voc(from_archive=True, workers=args.workers)
+    return n, 'images', {'unzip_seconds': unzip, 'from_archive_seconds': time.time() - start}
+
+
+def case_surreal(args, data):
+    import vis
+    import scipy.io as sio
+    n = 0
+    overlay = 0.0
+    for video in sorted(glob.glob(os.path.join(data['surreal'], 'train/*/*/*.mp4'))):
+        segm = sio.loadmat(video[:-len('.mp4')] + '_segm.mat')
+        for ind, img in vis.iter_mp4(video):
+            n += 1
+            start = time.time()
+            vis.draw_mask_on_img(img, segm['segm_{}'.format(ind + 1)])
+            overlay += time.time() - start
+    return n, 'frames', {'overlay_seconds': overlay}
+
+
+cases = {'readvbb': (case_readvbb, 'caltech'),
+         'readseq': (case_readseq, 'caltech'),
+         'check_anno': (case_check_anno, None),
+         'anno2xml': (case_anno2xml, None),
+         'caltech': (case_caltech, 'caltech'),
+         'caltech_tar': (case_caltech_tar, 'caltech_tar'),
+         'kitti': (case_kitti, 'kitti'),
+         'citypersons': (case_citypersons, 'citypersons'),
+         'inria': (case_inria, 'inria'),
+         'lip': (case_lip, 'lip'),
+         'surreal': (case_surreal, 'surreal')}
+
+
+def generate(args, names):
+    """Create synthetic datasets needed by cases, reused if already there"""
+    data = {'workdir': args.workdir}
+    makers = {
+        'caltech': lambda d: synthetic.caltech(d, videos=args.videos, frames=args.frames, boxes=args.boxes),
+        'caltech_tar': lambda d: synthetic.caltech(d, videos=args.videos, frames=args.frames, boxes=args.boxes, archive=True),
+        'kitti': lambda d: synthetic.kitti(d, train=args.images, test=args.images // 5, boxes=args.boxes),
+        'citypersons': lambda d: synthetic.citypersons(d, images=max(args.images // 9, 1), boxes=args.boxes),
+        'inria': lambda d: synthetic.inria(d, train=args.images, test=args.images // 2, boxes=args.boxes),
+        'lip': lambda d: synthetic.lip(d, train=args.images, val=args.images // 2, test=args.images // 2),
+        'surreal': lambda d: synthetic.surreal(d, clips=args.clips, frames=args.frames)}
+    for name in names:
+        data[name] = os.path.join(args.workdir, name)
+        if not os.path.exists(data[name]):
+            print('generating synthetic ' + name + ' ...')
+            makers[name](data[name])
+    return data
+
+
+def _run(name, args, data, conn):
+    rss_start = peak_rss()[0]
+    start = time.time()
+    try:
+        n, unit, extra = cases[name][0](args, data)
+        seconds = time.time() - start
+        rss = peak_rss()
+        conn.send({'case': name, 'seconds': seconds, 'items': n, 'unit': unit,
+                   'throughput': n / seconds if seconds > 0 else 0.0,
+                   'rss_start': rss_start, 'peak_rss': rss[0], 'peak_rss_children': rss[1],
+                   'extra': extra})
+    except Exception as e:
+        conn.send({'case': name, 'error': repr(e)})
+    conn.close()
+
+
+def run_case(name, args, data):
+    parent, child = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=_run, args=(name, args, data, child))
+    p.start()
+    result = parent.recv()
+    p.join()
+    return result
+
+
+def show(results, compare=None):
+    old = dict((x['case'], x) for x in compare or [])
+    print('{:<12} {:>10} {:>10} {:>14} {:>10} {:>8}'.format('case', 'items', 'seconds', 'throughput', 'peak MB', 'speedup'))
+    for r in results:
+        if 'error' in r:
+            print('{:<12} error: {}'.format(r['case'], r['error']))
+            continue
+        speedup = ''
+        if r['case'] in old and old[r['case']].get('throughput'):
+            speedup = '{:.2f}x'.format(r['throughput'] / old[r['case']]['throughput'])
+        print('{:<12} {:>10} {:>10.3f} {:>9.1f} {:<4} {:>10.1f} {:>8}'.format(
+            r['case'], r['items'], r['seconds'], r['throughput'], r['unit'][:4] + '/s',
+            max(r['peak_rss'], r['peak_rss_children']) / 1e6, speedup))
+
+
+def main(args):
+    names = list(cases.keys()) if args.cases == 'all' else args.cases.split(',')
+    for name in names:
+        if name not in cases:
+            raise ValueError('Unknown case: {}'.format(name))
+    if args.workdir is None:
+        args.workdir = tempfile.mkdtemp(prefix='human_bench_')
+    data = generate(args, sorted(set(cases[x][1] for x in names if cases[x][1] is not None)))
+
+    results = []
+    for name in names:
+        print('===> ' + name)
+        results.append(run_case(name, args, data))
+
+    compare = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as fid:
+            compare = json.load(fid)['results']
+    show(results, compare)
+    if args.output is not None:
+        with open(args.output, 'w') as fid:
+            json.dump({'args': vars(args), 'time': time.time(), 'results': results}, fid, indent=2)
+        print('results are saved in ' + args.output)
+    if not args.keep and args.workdir.startswith(tempfile.gettempdir()):
+        shutil.rmtree(args.workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark dataset converters on synthetic data')
+    parser.add_argument('--cases', default='all', type=str, help='comma separated cases, or all: ' + ','.join(sorted(cases)))
+    parser.add_argument('--images', default=100, type=int, help='images per dataset')
+    parser.add_argument('--boxes', default=5, type=int, help='average boxes per image')
+    parser.add_argument('--videos', default=1, type=int, help='caltech videos per set')
+    parser.add_argument('--frames', default=60, type=int, help='frames per caltech video / surreal clip')
+    parser.add_argument('--clips', default=4, type=int, help='surreal clips')
+    parser.add_argument('--workers', default=4, type=int, help='worker processes of converters')
+    parser.add_argument('--xml_writer', default='fast', type=str, help='lxml | fast')
+    parser.add_argument('--outputs', default='xml', type=str, help='comma separated annotation outputs: xml,store,coco')
+    parser.add_argument('--raw_seq', default=1, type=int, help='readseq gives jpg bytes instead of decoded frames')
+    parser.add_argument('--workdir', default=None, type=str, help='where synthetic data is kept, default a temp dir')
+    parser.add_argument('--keep', action='store_true', help='keep temp workdir')
+    parser.add_argument('--output', default=None, type=str, help='save results as json')
+    parser.add_argument('--compare', default=None, type=str, help='json of an earlier run to compare with')
+    args = parser.parse_args()
+    main(args)
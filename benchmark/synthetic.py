@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generate small, format-correct fake datasets for benchmarks.
+
+Every generator takes the number of images (or frames) and boxes, so the
+size of a run can be scaled without the real multi-GB datasets.
+"""
+
+from __future__ import print_function
+import os
+import glob
+import struct
+import tarfile
+import zipfile
+import numpy as np
+import cv2
+from scipy.io import savemat
+
+
+def mkdir(d):
+    if not os.path.exists(d):
+        os.makedirs(d)
+    return d
+
+
+def fake_image(rng, h, w):
+    """Cheap image with some texture, so jpg/png are not trivially small"""
+    img = np.zeros((h, w, 3), np.uint8)
+    img[:] = rng.randint(0, 255, 3)
+    noise = rng.randint(0, 64, (h // 8 + 1, w // 8 + 1, 3)).astype(np.uint8)
+    img += cv2.resize(noise, (w, h), interpolation=cv2.INTER_NEAREST)
+    return img
+
+
+def fake_boxes(rng, n, h, w):
+    """n boxes in (x1, y1, x2, y2), some of them out of image or degenerated"""
+    x1 = rng.uniform(-10, w, n)
+    y1 = rng.uniform(-10, h, n)
+    bw = rng.uniform(0, w / 4.0, n)
+    bh = rng.uniform(0, h / 2.0, n)
+    return np.stack([x1, y1, x1 + bw, y1 + bh], 1)
+
+
+def write_seq(seq_file, frames, fps=30.0):
+    """Write jpg-encoded frames to a Norpix .seq file, layout of seqIo.m"""
+    h, w = frames[0].shape[:2]
+    header = bytearray(1024)
+    struct.pack_into('<I', header, 0, 0xFEED)
+    header[4:24] = u'Norpix seq'.encode('utf-16-le')
+    struct.pack_into('<iI', header, 28, 3, 1024)
+    struct.pack_into('<9I', header, 548, w, h, 24, 8, w * h * 3, 102, len(frames), 0, w * h * 3)
+    struct.pack_into('<d', header, 584, fps)
+    with open(seq_file, 'wb') as fid:
+        fid.write(header)
+        for frame in frames:
+            data = cv2.imencode('.jpg', frame)[1].tobytes()
+            fid.write(struct.pack('<I', len(data) + 4))
+            fid.write(data)
+            fid.write(b'\0' * 8) # timestamp
+    return seq_file
+
+
+def write_vbb(vbb_file, boxes, labels=('person', 'people', 'person-fa')):
+    """Write vbb annotation readable by SeqVbb.readvbb
+
+    Args:
+        boxes (list): per frame, list of (obj_id, [x, y, w, h], occl), obj_id from 1
+    """
+    fields = [('id', 'O'), ('pos', 'O'), ('occl', 'O'), ('lock', 'O'), ('posv', 'O')]
+    obj_lists = np.empty((1, len(boxes)), dtype=object)
+    for f, objs in enumerate(boxes):
+        if len(objs) == 0:
+            obj_lists[0, f] = np.zeros((0, 0))
+            continue
+        st = np.zeros((1, len(objs)), dtype=fields)
+        for j, (obj_id, pos, occl) in enumerate(objs):
+            st[0, j] = (np.array([[obj_id]], dtype=np.float64),
+                        np.array([pos], dtype=np.float64),
+                        np.array([[occl]], dtype=np.float64),
+                        np.array([[0.]]),
+                        np.zeros((1, 4)))
+        obj_lists[0, f] = st
+    obj_lbl = np.empty((1, len(labels)), dtype=object)
+    for i, label in enumerate(labels):
+        obj_lbl[0, i] = label
+    savemat(vbb_file, {'A': {'nFrame': float(len(boxes)),
+                             'objLists': obj_lists,
+                             'maxObj': float(len(labels)),
+                             'objInit': np.ones((1, len(labels))),
+                             'objLbl': obj_lbl}})
+    return vbb_file
+
+
+def caltech(root, sets=11, videos=2, frames=60, boxes=3, h=480, w=640, seed=0, archive=False):
+    """root/setXX/VYYY.seq and root/annotations/setXX/VYYY.vbb
+
+    archive (bool): pack them into root/setXX.tar and root/annotations.zip
+        as downloaded, and remove the extracted files
+    """
+    rng = np.random.RandomState(seed)
+    for i in range(sets):
+        setid = 'set{:0>2}'.format(i)
+        seqdir = mkdir(os.path.join(root, setid))
+        vbbdir = mkdir(os.path.join(root, 'annotations', setid))
+        for v in range(videos):
+            videoid = 'V{:0>3}'.format(v)
+            imgs = [fake_image(rng, h, w) for _ in range(frames)]
+            write_seq(os.path.join(seqdir, videoid + '.seq'), imgs)
+            annos = []
+            for f in range(frames):
+                n = rng.randint(0, 2 * boxes + 1)
+                xyxy = fake_boxes(rng, n, h, w)
+                annos.append([(rng.randint(1, 4), [x1, y1, x2 - x1, y2 - y1], rng.randint(0, 2))
+                              for x1, y1, x2, y2 in xyxy])
+            write_vbb(os.path.join(vbbdir, videoid + '.vbb'), annos)
+    if archive:
+        for i in range(sets):
+            setid = 'set{:0>2}'.format(i)
+            with tarfile.open(os.path.join(root, setid + '.tar'), 'w') as tar:
+                for seq in sorted(glob.glob(os.path.join(root, setid, '*.seq'))):
+                    tar.add(seq, os.path.relpath(seq, root))
+                    os.remove(seq)
+        with zipfile.ZipFile(os.path.join(root, 'annotations.zip'), 'w') as zf:
+            for vbb in sorted(glob.glob(os.path.join(root, 'annotations/*/*.vbb'))):
+                zf.write(vbb, os.path.relpath(vbb, root))
+                os.remove(vbb)
+    return root
+
+
+def kitti(root, train=100, test=20, boxes=5, h=375, w=1242, seed=0):
+    """root/{training,testing}/image_2/*.png and root/training/label_2/*.txt"""
+    rng = np.random.RandomState(seed)
+    classes = ('Car', 'Pedestrian', 'Cyclist', 'Van', 'DontCare')
+    imgdir = mkdir(os.path.join(root, 'training/image_2'))
+    labeldir = mkdir(os.path.join(root, 'training/label_2'))
+    for ind in range(train):
+        cv2.imwrite(os.path.join(imgdir, '{:0>6}.png'.format(ind)), fake_image(rng, h, w))
+        with open(os.path.join(labeldir, '{:0>6}.txt'.format(ind)), 'w') as fid:
+            for x1, y1, x2, y2 in fake_boxes(rng, rng.randint(0, 2 * boxes + 1), h, w):
+                fid.write('{} 0.00 0 -1.57 {:.2f} {:.2f} {:.2f} {:.2f} 1.50 1.60 3.70 0.0 1.0 20.0 -1.57\n'.format(
+                    classes[rng.randint(len(classes))], x1, y1, x2, y2))
+    imgdir = mkdir(os.path.join(root, 'testing/image_2'))
+    for ind in range(test):
+        cv2.imwrite(os.path.join(imgdir, '{:0>6}.png'.format(ind)), fake_image(rng, h, w))
+    return root
+
+
+def citypersons(root, cities=3, images=20, boxes=8, h=1024, w=2048, seed=0):
+    """root/leftImg8bit/{train,val,test}/city/*.png and anno_{train,val}.mat"""
+    rng = np.random.RandomState(seed)
+    annodir = mkdir(os.path.join(root, 'shanshanzhang-citypersons/annotations'))
+    for phase in ('train', 'val', 'test'):
+        entries = []
+        for c in range(cities):
+            cityname = '{}city{}'.format(phase, c)
+            imgdir = mkdir(os.path.join(root, 'leftImg8bit', phase, cityname))
+            for k in range(images):
+                imgname = '{}_{:0>6}_000019_leftImg8bit.png'.format(cityname, k)
+                cv2.imwrite(os.path.join(imgdir, imgname), fake_image(rng, h, w))
+                n = rng.randint(0, 2 * boxes + 1)
+                xyxy = fake_boxes(rng, n, h, w)
+                bbs = np.zeros((n, 10))
+                bbs[:, 0] = rng.randint(0, 6, n)
+                bbs[:, 1:3] = xyxy[:, :2]
+                bbs[:, 3:5] = xyxy[:, 2:] - xyxy[:, :2]
+                bbs[:, 5:9] = bbs[:, 1:5]
+                entries.append({'cityname': np.array([cityname]),
+                                'im_name': np.array([imgname]),
+                                'bbs': bbs})
+        if phase == 'test':
+            continue
+        cell = np.empty((1, len(entries)), dtype=object)
+        for i, entry in enumerate(entries):
+            cell[0, i] = entry
+        savemat(os.path.join(annodir, 'anno_{}.mat'.format(phase)), {'anno_{}_aligned'.format(phase): cell})
+    return root
+
+
+def inria(root, train=50, test=20, boxes=2, h=480, w=640, seed=0):
+    """root/{Train,Test}/{pos.lst,annotations.lst,pos/,annotations/}"""
+    rng = np.random.RandomState(seed)
+    for phase, num in (('Train', train), ('Test', test)):
+        posdir = mkdir(os.path.join(root, phase, 'pos'))
+        annodir = mkdir(os.path.join(root, phase, 'annotations'))
+        pos_lst, anno_lst = [], []
+        for ind in range(num):
+            name = 'person_{:0>3}'.format(ind)
+            cv2.imwrite(os.path.join(posdir, name + '.png'), fake_image(rng, h, w))
+            pos_lst.append('{}/pos/{}.png'.format(phase, name))
+            anno_lst.append('{}/annotations/{}.txt'.format(phase, name))
+            with open(os.path.join(annodir, name + '.txt'), 'w') as fid:
+                fid.write('# PASCAL Annotation Version 1.00\n')
+                fid.write('Image filename : "{}"\n'.format(pos_lst[-1]))
+                fid.write('Image size (X x Y x C) : {} x {} x 3\n'.format(w, h))
+                xyxy = np.clip(fake_boxes(rng, rng.randint(1, 2 * boxes + 1), h, w), 1, [w, h, w, h]).astype(int)
+                for k, (x1, y1, x2, y2) in enumerate(xyxy):
+                    fid.write('Bounding box for object {} "PASperson" (Xmin, Ymin) - (Xmax, Ymax) : ({}, {}) - ({}, {})\n'.format(
+                        k + 1, x1, y1, x2, y2))
+        with open(os.path.join(root, phase, 'pos.lst'), 'w') as fid:
+            fid.write('\n'.join(pos_lst) + '\n')
+        with open(os.path.join(root, phase, 'annotations.lst'), 'w') as fid:
+            fid.write('\n'.join(anno_lst) + '\n')
+    return root
+
+
+def _zip_dir(zip_file, members):
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_STORED) as zf:
+        for arcname, data in members:
+            zf.writestr(arcname, data)
+
+
+def lip(ziproot, train=50, val=20, test=20, classes=20, h=256, w=192, seed=0):
+    """Zip-in-zip archives of LIP, as consumed by LIPsingle.unzip"""
+    rng = np.random.RandomState(seed)
+    mkdir(ziproot)
+    images, segs = [], []
+    for phase, num in (('train', train), ('val', val)):
+        ids = []
+        for ind in range(num):
+            name = '{}_{:0>6}'.format(ind, phase)
+            ids.append(name)
+            images.append(('{}_images/{}.jpg'.format(phase, name),
+                           cv2.imencode('.jpg', fake_image(rng, h, w))[1].tobytes()))
+            mask = cv2.resize(rng.randint(0, classes, (h // 16, w // 16)).astype(np.uint8), (w, h),
+                              interpolation=cv2.INTER_NEAREST)
+            segs.append(('{}_segmentations/{}.png'.format(phase, name), cv2.imencode('.png', mask)[1].tobytes()))
+        images.append(('{}_id.txt'.format(phase), ('\n'.join(ids) + '\n').encode('ascii')))
+    test_images = [('testing_images/{}_test.jpg'.format(ind), cv2.imencode('.jpg', fake_image(rng, h, w))[1].tobytes())
+                   for ind in range(test)]
+
+    inner = os.path.join(ziproot, 'inner.zip')
+    for outer, inner_name, members in (
+            ('TrainVal_images.zip', 'TrainVal_images.zip', images),
+            ('Testing_images.zip', 'Testing_images.zip', test_images),
+            ('TrainVal_parsing_annotations.zip',
+             'TrainVal_parsing_annotations/TrainVal_parsing_annotations.zip', segs)):
+        _zip_dir(inner, members)
+        with zipfile.ZipFile(os.path.join(ziproot, outer), 'w', zipfile.ZIP_STORED) as zf:
+            zf.write(inner, inner_name)
+        os.remove(inner)
+    return ziproot
+
+
+def surreal(root, split='train', clips=4, frames=30, h=240, w=320, joints=24, seed=0):
+    """root/split/run0/seqname/seqname_c0001{.mp4,_segm.mat,_depth.mat,_info.mat}"""
+    rng = np.random.RandomState(seed)
+    for c in range(clips):
+        seqname = 'seq{:0>3}'.format(c)
+        clipdir = mkdir(os.path.join(root, split, 'run0', seqname))
+        stem = os.path.join(clipdir, seqname + '_c0001')
+        writer = cv2.VideoWriter(stem + '.mp4', cv2.VideoWriter_fourcc(*'mp4v'), 30, (w, h))
+        segm, depth = {}, {}
+        for f in range(frames):
+            writer.write(fake_image(rng, h, w))
+            mask = cv2.resize(rng.randint(0, 25, (h // 20, w // 20)).astype(np.uint8), (w, h),
+                              interpolation=cv2.INTER_NEAREST)
+            segm['segm_{}'.format(f + 1)] = mask
+            depth['depth_{}'.format(f + 1)] = np.where(mask > 0, rng.uniform(2, 8), 1e10).astype(np.float32)
+        writer.release()
+        savemat(stem + '_segm.mat', segm, do_compression=True)
+        savemat(stem + '_depth.mat', depth, do_compression=True)
+        savemat(stem + '_info.mat', {
+            'joints2D': rng.uniform(0, w, (2, joints, frames)),
+            'joints3D': rng.uniform(-1, 1, (3, joints, frames)),
+            'pose': rng.uniform(-1, 1, (72, frames)),
+            'shape': rng.uniform(-1, 1, (10, frames)),
+            'zrot': rng.uniform(-3, 3, (frames, 1)),
+            'camLoc': rng.uniform(-1, 1, (3, 1)),
+            'camDist': np.array([[6.0]]),
+            'gender': rng.randint(0, 2, (frames, 1)),
+            'sequence': np.array([seqname]),
+            'source': np.array(['cmu'])})
+    return root
@@ -2,37 +2,35 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import cv2
 import numpy as np
 from PIL import Image
 import tqdm
-import zipfile
-try:
-    import commands
-except Exception as e:
-    import subprocess as commands
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../pedestrian/dataset"))
+from linkfarm import LinkFarm
+import shards
+from nestedzip import NestedZip
+from maskstore import pack_masks, MaskStore
 
 default_root = os.path.expanduser('~/data')
 if not os.path.exists(default_root):
     os.makedirs(default_root)
 
 
-def extract(inputfile, savedir):
-    print('Unzip ' + inputfile + ' ...')
-    zip_ref = zipfile.ZipFile(inputfile, 'r')
-    zip_ref.extractall(savedir)
-    zip_ref.close()
-
-
 def mkdir(dir):
     if not os.path.exists(dir):
         os.makedirs(dir)
 
 
-def ln(src, dst):
-    cmd = 'ln -s {} {}'.format(src, dst)
-    (status, output) = commands.getstatusoutput(cmd)
-    output = output.split('\n')
+def ln(pairs, mode='symlink', workers=8):
+    """Create links of [(src, dst), ...] in parallel, return failed ones"""
+    failures = LinkFarm(mode, workers).build(pairs)
+    if failures:
+        print("{}/{} links failed:".format(len(failures), len(pairs)))
+        for src, dst, err in failures[:10]:
+            print("    {} -> {}: {}".format(src, dst, err))
+    return failures
 
 
 class LIPsingle(object):
@@ -44,32 +42,42 @@ class LIPsingle(object):
         if not os.path.exists(self.save_path):
             os.makedirs(self.save_path)
         self.voc_name = self.name + '_voc'
+        self.link_mode = 'symlink'
+        self.num_classes = 20
+
 
+    def archives(self):
+        """Zips inside the downloaded zips: images, test images and segmentations"""
+        return {'images': NestedZip(os.path.join(self.ziproot, 'TrainVal_images.zip'),
+                                    'TrainVal_images.zip'),
+                'test': NestedZip(os.path.join(self.ziproot, 'Testing_images.zip'),
+                                  'Testing_images.zip'),
+                'segs': NestedZip(os.path.join(self.ziproot, 'TrainVal_parsing_annotations.zip'),
+                                  'TrainVal_parsing_annotations/TrainVal_parsing_annotations.zip')}
 
-    def unzip(self):
-        trainval_img = os.path.join(self.ziproot, 'TrainVal_images.zip')
-        test_img =  os.path.join(self.ziproot, 'Testing_images.zip')
 
-        extract(trainval_img, self.save_path) 
-        extract(os.path.join(self.save_path, 'TrainVal_images.zip'), self.save_path) 
-        extract(test_img, self.save_path) 
-        extract(os.path.join(self.save_path, 'Testing_images.zip'), self.save_path) 
+    def unzip(self, workers=8):
+        """Extract members of the inner zips to save_path, the inner zips are not written"""
+        for key, nested in sorted(self.archives().items()):
+            print('Unzip ' + nested.inner_name + ' ...')
+            with nested:
+                nested.extract(nested.names(), self.save_path, workers=workers)
 
-        trainval_anno =  os.path.join(self.ziproot, 'TrainVal_parsing_annotations.zip')
-        extract(trainval_anno, self.save_path) 
-        trainval_anno =  os.path.join(self.save_path, 
-                                      'TrainVal_parsing_annotations',
-                                      'TrainVal_parsing_annotations.zip')
-        extract(trainval_anno, self.save_path) 
 
+    def convert2voc(self, from_archive=False, workers=8):
+        """Create voc layout from unzipped files, or from archives in ziproot
 
-    def convert2voc(self):
+        from_archive (bool): extract images and segmentations right into the
+            voc layout, unzip is not needed
+        """
         voc_root = os.path.join(self.save_path, self.voc_name)
         if not os.path.exists(voc_root):
             os.makedirs(voc_root)
         else:
             print(voc_root + ' already exists')
             return
+        if from_archive:
+            return self._convert_from_archive(voc_root, workers)
         
         jpegdir = os.path.join(voc_root, 'JPEGImages') 
         annodir = os.path.join(voc_root, 'SegmentationClass')
@@ -94,33 +102,139 @@ class LIPsingle(object):
         
 
         print('creating images ...')
-        t = tqdm.tqdm()
-        t.total = len(trainimg + validimg)
-        for img in trainimg + validimg:
-            t.update()
-            dstname = os.path.join(jpegdir, os.path.basename(img))
-            ln(img, dstname)
+        ln([(img, os.path.join(jpegdir, os.path.basename(img))) for img in trainimg + validimg],
+           self.link_mode)
 
         print('creating segmentations ...')
-        t = tqdm.tqdm()
-        t.total = len(trainseg + validseg)
-        for seg in trainseg + validseg:
-            t.update()
-            dstname = os.path.join(annodir, os.path.basename(seg))
-            ln(seg, dstname)
+        ln([(seg, os.path.join(annodir, os.path.basename(seg))) for seg in trainseg + validseg],
+           self.link_mode)
 
-        ln(trainid, os.path.join(imgsetdir1, 'train_seg.txt'))
-        ln(validid, os.path.join(imgsetdir1, 'val_seg.txt'))
-
-        ln(trainid, os.path.join(imgsetdir2, 'train.txt'))
-        ln(validid, os.path.join(imgsetdir2, 'val.txt'))
+        ln([(trainid, os.path.join(imgsetdir1, 'train_seg.txt')),
+            (validid, os.path.join(imgsetdir1, 'val_seg.txt')),
+            (trainid, os.path.join(imgsetdir2, 'train.txt')),
+            (validid, os.path.join(imgsetdir2, 'val.txt'))])
 
         # create test id list
         testid = os.path.join(self.save_path, 'test_id.txt')
-        cmd = "ls {}/testing_images | cut -d'.' -f1 > {}".format(self.save_path, testid)
-        (status, output) = commands.getstatusoutput(cmd)
-        ln(testid, os.path.join(imgsetdir2, 'test.txt'))
+        test_imgdir = os.path.join(self.save_path, 'testing_images')
+        with open(testid, 'w') as fid:
+            for x in sorted(os.listdir(test_imgdir)):
+                if x.endswith('.jpg'):
+                    fid.write(os.path.splitext(x)[0] + '\n')
+        ln([(testid, os.path.join(imgsetdir2, 'test.txt'))])
+
 
+    def _convert_from_archive(self, voc_root, workers):
+        jpegdir = os.path.join(voc_root, 'JPEGImages')
+        annodir = os.path.join(voc_root, 'SegmentationClass')
+        imgsetdir1 = os.path.join(voc_root, 'ImageSets/Main')
+        imgsetdir2 = os.path.join(voc_root, 'ImageSets/Segmentation')
+        mkdir(imgsetdir1)
+        mkdir(imgsetdir2)
+
+        archives = self.archives()
+        images, test, segs = archives['images'], archives['test'], archives['segs']
+        print('creating images ...')
+        images.extract(images.names('train_images/', '.jpg') + images.names('val_images/', '.jpg'),
+                       jpegdir, os.path.basename, workers)
+        print('creating segmentations ...')
+        segs.extract(segs.names('train_segmentations/', '.png') + segs.names('val_segmentations/', '.png'),
+                     annodir, os.path.basename, workers)
+
+        for phase in ('train', 'val'):
+            data = images.read('{}_id.txt'.format(phase))
+            for f in (os.path.join(imgsetdir1, phase + '_seg.txt'), os.path.join(imgsetdir2, phase + '.txt')):
+                with open(f, 'wb') as fid:
+                    fid.write(data)
+        with open(os.path.join(imgsetdir2, 'test.txt'), 'w') as fid:
+            for name in test.names('testing_images/', '.jpg'):
+                fid.write(os.path.splitext(os.path.basename(name))[0] + '\n')
+        for x in archives.values():
+            x.close()
+
+
+    def export_shards(self, split='train', out_dir=None, maxsize=256 << 20, maxcount=10000, workers=4,
+                      from_archive=False):
+        """Pack a split into tar shards of <id>.jpg and <id>.png segmentation
+
+        Test samples have no png. Default out_dir is voc_root/shards/split.
+        from_archive (bool): read images and segmentations from the archives
+            in ziproot, nothing needs to be unzipped or converted
+        """
+        voc_root = os.path.join(self.save_path, self.voc_name)
+        if out_dir is None:
+            out_dir = os.path.join(voc_root, 'shards', split)
+        if from_archive:
+            return self._export_shards_from_archive(split, out_dir, maxsize, maxcount, workers)
+        with open(os.path.join(voc_root, 'ImageSets/Segmentation', split + '.txt'), 'r') as fid:
+            ids = [x.strip() for x in fid if x.strip()]
+
+        samples = []
+        for x in ids:
+            files = {}
+            jpg = os.path.join(voc_root, 'JPEGImages', x + '.jpg')
+            files['jpg'] = jpg if os.path.exists(jpg) else os.path.join(self.save_path, 'testing_images', x + '.jpg')
+            png = os.path.join(voc_root, 'SegmentationClass', x + '.png')
+            if os.path.exists(png):
+                files['png'] = png
+            samples.append((x, files))
+        index = shards.write_shards(samples, out_dir, self.name, maxsize, maxcount, workers)
+        print("{} samples in {} shards are saved in {}".format(index['count'], len(index['shards']), out_dir))
+        return index
+
+
+    def _export_shards_from_archive(self, split, out_dir, maxsize, maxcount, workers):
+        archives = self.archives()
+        images, test, segs = archives['images'], archives['test'], archives['segs']
+        samples = []
+        if split == 'test':
+            for name in test.names('testing_images/', '.jpg'):
+                samples.append((os.path.splitext(os.path.basename(name))[0], {'jpg': (test, name)}))
+        else:
+            ids = [x.strip() for x in images.read('{}_id.txt'.format(split)).decode('utf-8').split('\n') if x.strip()]
+            seg_names = set(segs.names('{}_segmentations/'.format(split), '.png'))
+            for x in ids:
+                files = {'jpg': (images, '{}_images/{}.jpg'.format(split, x))}
+                png = '{}_segmentations/{}.png'.format(split, x)
+                if png in seg_names:
+                    files['png'] = (segs, png)
+                samples.append((x, files))
+        index = shards.write_shards(samples, out_dir, self.name, maxsize, maxcount, workers)
+        for x in archives.values():
+            x.close()
+        print("{} samples in {} shards are saved in {}".format(index['count'], len(index['shards']), out_dir))
+        return index
+
+    def pack_masks(self, split='train', out_dir=None, workers=8, from_archive=False):
+        """Pack segmentations of split into a memory-mapped MaskStore
+
+        Per-image and global class histograms are computed while packing,
+        e.g. store.class_weights() for loss weighting. Default out_dir is
+        voc_root/masks/split.
+        """
+        voc_root = os.path.join(self.save_path, self.voc_name)
+        if out_dir is None:
+            out_dir = os.path.join(voc_root, 'masks', split)
+        archive = None
+        if from_archive:
+            archives = self.archives()
+            archive = archives['segs']
+            with archives['images'] as images:
+                ids = [x.strip() for x in images.read('{}_id.txt'.format(split)).decode('utf-8').split('\n') if x.strip()]
+            items = [(x, '{}_segmentations/{}.png'.format(split, x)) for x in ids]
+        else:
+            with open(os.path.join(voc_root, 'ImageSets/Segmentation', split + '.txt'), 'r') as fid:
+                ids = [x.strip() for x in fid if x.strip()]
+            items = [(x, os.path.join(voc_root, 'SegmentationClass', x + '.png')) for x in ids]
+        store = pack_masks(items, out_dir, self.num_classes, workers, archive)
+        if archive is not None:
+            archive.close()
+        print("{} masks are packed in {}".format(len(store), out_dir))
+        return store
+
+
+    def open_masks(self, split='train'):
+        return MaskStore(os.path.join(self.save_path, self.voc_name, 'masks', split))
 
 
 if __name__ == "__main__":
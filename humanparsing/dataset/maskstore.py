@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Segmentation masks of a dataset packed into one memory-mapped uint8 file.
+
+Layout of a store directory:
+    masks.u8     all masks, row-major, one after another
+    offsets.npy  (N+1,) int64, mask i is masks.u8[offsets[i]:offsets[i+1]]
+    shapes.npy   (N, 2) int32, height width
+    ids.npy      (N,) bytes, image ids
+    hist.npy     (N, C+1) int64, pixels of each class, last column counts
+                 labels >= C, e.g. 255
+    meta.json    {'num_classes': C, 'hist': global histogram}
+"""
+
+import os
+import io
+import json
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+
+_worker_archive = None
+
+def _init_worker(archive):
+    global _worker_archive
+    _worker_archive = archive.copy() if archive is not None else None
+
+
+def _read(name, archive):
+    if archive is not None:
+        return archive.read(name)
+    with open(name, 'rb') as fid:
+        return fid.read()
+
+
+def decode_mask(data):
+    """Label image of png bytes, palette indices are kept as they are"""
+    return np.array(Image.open(io.BytesIO(data)), dtype=np.uint8)
+
+
+def _decode(args, archive=None):
+    name, num_classes = args
+    mask = decode_mask(_read(name, _worker_archive if archive is None else archive))
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    hist = np.bincount(mask.ravel(), minlength=256)
+    hist = np.concatenate([hist[:num_classes], [hist[num_classes:].sum()]])
+    return mask.shape, hist, mask.tobytes()
+
+
+def pack_masks(items, out_dir, num_classes=20, workers=8, archive=None):
+    """Decode masks in a process pool and pack them into out_dir
+
+    Args:
+        items (list): [(id, png), ...], png is a path, or a member name of
+            archive, e.g. a NestedZip
+
+    Returns:
+        MaskStore of out_dir
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    jobs = [(name, num_classes) for _, name in items]
+    pool = None
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(workers, _init_worker, (archive,))
+        results = pool.imap(_decode, jobs, chunksize=16)
+    else:
+        results = (_decode(x, archive) for x in jobs)
+
+    n = len(items)
+    shapes = np.zeros((n, 2), dtype=np.int32)
+    hists = np.zeros((n, num_classes + 1), dtype=np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    # masks come back in order and are appended, memory stays at one chunk
+    tmpfile = os.path.join(out_dir, 'masks.u8.tmp')
+    with open(tmpfile, 'wb') as fid:
+        for i, (shape, hist, data) in enumerate(results):
+            shapes[i] = shape
+            hists[i] = hist
+            offsets[i + 1] = offsets[i] + len(data)
+            fid.write(data)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    os.rename(tmpfile, os.path.join(out_dir, 'masks.u8'))
+
+    np.save(os.path.join(out_dir, 'offsets.npy'), offsets)
+    np.save(os.path.join(out_dir, 'shapes.npy'), shapes)
+    np.save(os.path.join(out_dir, 'ids.npy'), np.array([x.encode('utf-8') for x, _ in items], dtype=bytes))
+    np.save(os.path.join(out_dir, 'hist.npy'), hists)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as fid:
+        json.dump({'num_classes': num_classes, 'hist': hists.sum(0).tolist()}, fid)
+    return MaskStore(out_dir)
+
+
+class MaskStore(object):
+
+    """Read-only access to packed masks, mask i is a view of the mmap"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r') as fid:
+            self.meta = json.load(fid)
+        self.num_classes = self.meta['num_classes']
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'), mmap_mode='r')
+        self.shapes = np.load(os.path.join(store_dir, 'shapes.npy'), mmap_mode='r')
+        self.ids = np.load(os.path.join(store_dir, 'ids.npy'), mmap_mode='r')
+        self.hist = np.load(os.path.join(store_dir, 'hist.npy'), mmap_mode='r')
+        masks_file = os.path.join(store_dir, 'masks.u8')
+        if os.path.getsize(masks_file) > 0:
+            self.masks = np.memmap(masks_file, dtype=np.uint8, mode='r')
+        else:
+            self.masks = np.zeros(0, dtype=np.uint8)
+        self._index = None
+
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+
+    def __getitem__(self, i):
+        h, w = self.shapes[i]
+        return self.masks[self.offsets[i]:self.offsets[i+1]].reshape(h, w)
+
+
+    def index(self, image_id):
+        if self._index is None:
+            self._index = dict((x.decode('utf-8'), i) for i, x in enumerate(self.ids))
+        return self._index[image_id]
+
+
+    def get(self, image_id):
+        return self[self.index(image_id)]
+
+
+    def class_pixels(self):
+        """Pixels of each class over all images, without the >= C column"""
+        return np.asarray(self.meta['hist'][:self.num_classes], dtype=np.int64)
+
+
+    def class_frequency(self):
+        """Share of labeled pixels of each class"""
+        pixels = self.class_pixels().astype(np.float64)
+        return pixels / max(pixels.sum(), 1)
+
+
+    def class_weights(self):
+        """Median frequency balancing: median(freq) / freq(c)
+
+        freq(c) is pixels of c over pixels of images where c is present.
+        Classes never present get weight 0.
+        """
+        hist = np.asarray(self.hist[:, :self.num_classes], dtype=np.float64)
+        present = hist > 0
+        image_pixels = hist.sum(1, keepdims=True)
+        denom = (present * image_pixels).sum(0)
+        freq = np.where(denom > 0, hist.sum(0) / np.maximum(denom, 1), 0)
+        median = np.median(freq[freq > 0]) if (freq > 0).any() else 0
+        return np.where(freq > 0, median / np.maximum(freq, 1e-12), 0)
+
+
+    def images_with(self, label):
+        """Indexes of images containing label"""
+        return np.nonzero(np.asarray(self.hist[:, label]) > 0)[0]
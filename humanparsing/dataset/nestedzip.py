@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Read members of a zip stored inside another zip, without extracting the
+inner zip to disk first.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import multiprocessing
+
+
+class _Window(object):
+
+    """Read-only file object over bytes [start, start+size) of a file"""
+
+    def __init__(self, path, start, size):
+        self._fid = open(path, 'rb')
+        self._start = start
+        self._size = size
+        self._pos = 0
+
+
+    def seekable(self):
+        return True
+
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._size
+        self._pos = min(max(pos, 0), self._size)
+        return self._pos
+
+
+    def tell(self):
+        return self._pos
+
+
+    def read(self, n=-1):
+        if n is None or n < 0 or self._pos + n > self._size:
+            n = self._size - self._pos
+        self._fid.seek(self._start + self._pos)
+        data = self._fid.read(n)
+        self._pos += len(data)
+        return data
+
+
+    def close(self):
+        self._fid.close()
+
+
+class NestedZip(object):
+
+    """Members of zip inner_name inside zip outer_file
+
+    If the inner zip is stored without compression, as zips of jpg usually
+    are, it is read in place from the outer file. Otherwise it is inflated
+    once to a temp file, removed on close.
+
+    Usage:
+        nz = NestedZip('TrainVal_images.zip', 'TrainVal_images.zip')
+        data = nz.read('train_images/77_471474.jpg')
+    """
+
+    def __init__(self, outer_file, inner_name):
+        self.outer_file = outer_file
+        self.inner_name = inner_name
+        self._zip = None
+        self._src = None
+        self._tmpfile = None
+        self._shared = None
+
+
+    def __getstate__(self):
+        # reopened by each worker process, an inflated inner zip is shared
+        return {'outer_file': self.outer_file, 'inner_name': self.inner_name,
+                '_zip': None, '_src': None, '_tmpfile': None,
+                '_shared': self._tmpfile or self._shared}
+
+
+    def copy(self):
+        """Same archive with its own file handles"""
+        other = NestedZip(self.outer_file, self.inner_name)
+        other.__dict__.update(self.__getstate__())
+        return other
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    @property
+    def zip(self):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self._open_inner(), 'r')
+        return self._zip
+
+
+    def _open_inner(self):
+        if self._shared is not None:
+            return self._shared
+        with zipfile.ZipFile(self.outer_file, 'r') as outer:
+            info = outer.getinfo(self.inner_name)
+            if info.compress_type == zipfile.ZIP_STORED:
+                # data starts after the local header, whose extra field may
+                # differ from the one in the central directory
+                with open(self.outer_file, 'rb') as fid:
+                    fid.seek(info.header_offset)
+                    header = fid.read(30)
+                name_len, extra_len = struct.unpack('<HH', header[26:30])
+                start = info.header_offset + 30 + name_len + extra_len
+                self._src = _Window(self.outer_file, start, info.file_size)
+                return self._src
+            fd, self._tmpfile = tempfile.mkstemp(suffix='.zip')
+            with os.fdopen(fd, 'wb') as dst:
+                with outer.open(info) as src:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+        return self._tmpfile
+
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._src is not None:
+            self._src.close()
+            self._src = None
+        if self._tmpfile is not None:
+            os.remove(self._tmpfile)
+            self._tmpfile = None
+
+
+    def names(self, prefix='', suffix=''):
+        """Sorted names of files in the inner zip"""
+        return sorted(x for x in self.zip.namelist()
+                      if x.startswith(prefix) and x.endswith(suffix) and not x.endswith('/'))
+
+
+    def size(self, name):
+        return self.zip.getinfo(name).file_size
+
+
+    def read(self, name):
+        return self.zip.read(name)
+
+
+    def extract(self, names, outdir, dst_name=None, workers=8):
+        """Extract names to outdir in parallel, existing files of the same size are kept
+
+        dst_name (callable): path under outdir of a member name, default the name itself
+
+        Returns:
+            list of written paths
+        """
+        jobs = []
+        for name in names:
+            dst = os.path.join(outdir, dst_name(name) if dst_name is not None else name)
+            if os.path.exists(dst) and os.path.getsize(dst) == self.size(name):
+                continue
+            jobs.append((name, dst))
+        if workers > 1 and len(jobs) > 1:
+            self.zip # inflate here once, not in every worker
+            # contiguous chunks, each worker reads the archive in order
+            step = (len(jobs) + workers - 1) // workers
+            chunks = [jobs[i:i + step] for i in range(0, len(jobs), step)]
+            pool = multiprocessing.Pool(workers, _init_worker, (self,))
+            pool.map(_extract, chunks)
+            pool.close()
+            pool.join()
+        else:
+            _extract(jobs, self)
+        return [x[1] for x in jobs]
+
+
+_worker_zip = None
+
+def _init_worker(nested):
+    # a forked worker would share the file offsets of the parent
+    global _worker_zip
+    _worker_zip = nested.copy()
+
+
+def _extract(jobs, nested=None):
+    nested = _worker_zip if nested is None else nested
+    for name, dst in jobs:
+        dirname = os.path.dirname(dst)
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                pass
+        tmp = '{}.{}.tmp'.format(dst, os.getpid())
+        with open(tmp, 'wb') as fid:
+            fid.write(nested.read(name))
+        os.rename(tmp, dst)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Compact annotation store: all boxes of a dataset in a few memory-mapped arrays.
+
+Layout of a store directory:
+    boxes.npy      (N, 4) int32, x1 y1 x2 y2
+    classes.npy    (N,) int16, index into meta.json classes
+    occlusion.npy  (N,) uint8
+    offsets.npy    (M+1,) int64, boxes of image i are offsets[i]:offsets[i+1]
+    sizes.npy      (M, 2) int32, width height
+    ids.npy        (M,) bytes, image ids
+    meta.json      {'classes': [...]}
+
+AnnoStoreWriter appends records as segments in <store_dir>.log, merged
+into the store once at close. The merged store is written to
+<store_dir>.tmp and swapped in, recover() finishes or rolls back a swap
+that was interrupted.
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+
+
+arrays = ('boxes', 'classes', 'occlusion', 'offsets', 'sizes', 'ids')
+
+
+class AnnoStore(object):
+
+    """Read-only, zero-copy access to an annotation store"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        recover(store_dir)
+        for name in arrays:
+            setattr(self, name, np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(store_dir, 'meta.json'), 'r') as fid:
+            self.meta = json.load(fid)
+        self.class_names = self.meta['classes']
+        self._index = None
+
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+
+    def __getitem__(self, i):
+        """Annotations of i-th image, arrays are views of the mmap"""
+        s, e = self.offsets[i], self.offsets[i+1]
+        return {'id': self.ids[i].decode('utf-8'),
+                'width': int(self.sizes[i, 0]),
+                'height': int(self.sizes[i, 1]),
+                'boxes': self.boxes[s:e],
+                'classes': self.classes[s:e],
+                'occlusion': self.occlusion[s:e]}
+
+
+    def index(self, image_id):
+        """Position of image_id in the store"""
+        if self._index is None:
+            self._index = dict((x.decode('utf-8'), i) for i, x in enumerate(self.ids))
+        return self._index[image_id]
+
+
+    def get(self, image_id):
+        return self[self.index(image_id)]
+
+
+    def boxes_per_image(self):
+        return np.diff(self.offsets)
+
+
+    def class_counts(self):
+        """{class name: number of boxes}"""
+        counts = np.bincount(self.classes, minlength=len(self.class_names))
+        return dict(zip(self.class_names, counts.tolist()))
+
+
+    def box_stats(self):
+        """Size statistics of all boxes, relative to their image"""
+        b = np.asarray(self.boxes, dtype=np.float64)
+        w = b[:, 2] - b[:, 0]
+        h = b[:, 3] - b[:, 1]
+        img_hw = np.repeat(np.asarray(self.sizes, dtype=np.float64), self.boxes_per_image(), axis=0)
+        return {'images': len(self),
+                'boxes': int(b.shape[0]),
+                'height': {'mean': float(h.mean()) if h.size else 0.0,
+                           'median': float(np.median(h)) if h.size else 0.0},
+                'aspect_ratio': {'mean': float((w / np.maximum(h, 1)).mean()) if h.size else 0.0},
+                'relative_area': {'mean': float((w * h / (img_hw[:, 0] * img_hw[:, 1])).mean()) if h.size else 0.0},
+                'occluded': float(np.asarray(self.occlusion).mean()) if h.size else 0.0,
+                'classes': self.class_counts()}
+
+
+def recover(store_dir):
+    """Finish a swap of store_dir interrupted by a crash, remove leftovers
+
+    Returns:
+        True if store_dir holds a store
+    """
+    tmp_dir, old_dir = store_dir + '.tmp', store_dir + '.old'
+    done = lambda x: os.path.exists(os.path.join(x, 'meta.json'))
+    if not done(store_dir):
+        # meta.json is written last, a tmp dir with it is complete
+        if done(tmp_dir) or done(old_dir):
+            if os.path.exists(store_dir):
+                shutil.rmtree(store_dir)
+            os.rename(tmp_dir if done(tmp_dir) else old_dir, store_dir)
+    for x in (tmp_dir, old_dir):
+        if os.path.exists(x):
+            shutil.rmtree(x)
+    return done(store_dir)
+
+
+class AnnoStoreWriter(object):
+
+    """Collect annotation records and save them as an AnnoStore
+
+    save() appends pending records to a new segment in <store_dir>.log,
+    so its cost does not grow with the store. close() merges the existing
+    store and all segments once: images are kept unless they are added
+    again or removed by a later segment. bytes_written counts segments
+    and store files written.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.log_dir = store_dir + '.log'
+        self._records = {}
+        self._removed = set()
+        self.bytes_written = 0
+
+
+    def add(self, image_id, width, height, bboxes):
+        """
+        Args:
+            bboxes (list): [{'name':'person', 'xyxy':[], 'occlusion':0}, ...]
+        """
+        self._records[image_id] = (width, height, [(b['name'], [int(x) for x in b['xyxy']], b.get('occlusion', 0)) for b in bboxes])
+        self._removed.discard(image_id)
+
+
+    def remove(self, image_id):
+        self._records.pop(image_id, None)
+        self._removed.add(image_id)
+
+
+    def _pending(self):
+        ids = sorted(self._records.keys())
+        boxes = [b for x in ids for b in self._records[x][2]]
+        class_names, classes = [], np.zeros(0, dtype=np.int64)
+        if boxes:
+            class_names, classes = np.unique([b[0] for b in boxes], return_inverse=True)
+            class_names = class_names.tolist()
+        return {'ids': np.array([x.encode('utf-8') for x in ids], dtype=bytes),
+                'sizes': np.array([self._records[x][:2] for x in ids], dtype=np.int32).reshape(-1, 2),
+                'counts': np.array([len(self._records[x][2]) for x in ids], dtype=np.int64),
+                'boxes': np.array([b[1] for b in boxes], dtype=np.int32).reshape(-1, 4),
+                'class_names': np.array([x.encode('utf-8') for x in class_names], dtype=bytes),
+                'classes': classes.reshape(-1),
+                'occlusion': np.array([b[2] for b in boxes], dtype=np.uint8),
+                'removed': np.array(sorted(x.encode('utf-8') for x in self._removed), dtype=bytes)}
+
+
+    def _segments(self):
+        if not os.path.exists(self.log_dir):
+            return []
+        return sorted(os.path.join(self.log_dir, x) for x in os.listdir(self.log_dir)
+                      if x.endswith('.npz') and not x.endswith('.tmp.npz'))
+
+
+    def save(self):
+        """Append pending records to the log as one segment"""
+        if not self._records and not self._removed:
+            return
+        segments = self._segments()
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        index = int(os.path.basename(segments[-1]).split('.')[0]) + 1 if segments else 0
+        segment = os.path.join(self.log_dir, '{:0>8}.npz'.format(index))
+        # renamed into place, a segment on disk is complete
+        tmpfile = segment[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmpfile, **self._pending())
+        os.rename(tmpfile, segment)
+        self.bytes_written += os.path.getsize(segment)
+        self._records = {}
+        self._removed = set()
+
+
+    def close(self):
+        """Save pending records and merge the log into the store"""
+        self.save()
+        segments = self._segments()
+        if not segments:
+            recover(self.store_dir)
+            return
+        parts = []
+        if recover(self.store_dir):
+            old = AnnoStore(self.store_dir)
+            parts.append({'ids': np.asarray(old.ids), 'sizes': old.sizes, 'counts': old.boxes_per_image(),
+                          'boxes': old.boxes, 'class_names': old.class_names, 'classes': old.classes,
+                          'occlusion': old.occlusion, 'removed': np.zeros(0, dtype=bytes)})
+        for f in segments:
+            with np.load(f) as seg:
+                part = dict((k, seg[k]) for k in seg.files)
+            part['class_names'] = [x.decode('utf-8') for x in part['class_names'].tolist()]
+            parts.append(part)
+        self._write(self._merge(parts))
+        # a crash before this replays the segments, which gives the same store
+        shutil.rmtree(self.log_dir)
+
+
+    def _merge(self, parts):
+        # the latest event of an id, added or removed, decides whether it is kept
+        ids = np.concatenate([x['ids'] for x in parts] + [x['removed'] for x in parts]).astype(bytes)
+        n_images = sum(x['ids'].shape[0] for x in parts)
+        order_key = np.concatenate([np.full(x['ids'].shape[0], i) for i, x in enumerate(parts)] +
+                                   [np.full(x['removed'].shape[0], i) for i, x in enumerate(parts)])
+        events = np.lexsort((order_key, ids))
+        last = np.ones(events.shape[0], dtype=bool)
+        last[:-1] = ids[events[1:]] != ids[events[:-1]]
+        keep = np.zeros(ids.shape[0], dtype=bool)
+        keep[events[last]] = True
+        keep = keep[:n_images] # removals are never kept
+
+        counts = np.concatenate([x['counts'] for x in parts]).astype(np.int64)
+        box_keep = np.repeat(keep, counts)
+        # class ids of each part mapped into one sorted class table
+        class_names = sorted(set(n for x in parts for n in x['class_names']))
+        classes = np.concatenate([np.array([class_names.index(n) for n in x['class_names']],
+                                           dtype=np.int16)[np.asarray(x['classes'], dtype=np.int64)]
+                                  for x in parts])[box_keep]
+        ids, counts = ids[:n_images][keep], counts[keep]
+
+        # images sorted by id, boxes follow their image
+        order = np.argsort(ids, kind='mergesort')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        box_order = np.argsort(rank[np.repeat(np.arange(ids.shape[0]), counts)], kind='mergesort')
+
+        return {'boxes': np.concatenate([x['boxes'] for x in parts])[box_keep][box_order],
+                'classes': classes[box_order],
+                'occlusion': np.concatenate([x['occlusion'] for x in parts])[box_keep][box_order],
+                'offsets': np.concatenate([[0], np.cumsum(counts[order])]).astype(np.int64),
+                'sizes': np.concatenate([x['sizes'] for x in parts])[keep][order],
+                'ids': ids[order],
+                'class_names': class_names}
+
+
+    def _write(self, out):
+        # written to a new dir and swapped in, readers never see half a store
+        tmp_dir, old_dir = self.store_dir + '.tmp', self.store_dir + '.old'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name in arrays:
+            np.save(os.path.join(tmp_dir, name + '.npy'), out[name])
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as fid:
+            json.dump({'classes': out['class_names'], 'images': int(out['ids'].shape[0]),
+                       'boxes': int(out['classes'].shape[0])}, fid)
+        self.bytes_written += sum(os.path.getsize(os.path.join(tmp_dir, x)) for x in os.listdir(tmp_dir))
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.exists(self.store_dir):
+            os.rename(self.store_dir, old_dir)
+        os.rename(tmp_dir, self.store_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
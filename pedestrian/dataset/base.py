@@ -7,6 +7,18 @@ import cv2
 import numpy as np
 from lxml import objectify, etree
 import tqdm
+import cProfile
+import json
+import zlib
+from imsize import SizeCache
+from vocxml import VocXmlWriter
+from linkfarm import LinkFarm
+from manifest import Manifest
+from stats import Stats
+from annostore import AnnoStore, AnnoStoreWriter, recover
+from coco import CocoWriter
+from vocreader import VocDataset
+import shards
 
 try:
     import commands
@@ -17,6 +29,43 @@ except Exception as e:
 default_root = osp.expanduser('~/data/pedestrian')
 
 
+def clip_bboxes(bboxes, hw):
+    """Clip, filter and normalize boxes in one pass
+
+    Args:
+        bboxes (np.ndarray): Nx4 boxes, (x1, y1, x2, y2)
+        hw (tuple or np.ndarray): (h, w) shared by all boxes, or Nx2 array
+            of per-box (h, w), e.g. boxes of a whole dataset at once
+
+    Returns:
+        (cleaned Mx4 bboxes, keep mask of length N)
+    """
+    bboxes = np.array(bboxes).reshape(-1, 4)
+    hw = np.asarray(hw)
+    if hw.ndim == 2:
+        h, w = hw[:, 0], hw[:, 1]
+    else:
+        h, w = hw[0], hw[1]
+
+    # 1<= x <= w, 1 <= y <= h
+    x1 = np.maximum(bboxes[:, 0], 1)
+    y1 = np.maximum(bboxes[:, 1], 1)
+    x2 = np.minimum(bboxes[:, 2], w)
+    y2 = np.minimum(bboxes[:, 3], h)
+
+    # delete x1 == x2, y1 == y2
+    keep = (x1 != x2) & (y1 != y2)
+
+    # x1 < x2, y1 < y2
+    out = np.empty((int(keep.sum()), 4), dtype=bboxes.dtype)
+    x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+    out[:, 0] = np.minimum(x1, x2)
+    out[:, 1] = np.minimum(y1, y2)
+    out[:, 2] = np.maximum(x1, x2)
+    out[:, 3] = np.maximum(y1, y2)
+    return out, keep
+
+
 class Pedestrian(object):
 
     """Base class for pedestrian detection dataset"""
@@ -25,10 +74,35 @@ class Pedestrian(object):
         self._name = name
         self._root = root
         self._voc_name = self._name + '_voc'
+        self._size_cache = None
+        self._xml_writer = None
+        self._xml_writer_kind = 'lxml'
+        self._xml_workers = 4
+        self._linkfarm = LinkFarm()
+        self.stats = Stats()
+        self._profile_file = None
+        self._profiler = None
+        self._outputs = ('xml',)
+        self._store_writer = None
+        self._coco_writer = None
+        self.coco_by_split = True
+        self.crowd_classes = ()
+        self._shard = None
         if not osp.exists(root):
             os.makedirs(root)
 
 
+    def __getstate__(self):
+        # sent to worker processes without pools and pending outputs
+        state = self.__dict__.copy()
+        state['_xml_writer'] = None
+        state['_profiler'] = None
+        state['_store_writer'] = None
+        state['_coco_writer'] = None
+        state['_linkfarm'] = LinkFarm(self._linkfarm.mode, self._linkfarm.workers)
+        return state
+
+
     @property
     def root(self):
         return self._root
@@ -41,6 +115,8 @@ class Pedestrian(object):
 
     @property
     def voc_name(self):
+        if self._shard is not None:
+            return '{}_part{}of{}'.format(self._voc_name, *self._shard)
         return self._voc_name
 
 
@@ -52,7 +128,7 @@ class Pedestrian(object):
         raise NotImplementedError
 
 
-    def convert2voc(self):
+    def convert2voc(self, xml_writer=None):
         raise NotImplementedError
 
 
@@ -61,7 +137,7 @@ class Pedestrian(object):
 
 
     def create_voc(self):
-        voc_root = osp.join(self.root, self.name+'_voc')
+        voc_root = osp.join(self.root, self.voc_name)
         jpgdir = osp.join(voc_root, 'JPEGImages')
         annodir = osp.join(voc_root, 'Annotations') 
         splitdir = osp.join(voc_root, 'ImageSets/Main')
@@ -77,6 +153,174 @@ class Pedestrian(object):
         return voc_root, jpgdir, annodir, splitdir
 
 
+    def set_shard(self, index, count):
+        """Convert only units of shard index of count, to voc_name_part<index>of<count>
+
+        Units are assigned to shards by a hash of their key, so every node
+        running its shard gets a disjoint part. Parts are put together by
+        merge_shards(count).
+        """
+        index, count = int(index), int(count)
+        if count < 1 or index < 0 or index >= count:
+            raise ValueError("Invalid shard {} of {}".format(index, count))
+        self._shard = None if count == 1 else (index, count)
+
+
+    def in_shard(self, key):
+        if self._shard is None:
+            return True
+        return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % self._shard[1] == self._shard[0]
+
+
+    def shard_keys(self, keys, global_ids=False):
+        """Keys of units in this shard, all keys are saved in voc_root/part.json for merge
+
+        global_ids (bool): ids of units do not depend on other units, e.g.
+            KITTI, and are kept by merge_shards
+        """
+        if self._shard is None:
+            return list(keys)
+        voc_root = self.create_voc()[0]
+        with open(osp.join(voc_root, 'part.json'), 'w') as fid:
+            json.dump({'shard': list(self._shard), 'keys': list(keys), 'global_ids': global_ids}, fid)
+        return [x for x in keys if self.in_shard(x)]
+
+
+    def merge_shards(self, count):
+        """Put parts of a sharded conversion together into voc_name
+
+        Ids are assigned again in unit order, as a conversion on one node
+        would do. Images are linked to the sources of the parts, the
+        <folder> and <filename> of xml are rewritten, annostore and coco
+        outputs of parts are merged as well. The mapping of part ids is
+        saved in voc_root/id_map.json.
+        """
+        self._shard = None
+        parts = [osp.join(self.root, '{}_part{}of{}'.format(self._voc_name, i, count)) for i in range(count)]
+        infos, manifests = [], []
+        for part in parts:
+            if not osp.exists(osp.join(part, 'part.json')):
+                raise IOError('{} is not converted'.format(part))
+            with open(osp.join(part, 'part.json'), 'r') as fid:
+                infos.append(json.load(fid))
+            manifests.append(Manifest(osp.join(part, 'manifest.json')))
+        keys = infos[0]['keys']
+        global_ids = infos[0]['global_ids']
+        owner = {}
+        for i, manifest in enumerate(manifests):
+            for key in manifest.units:
+                owner[key] = i
+        missing = [x for x in keys if x not in owner]
+        if missing:
+            raise ValueError('{} units are not converted, e.g. {}'.format(len(missing), missing[0]))
+
+        manifest = self.open_manifest()
+        if manifest is None or len(manifest) > 0:
+            print('{} already exists'.format(self.voc_name))
+            return False
+        voc_root, jpgdir, annodir, splitdir = self.create_voc()
+        self.stats.reset()
+
+        stores = [AnnoStore(osp.join(x, 'annostore')) if recover(osp.join(x, 'annostore')) else None
+                  for x in parts]
+        cocos = [osp.join(x, 'coco', 'records.jsonl') for x in parts]
+        cocos = [x if osp.exists(x) else None for x in cocos]
+        if any(x is not None for x in stores):
+            self._outputs = tuple(set(self._outputs) | set(['store']))
+        coco_records = [{} for _ in parts]
+        for i, x in enumerate(cocos):
+            if x is None:
+                continue
+            self._outputs = tuple(set(self._outputs) | set(['coco']))
+            with open(x, 'r') as fid:
+                for line in fid:
+                    record = json.loads(line)
+                    if record.get('removed'):
+                        coco_records[i].pop(record['id'], None)
+                    else:
+                        coco_records[i][record['id']] = line
+
+        id_map = {}
+        next_id = 1
+        t = tqdm.tqdm()
+        t.total = len(keys)
+        for key in keys:
+            t.update()
+            i = owner[key]
+            part, unit = parts[i], manifests[i].units[key]
+            ids = unit['ids'] if global_ids else list(range(next_id, next_id + len(unit['ids'])))
+            next_id = max([next_id] + [x + 1 for x in ids])
+            for old, new in zip(unit['ids'], ids):
+                old, new = '{:0>6}'.format(old), '{:0>6}'.format(new)
+                jpg = osp.join(part, 'JPEGImages', old + '.jpg')
+                self.link(os.readlink(jpg) if osp.islink(jpg) else jpg, osp.join(jpgdir, new + '.jpg'))
+                xmlfile = osp.join(part, 'Annotations', old + '.xml')
+                if osp.exists(xmlfile):
+                    with open(xmlfile, 'rb') as fid:
+                        xml = fid.read()
+                    xml = xml.replace('<folder>{}</folder>'.format(osp.basename(part)).encode('utf-8'),
+                                      '<folder>{}</folder>'.format(self.voc_name).encode('utf-8'), 1)
+                    xml = xml.replace('<filename>{}</filename>'.format(old).encode('utf-8'),
+                                      '<filename>{}</filename>'.format(new).encode('utf-8'), 1)
+                    with open(osp.join(annodir, new + '.xml'), 'wb') as fid:
+                        fid.write(xml)
+                if stores[i] is not None:
+                    try:
+                        a = stores[i].get(old)
+                        self.store_writer.add(new, a['width'], a['height'],
+                            [{'name': stores[i].class_names[c], 'xyxy': b, 'occlusion': o}
+                             for b, c, o in zip(a['boxes'].tolist(), a['classes'], a['occlusion'])])
+                    except KeyError as e:
+                        pass
+                if old in coco_records[i]:
+                    record = json.loads(coco_records[i][old])
+                    self.coco_writer.add(new, record['width'], record['height'],
+                        [{'name': b[0], 'xyxy': b[1:]} for b in record['bboxes']], record['split'])
+            manifest.update(key, unit['stamp'], ids, unit['splits'])
+            id_map[key] = {'part': i, 'part_ids': unit['ids'], 'ids': ids}
+        self.save_manifest(manifest)
+
+        lists = manifest.split_lists(keys)
+        train_list, val_list, test_list = lists['train'], lists['val'], lists['test']
+        self.create_split(splitdir, None, train_list + val_list, test_list, train_list, val_list)
+        with open(osp.join(voc_root, 'id_map.json'), 'w') as fid:
+            json.dump(id_map, fid)
+        self.close_outputs()
+        self.write_report()
+        print("===> Successfully.")
+        print("{} parts are merged in {}".format(count, voc_root))
+        return True
+
+
+    def open_voc(self, split='trainval', cache_size=1024, use_store=False):
+        """Random access reader of a split of the converted voc tree, see VocDataset"""
+        return VocDataset(osp.join(self.root, self.voc_name), split, cache_size, use_store)
+
+
+    def export_shards(self, split='trainval', out_dir=None, maxsize=256 << 20, maxcount=10000, workers=4):
+        """Pack a split of the voc tree into tar shards, see shards.py
+
+        Each sample is <id>.jpg and <id>.json, json holds width, height,
+        bboxes, names and occlusion. Default out_dir is voc_root/shards/split.
+        """
+        if out_dir is None:
+            out_dir = osp.join(self.root, self.voc_name, 'shards', split)
+        voc = self.open_voc(split, cache_size=0)
+        samples = []
+        with self.stats.timer('read_anno'):
+            for i in range(len(voc)):
+                anno = voc.anno(i)
+                record = {'id': anno['id'], 'width': anno['width'], 'height': anno['height'],
+                          'bboxes': anno['bboxes'].tolist(), 'names': anno['names'],
+                          'occlusion': anno['occlusion'].tolist()}
+                samples.append((voc.ids[i], {'jpg': voc.imgfile(i),
+                                             'json': json.dumps(record).encode('utf-8')}))
+        with self.stats.timer('write_shards'):
+            index = shards.write_shards(samples, out_dir, self.name, maxsize, maxcount, workers)
+        print("{} samples in {} shards are saved in {}".format(index['count'], len(index['shards']), out_dir))
+        return index
+
+
     def create_split(self, splitdir, clsname, trainval_list, test_list, train_list=None, val_list=None):
         if not os.path.exists(splitdir):
             raise ValueError("{} not exist.".format(splitdir))
@@ -105,46 +349,76 @@ class Pedestrian(object):
                         fid.write(line + '\n')
 
     
-    def check_anno(self, bboxes, imgfile, imagemagick=False):
-        h, w = self.get_image_wh(imgfile, imagemagick)
-
-        # 1<= x <= w, 1 <= y <= h
-        bboxes[:, 0] = np.maximum(bboxes[:, 0], 1)
-        bboxes[:, 1] = np.maximum(bboxes[:, 1], 1)
-        bboxes[:, 2] = np.minimum(bboxes[:, 2], w)
-        bboxes[:, 3] = np.minimum(bboxes[:, 3], h)
-        
-        # delete x1 == x2, y1 == y2
-        # np.delete is not used, because bboxes is also used in for-loop
-        new_bboxes = np.array([[0, 0, 0, 0]]).astype(bboxes.dtype)
-        for i in range(bboxes.shape[0]):
-            if bboxes[i, 0] != bboxes[i, 2] and bboxes[i, 1] != bboxes[i, 3]:
-                new_bboxes = np.append(new_bboxes, 
-                                       np.expand_dims(bboxes[i], 0), 
-                                       0)
-        bboxes = new_bboxes[1:]
-
-        # x1 < x2, y1 < y2
-        new_bboxes = np.zeros_like(bboxes)
-        new_bboxes[:, 0] = np.minimum(bboxes[:, 0], bboxes[:, 2])
-        new_bboxes[:, 2] = np.maximum(bboxes[:, 0], bboxes[:, 2])
-        new_bboxes[:, 1] = np.minimum(bboxes[:, 1], bboxes[:, 3])
-        new_bboxes[:, 3] = np.maximum(bboxes[:, 1], bboxes[:, 3])
-        bboxes = new_bboxes
+    def check_anno(self, bboxes, imgfile=None, imagemagick=False, hw=None, return_mask=False):
+        """Clip boxes into image, drop degenerated ones and make x1 < x2, y1 < y2.
+
+        Args:
+            bboxes (np.ndarray): Nx4 boxes
+            imgfile (str): image path, used to get (h, w) if hw is None
+            hw (tuple or np.ndarray): (h, w), or Nx2 per-box (h, w)
+            return_mask (bool): also return keep mask of input boxes
+
+        Returns:
+            cleaned boxes, (cleaned boxes, keep mask) if return_mask
+        """
+        if hw is None:
+            hw = self.get_image_wh(imgfile, imagemagick)
+        with self.stats.timer('check_anno'):
+            bboxes, keep = clip_bboxes(bboxes, hw)
+        self.stats.count('boxes_checked', keep.shape[0])
+        if return_mask:
+            return bboxes, keep
         return bboxes
 
     
+    @property
+    def size_cache(self):
+        if self._size_cache is None:
+            self._size_cache = SizeCache(osp.join(self.root, '.imsize.json'))
+        return self._size_cache
+
+
+    def save_size_cache(self):
+        if self._size_cache is not None:
+            self._size_cache.save()
+
+
     def get_image_wh(self, imgfile, imagemagick=False):
-        if imagemagick:
-            cmd = 'identify {} | cut -d \' \' -f 3'.format(imgfile)
-            (status, output) = commands.getstatusoutput(cmd)
-            w = int(output.split('x')[0])
-            h = int(output.split('x')[1])
-        else:
-            h, w = cv2.imread(imgfile).shape[:2]
+        """Return (h, w) of image, read from image header and cached in root/.imsize.json
+
+        imagemagick (bool): fall back to `identify` if the header can not be parsed
+        """
+        with self.stats.timer('image_size'):
+            try:
+                w, h = self.size_cache.get(osp.abspath(imgfile))
+            except (IOError, OSError) as e:
+                if imagemagick:
+                    cmd = 'identify {} | cut -d \' \' -f 3'.format(imgfile)
+                    (status, output) = commands.getstatusoutput(cmd)
+                    self.stats.count('subprocess')
+                    w = int(output.split('x')[0])
+                    h = int(output.split('x')[1])
+                else:
+                    h, w = cv2.imread(imgfile).shape[:2]
+                    self.stats.count('image_decode')
+                    self.count_read(imgfile)
         return (h, w)
 
 
+    def count_read(self, path):
+        """Count a source file read whole, e.g. an annotation file, in bytes_read"""
+        self.stats.count('bytes_read', osp.getsize(path))
+
+
+    def count_bytes(self, writer):
+        """Move bytes_read and bytes_written tallied by writer into stats"""
+        for name in ('bytes_read', 'bytes_written'):
+            n = getattr(writer, name, 0)
+            if n:
+                self.stats.count(name, n)
+                setattr(writer, name, 0)
+
+
     def anno2xml(self, imgfile, anno_dict):
         """Convert anno dict to xml tree
 
@@ -159,6 +433,11 @@ class Pedestrian(object):
 
         height, width = self.get_image_wh(imgfile, imagemagick=True)
 
+        with self.stats.timer('anno2xml'):
+            return self._anno2xml(anno_dict, width, height)
+
+
+    def _anno2xml(self, anno_dict, width, height):
         E = objectify.ElementMaker(annotate=False)
         anno_tree = E.annotation(
             E.folder(self.voc_name),
@@ -196,6 +475,247 @@ class Pedestrian(object):
         return anno_tree
 
 
+    def set_xml_writer(self, kind, workers=4):
+        """Select how annotation xml files are written
+
+        Args:
+            kind (str): 'lxml', build by objectify and write on main thread
+                        'fast', build by string formatting, write in a
+                        pool of `workers` processes, same output bytes
+        """
+        if kind not in ('lxml', 'fast'):
+            raise ValueError("Unknown xml writer: {}".format(kind))
+        self.close_xml_writer()
+        self._xml_writer_kind = kind
+        self._xml_workers = workers
+
+
+    def write_xml(self, imgfile, anno_dict, xmlfile):
+        """Write anno_dict of imgfile to xmlfile with the selected writer"""
+        self.stats.count('xml')
+        self.stats.count('boxes', len(anno_dict['bboxes']))
+        if self._xml_writer_kind == 'lxml':
+            anno_tree = self.anno2xml(imgfile, anno_dict)
+            with self.stats.timer('write_xml'):
+                etree.ElementTree(anno_tree).write(xmlfile, pretty_print=True)
+            self.stats.count('bytes_written', osp.getsize(xmlfile))
+            return
+        if self._xml_writer is None:
+            self._xml_writer = VocXmlWriter(self._xml_workers)
+        height, width = self.get_image_wh(imgfile, imagemagick=True)
+        with self.stats.timer('write_xml'):
+            self._xml_writer.write(xmlfile, {'folder': self.voc_name,
+                                             'database': self.name,
+                                             'id': anno_dict['id'],
+                                             'width': width,
+                                             'height': height,
+                                             'bboxes': anno_dict['bboxes']})
+
+
+    def close_xml_writer(self):
+        """Wait until all pending xml files are written"""
+        if self._xml_writer is not None:
+            with self.stats.timer('write_xml'):
+                self._xml_writer.close()
+            self.count_bytes(self._xml_writer)
+            self._xml_writer = None
+
+
+    def set_outputs(self, *outputs):
+        """Select annotation outputs of convert2voc
+
+        Args:
+            outputs (str): 'xml', one VOC xml per image in Annotations
+                           'store', all boxes in memory-mapped arrays in
+                           voc_root/annostore, read by annostore.AnnoStore
+                           'coco', COCO instances json in voc_root/coco, one
+                           per split if coco_by_split
+        """
+        for x in outputs:
+            if x not in ('xml', 'store', 'coco'):
+                raise ValueError("Unknown output: {}".format(x))
+        self._outputs = tuple(outputs)
+
+
+    def write_anno(self, imgfile, anno_dict, xmlfile, split=None):
+        """Write annotations of one image to the selected outputs
+
+        Boxes may carry 'occlusion', kept by the store only. split is
+        used to shard coco output.
+        """
+        if 'xml' in self._outputs:
+            self.write_xml(imgfile, anno_dict, xmlfile)
+        if 'store' in self._outputs or 'coco' in self._outputs:
+            height, width = self.get_image_wh(imgfile, imagemagick=True)
+        if 'store' in self._outputs:
+            with self.stats.timer('write_store'):
+                self.store_writer.add(anno_dict['id'], width, height, anno_dict['bboxes'])
+        if 'coco' in self._outputs:
+            with self.stats.timer('write_coco'):
+                self.coco_writer.add(anno_dict['id'], width, height, anno_dict['bboxes'], split)
+
+
+    @property
+    def store_writer(self):
+        if self._store_writer is None:
+            self._store_writer = AnnoStoreWriter(osp.join(self.root, self.voc_name, 'annostore'))
+        return self._store_writer
+
+
+    @property
+    def coco_writer(self):
+        if self._coco_writer is None:
+            self._coco_writer = CocoWriter(osp.join(self.root, self.voc_name, 'coco'),
+                                           getattr(self, 'classes', ('person',)),
+                                           self.crowd_classes, self.coco_by_split)
+        return self._coco_writer
+
+
+    def open_store(self):
+        """AnnoStore written by convert2voc with 'store' output"""
+        return AnnoStore(osp.join(self.root, self.voc_name, 'annostore'))
+
+
+    def close_outputs(self):
+        """Flush all annotation outputs"""
+        self.close_xml_writer()
+        if self._store_writer is not None:
+            with self.stats.timer('write_store'):
+                self._store_writer.close()
+            self.count_bytes(self._store_writer)
+            self._store_writer = None
+        if self._coco_writer is not None:
+            with self.stats.timer('write_coco'):
+                self._coco_writer.close()
+            self.count_bytes(self._coco_writer)
+            self._coco_writer = None
+
+
+    def set_link_mode(self, mode, workers=8):
+        """How JPEGImages are created: 'symlink', 'hardlink', 'reflink' or 'copy'"""
+        self._linkfarm = LinkFarm(mode, workers)
+
+
+    def link(self, src, dst):
+        """Queue a JPEGImages entry, created by build_links()"""
+        self.stats.count('images')
+        self._linkfarm.add(src, dst)
+
+
+    def build_links(self):
+        """Create all queued links in parallel and report failures
+
+        Returns:
+            list of (src, dst, error) of failed links
+        """
+        n = len(self._linkfarm)
+        with self.stats.timer('link'):
+            failures = self._linkfarm.build()
+        self.count_bytes(self._linkfarm)
+        self.stats.count('links', n)
+        self.stats.count('link_failures', len(failures))
+        if failures:
+            print("{}/{} links failed:".format(len(failures), n))
+            for src, dst, err in failures[:10]:
+                print("    {} -> {}: {}".format(src, dst, err))
+        return failures
+
+
+    def open_manifest(self):
+        """Manifest of converted units in voc_root/manifest.json
+
+        Returns None if voc_root exists but was not converted with a manifest,
+        such a tree can not be resumed.
+        """
+        voc_root = osp.join(self.root, self.voc_name)
+        manifest_file = osp.join(voc_root, 'manifest.json')
+        if osp.exists(voc_root) and not osp.exists(manifest_file):
+            return None
+        self.create_voc()
+        return Manifest(manifest_file)
+
+
+    def remove_outputs(self, ids):
+        """Delete JPEGImages and Annotations of ids"""
+        voc_root, jpgdir, annodir, splitdir = self.create_voc()
+        for ind in ids:
+            if 'store' in self._outputs:
+                self.store_writer.remove('{:0>6}'.format(ind))
+            if 'coco' in self._outputs:
+                self.coco_writer.remove('{:0>6}'.format(ind))
+            for f in (osp.join(jpgdir, '{:0>6}.jpg'.format(ind)),
+                      osp.join(annodir, '{:0>6}.xml'.format(ind))):
+                if osp.lexists(f):
+                    os.remove(f)
+
+
+    def drop_stale_units(self, manifest, keys):
+        """Forget units whose source is gone, and delete their outputs"""
+        keys = set(keys)
+        for key in [x for x in manifest.units if x not in keys]:
+            self.remove_outputs(manifest.remove(key))
+        self.save_manifest(manifest)
+
+
+    def sync_outputs(self):
+        """Make sure every queued link, xml, store and coco record is on disk"""
+        self.build_links()
+        if self._xml_writer is not None:
+            with self.stats.timer('write_xml'):
+                self._xml_writer.wait()
+            self.count_bytes(self._xml_writer)
+        if self._store_writer is not None:
+            with self.stats.timer('write_store'):
+                self._store_writer.save()
+            self.count_bytes(self._store_writer)
+        if self._coco_writer is not None:
+            self._coco_writer.flush()
+            self.count_bytes(self._coco_writer)
+
+
+    def finish_unit(self, manifest, key, stamp, ids, splits, save=True):
+        """Mark a unit done in manifest"""
+        manifest.update(key, stamp, ids, splits)
+        if save:
+            self.save_manifest(manifest)
+
+
+    def save_manifest(self, manifest):
+        """Save manifest once outputs of its units are on disk"""
+        self.sync_outputs()
+        manifest.save()
+
+
+    def set_profile(self, profile_file):
+        """Run the hot loop of convert2voc under cProfile, stats saved to profile_file"""
+        self._profile_file = profile_file
+
+
+    def start_profile(self):
+        if self._profile_file is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+
+    def stop_profile(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._profile_file)
+            self._profiler = None
+
+
+    def write_report(self, report_file=None):
+        """Save timers and counters of the last conversion as json
+
+        Default to voc_root/convert_report.json
+        """
+        if report_file is None:
+            report_file = osp.join(self.root, self.voc_name, 'convert_report.json')
+        self.stats.dump(report_file, self.name)
+        print("Conversion report is saved in {}".format(report_file))
+        return report_file
+
+
     def create_fake_test_anno(self):
         """ Create fake annotations xml file for testset.
         """
@@ -214,8 +734,8 @@ class Pedestrian(object):
         for line in lines:
             t.update()
             imgfile = osp.join(jpgdir, '{}.jpg'.format(line))
-            anno_tree = self.anno2xml(imgfile, {"id":line, "bboxes":[]})
-            etree.ElementTree(anno_tree).write(
-                osp.join(annodir, '{:0>6}.xml'.format(line)),
-                pretty_print=True)
+            self.write_xml(imgfile, {"id":line, "bboxes":[]},
+                           osp.join(annodir, '{:0>6}.xml'.format(line)))
+        self.close_xml_writer()
+        self.save_size_cache()
         print("create_fake_test_anno successfully.")
@@ -2,16 +2,37 @@
 
 import time
 import os
+import multiprocessing
+import zipfile
 import os.path as osp
-import commands
+try:
+    import commands
+except Exception as e:
+    import subprocess as commands
 from base import Pedestrian, default_root
 import tqdm
-from vbb import SeqVbb
+from vbb import SeqVbb, source_name
+from tarindex import TarIndex
+from manifest import Manifest
 import cv2
 import numpy as np
 from lxml import etree
 
 
+_worker_ds = None
+
+def _init_worker(ds):
+    global _worker_ds
+    _worker_ds = ds
+
+
+def _scan_video(unit):
+    # stats of each video are sent back and merged by the main process
+    _worker_ds.stats.reset()
+    records = _worker_ds.scan_video(unit)
+    return records, _worker_ds.stats.state()
+
+
 class Caltech(Pedestrian):
 
     """Caltech Pedestrian Dataset
@@ -23,12 +44,25 @@ class Caltech(Pedestrian):
         self.img_filename = 'set{:0>2}.tar'
         self.anno_filename = 'annotations.zip'
         self.test_type = 'voc' # 'caltech'
+        self.workers = 1
+        self.from_archive = False
+        self._member_stamps = {}
 
     
     def set_test_type(self, test_type):
         self.test_type = test_type
         if test_type == 'caltech':
             print("Please make sure caltech/setxx/frame are deleted.")
+
+
+    def set_from_archive(self, from_archive=True):
+        """Read seq from setXX.tar and vbb from annotations.zip in place, unzip is not needed"""
+        self.from_archive = from_archive
+
+
+    def set_workers(self, workers):
+        """Number of processes to scan videos in convert2voc"""
+        self.workers = max(int(workers), 1)
             
 
     def download(self):
@@ -53,6 +87,7 @@ class Caltech(Pedestrian):
 
     
     def unzip(self):
+        """Extract setXX.tar and annotations.zip, not needed with set_from_archive"""
         imgfile = osp.join(self.root, self.img_filename)
         annofile = osp.join(self.root, self.anno_filename)
 
@@ -72,8 +107,10 @@ class Caltech(Pedestrian):
         print("===> Successfully.")
 
 
-    def create_xml(self, bboxes, imgfile, cnt, annodir):
-        bboxes = self.check_anno(bboxes, imgfile)
+    def create_xml(self, bboxes, imgfile, cnt, annodir, checked=False, occl=None, split=None):
+        if not checked:
+            bboxes, keep = self.check_anno(bboxes, imgfile, return_mask=True)
+            occl = None if occl is None else np.asarray(occl)[keep]
 
         if isinstance(bboxes, np.ndarray):
             bboxes = bboxes.tolist()
@@ -82,99 +119,237 @@ class Caltech(Pedestrian):
         anno_dict = {}
         anno_dict['id'] = "{:0>6}".format(cnt)
         anno_dict['bboxes'] = []
-        for bbox in bboxes:
-            anno_dict['bboxes'].append({'name':'person', 'xyxy':bbox})
-        anno_tree = self.anno2xml(imgfile, anno_dict)
-        etree.ElementTree(anno_tree).write(
-            osp.join(annodir, '{:0>6}.xml'.format(cnt)),
-            pretty_print=True)
+        occl = [0] * len(bboxes) if occl is None else [int(x) for x in occl]
+        for bbox, o in zip(bboxes, occl):
+            anno_dict['bboxes'].append({'name':'person', 'xyxy':bbox, 'occlusion':o})
+        self.write_anno(imgfile, anno_dict, osp.join(annodir, '{:0>6}.xml'.format(cnt)), split)
         return True
 
 
-    def convert2voc(self):
-        if os.path.exists(osp.join(self.root, self.voc_name)):
-            print('caltech_voc already exists')
-            return False
-        voc_root, jpgdir, annodir, splitdir = self.create_voc()
-
-        print('===>')
-        print('This may take some time...')
-
-        parser = SeqVbb()
-
-        train_list = []
-        val_list = []
-        test_list = []
-        cnt = 1
+    def video_units(self):
+        """Source units of conversion, one per video: (set index, setid, seq, vbb)
 
+        seq and vbb are (archive, member name) if from_archive
+        """
+        if self.from_archive:
+            return self.archive_units()
+        units = []
         for i in range(11):
             setid = 'set{:0>2}'.format(i)
             seqdir = osp.join(self.root, setid)
             vbbdir = osp.join(self.root, "annotations", setid)
-            framedir = osp.join(seqdir, 'frame') 
-
-            print('parsing '+setid)
             vbbs = sorted([osp.join(vbbdir, x) for x in sorted(os.listdir(vbbdir)) if x.endswith('.vbb')])
-            # parse seq to jpg, saved in setxx/frame
+            seqs = sorted([osp.join(seqdir, x) for x in sorted(os.listdir(seqdir)) if x.endswith('.seq')])
+            for seq, vbb in zip(seqs, vbbs):
+                units.append((i, setid, seq, vbb))
+        return units
+
+
+    def archive_units(self):
+        annofile = osp.join(self.root, self.anno_filename)
+        with zipfile.ZipFile(annofile, 'r') as zf:
+            members = sorted(x for x in zf.namelist() if x.endswith('.vbb'))
+            # stamps of members, read once for unit_stamp
+            for x in members:
+                self._member_stamps[(annofile, x)] = list(zf.getinfo(x).date_time)
+        units = []
+        for i in range(11):
+            setid = 'set{:0>2}'.format(i)
+            tar_file = osp.join(self.root, self.img_filename.format(i))
+            index = TarIndex(tar_file)
+            seqs = index.names('.seq')
+            for x in seqs:
+                self._member_stamps[(tar_file, x)] = index.mtime(x)
+            vbbs = [x for x in members if x.split('/')[-2] == setid]
+            for seq, vbb in zip(seqs, vbbs):
+                units.append((i, setid, (tar_file, seq), (annofile, vbb)))
+        return units
+
+
+    def unit_key(self, unit):
+        i, setid, seq, vbb = unit
+        return setid + '/' + osp.splitext(osp.basename(source_name(seq)))[0]
+
+
+    def unit_stamp(self, unit):
+        i, setid, seq, vbb = unit
+        if self.from_archive:
+            if seq not in self._member_stamps or vbb not in self._member_stamps:
+                self.archive_units()
+            stamp = {'seq': [seq[1], self._member_stamps[seq]],
+                     'vbb': [vbb[1], self._member_stamps[vbb]]}
+        else:
+            stamp = Manifest.mtimes(seq, vbb)
+        stamp['test_type'] = self.test_type
+        return stamp
+
+
+    def scan_video(self, unit):
+        """Extract frames of one video to setxx/frame and check their boxes
+
+        Returns:
+            list of (imgfile, bboxes, occl), bboxes and occl are None if no
+            annotation is needed
+        """
+        i, setid, seq, vbb = unit
+        parser = SeqVbb()
+        videoid = osp.splitext(osp.basename(source_name(seq)))[0]
+        framedir = osp.join(self.root, setid, 'frame')
+        if not osp.exists(framedir):
+            try:
+                os.makedirs(framedir)
+            except OSError as e:
+                # created by a worker scanning another video of the set
+                if not osp.isdir(framedir):
+                    raise
+
+        # columnar annotations, parsed once and cached in .vbb.npz
+        with self.stats.timer('readvbb'):
+            anno = parser.loadvbb(vbb)
+
+        # parse seq to jpg, saved in setxx/frame
+        if self.test_type == 'caltech' and i > 5:
+            frame_index = lambda index: index % 30 == 0 # parse every 30-th image
+        elif self.test_type == 'voc':
+            frame_index = anno.frames() # only parse image with label
+        else:
+            frame_index = None
+        if frame_index is not None:
+            seq_mtime = os.stat(seq[0] if self.from_archive else seq).st_mtime
+            imgs = parser.readseq(seq, setid, stream=True, raw=True, frame_index=frame_index)
+            # jpg in seq is copied as it is, no decode and re-encode
+            while True:
+                with self.stats.timer('readseq'):
+                    key, data = next(imgs, (None, None))
+                if key is None:
+                    break
+                self.stats.count('bytes_read', len(data))
+                imgfile = osp.join(framedir, key)
+                if osp.exists(imgfile) and os.stat(imgfile).st_mtime >= seq_mtime:
+                    continue
+                with self.stats.timer('write_frames'):
+                    # renamed into place, a killed run leaves no truncated jpg
+                    # newer than the seq
+                    tmpfile = imgfile + '.tmp'
+                    with open(tmpfile, 'wb') as fid:
+                        fid.write(data)
+                    getattr(os, 'replace', os.rename)(tmpfile, imgfile)
+                self.stats.count('bytes_written', len(data))
+
+        head = setid + '_' + videoid + '_'
+        imgfiles = sorted([osp.join(framedir, x) for x in os.listdir(framedir) if x.startswith(head) and x.endswith('.jpg')])
+
+        records = []
+        for imgfile in imgfiles:
+            if self.test_type == 'voc' or \
+              (self.test_type == 'caltech' and i <= 5):
+                index = int(osp.splitext(osp.basename(imgfile))[0].split('_')[-1])
+                bboxes, keep = self.check_anno(anno.getbbox(index), imgfile, return_mask=True)
+                if bboxes.shape[0] < 1:
+                    continue
+                records.append((imgfile, bboxes, anno.occl[anno.select(index)][keep]))
+            else:
+                records.append((imgfile, None, None))
+        return records
+
+
+    def convert2voc(self, xml_writer=None, workers=None, shard=None, from_archive=None):
+        """Convert to voc format
+
+        Args:
+            xml_writer (str): 'lxml' or 'fast', see set_xml_writer
+            workers (int): videos are scanned (frame extraction, box checking)
+                by a pool of workers, ids and splits are still assigned in
+                video order, so output does not depend on workers.
+            shard (tuple): (index, count), convert only videos of this shard,
+                see set_shard and merge_shards
+            from_archive (bool): read setXX.tar and annotations.zip without
+                extracting them, see set_from_archive
+        """
+        if from_archive is not None:
+            self.set_from_archive(from_archive)
+        if workers is not None:
+            self.set_workers(workers)
+        if shard is not None:
+            self.set_shard(*shard)
+        manifest = self.open_manifest()
+        if manifest is None:
+            print('{} already exists'.format(self.voc_name))
+            return False
+        if xml_writer is not None:
+            self.set_xml_writer(xml_writer)
+        voc_root, jpgdir, annodir, splitdir = self.create_voc()
+
+        print('===>')
+        print('This may take some time...')
+
+        self.stats.reset()
+        units = self.video_units()
+        keys = self.shard_keys([self.unit_key(x) for x in units])
+        mine = set(keys)
+        units = [x for x in units if self.unit_key(x) in mine]
+        self.drop_stale_units(manifest, keys)
+
+        stamps = [self.unit_stamp(x) for x in units]
+        todo = [n for n, key in enumerate(keys) if not manifest.is_done(key, stamps[n])]
+        # made here, not by workers racing on the same set
+        for setid in sorted(set(units[n][1] for n in todo)):
+            framedir = osp.join(self.root, setid, 'frame')
             if not osp.exists(framedir):
                 os.makedirs(framedir)
-                seqs = sorted([osp.join(seqdir, x) for x in sorted(os.listdir(seqdir)) if x.endswith('.seq')])
-                for seq, vbb in zip(seqs, vbbs):
-                    anno = parser.readvbb(vbb, setid)
-                    if self.test_type == 'caltech' and i > 5:
-                        imgs = parser.readseq(seq, setid) # parse all images
-                    else:
-                        imgs = parser.readseq(seq, setid, anno) # only parse image with label
-
-                    # fetch_head
-                    keyname = list(imgs.keys())[0] 
-                    keyid = keyname.split('.')[0].split('_')[-1]
-                    key_loc = keyname.find(keyid)
-                    key_head = keyname[:key_loc]
-                    keyinds = sorted(['{:0>6}'.format(x.split('.')[0].split('_')[-1]) for x in imgs.keys()])
-                    # each seq contains many images
-                    for ind in range(len(imgs.keys())):
-                        if self.test_type == 'voc' or \
-                          (self.test_type == 'caltech' and i > 5 and (ind+1) % 30 == 0): 
-                            key = key_head + str(int(keyinds[ind])) + '.jpg'
-                            cv2.imwrite(osp.join(framedir, key), imgs[key])
-
-            # parse annotations
-            annos = {}
-            for vbb in vbbs:
-                anno = parser.readvbb(vbb, setid)
-                annos.update(anno)
-
-            # save to voc
-            imgfiles = sorted([os.path.join(framedir, x) for x in sorted(os.listdir(framedir)) if x.endswith('.jpg')])
-
-            t = tqdm.tqdm()
-            t.total = len(imgfiles)
-
-            for imgfile in imgfiles:
+
+        t = tqdm.tqdm()
+        t.total = len(todo)
+
+        self.start_profile()
+        pool = None
+        if self.workers > 1 and len(todo) > 1:
+            pool = multiprocessing.Pool(self.workers, _init_worker, (self,))
+            scanned = pool.imap(_scan_video, [units[n] for n in todo])
+        else:
+            scanned = ((self.scan_video(units[n]), None) for n in todo)
+
+        finished = False
+        try:
+            # results come back in video order, so are ids
+            for n, (records, state) in zip(todo, scanned):
                 t.update()
-                key = osp.basename(imgfile)
-                # Annotations
-                if self.test_type == 'voc' or \
-                  (self.test_type == 'caltech' and i <= 5):
-                    bboxes = parser.getbbox(annos[key])
-                    ret = self.create_xml(bboxes, imgfile, cnt, annodir)
-                    if not ret:
-                        continue
-                # JPEGImages
-                cmd = 'ln -s {} {}'.format(
-                    imgfile,
-                    osp.join(jpgdir, '{:0>6}.jpg'.format(cnt)))
-                (status, output) = commands.getstatusoutput(cmd)
+                if state is not None:
+                    self.stats.merge(state)
+                key, unit, stamp = keys[n], units[n], stamps[n]
+                i = unit[0]
+                ids, released = manifest.assign(key, len(records))
+                self.remove_outputs(released)
+
+                splits = []
                 # ImageSets/Main
                 if i < 5:
-                    train_list.append("{:0>6}".format(cnt))
+                    split = 'train'
                 elif i == 5:
-                    val_list.append("{:0>6}".format(cnt))
+                    split = 'val'
+                else:
+                    split = 'test'
+                for cnt, (imgfile, bboxes, occl) in zip(ids, records):
+                    # Annotations
+                    if bboxes is not None:
+                        self.create_xml(bboxes, imgfile, cnt, annodir, checked=True, occl=occl, split=split)
+                    # JPEGImages
+                    self.link(imgfile, osp.join(jpgdir, '{:0>6}.jpg'.format(cnt)))
+                    splits.append(split)
+                self.finish_unit(manifest, key, stamp, ids, splits)
+            finished = True
+        finally:
+            # a failed worker or write must not leave the pool running
+            if pool is not None:
+                if finished:
+                    pool.close()
                 else:
-                    test_list.append("{:0>6}".format(cnt))
-                cnt += 1
+                    pool.terminate()
+                pool.join()
+        self.stop_profile()
 
+        lists = manifest.split_lists(keys)
+        train_list, val_list, test_list = lists['train'], lists['val'], lists['test']
         trainval_list = train_list + val_list
         self.create_split(splitdir, None, 
                 trainval_list, 
@@ -182,6 +357,9 @@ class Caltech(Pedestrian):
                 train_list,
                 val_list)
 
+        self.close_outputs()
+        self.save_size_cache()
+        self.write_report()
         print("===> Successfully.")
         print("Caltech in voc-format is saved in {}".format(voc_root))
         return True
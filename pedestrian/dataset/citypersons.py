@@ -4,6 +4,7 @@ import os
 import os.path as osp
 from scipy.io import loadmat
 import glob
+import hashlib
 import numpy as np
 import tqdm
 from lxml import etree
@@ -24,6 +25,7 @@ class CityPersons(Pedestrian):
         super(CityPersons, self).__init__('citypersons', root)
         self.classes = ('ignore', 'pedestrian', 'rider', 'sitting', 'otherperson', 'peoplegroup')
         self.index_to_class = dict(zip(range(len(self.classes)), self.classes))
+        self.crowd_classes = ('ignore', 'peoplegroup')
 
 
     def download(self):
@@ -34,92 +36,129 @@ class CityPersons(Pedestrian):
         print("Do it by yourself.")
 
 
-    def convert2voc(self):
-        if os.path.exists(osp.join(self.root, self.voc_name)):
-            return False
-        voc_root, jpgdir, annodir, splitdir = self.create_voc()
-
-        if not os.path.exists(os.path.join(self.root, 'leftImg8bit')):
-            raise IOError('Image not found, please download and unzip')
-
-        train_list = []
-        val_list = []
-        test_list = []
-
-        train_imgdir = osp.join(self.root, 'leftImg8bit/train')
-        val_imgdir = osp.join(self.root, 'leftImg8bit/val')
-        test_imgdir = osp.join(self.root, 'leftImg8bit/test')
-
-        train_annos = loadmat(osp.join(self.root, 'shanshanzhang-citypersons/annotations/anno_train.mat'))
-        val_annos = loadmat(osp.join(self.root, 'shanshanzhang-citypersons/annotations/anno_val.mat'))
-
-        t = tqdm.tqdm()
-        t.total = train_annos['anno_train_aligned'].shape[1] + \
-                  val_annos['anno_val_aligned'].shape[1]
+    def city_units(self):
+        """Source units of conversion, one per city of each phase
 
-        ind = 1
+        Returns:
+            list of (phase, cityname, [(imgfile, bbs), ...]), bbs is None for test
+        """
+        units = []
         for phase in ('train', 'val'):
-            annos_mat = train_annos if phase is 'train' else val_annos 
-            imgdir = train_imgdir if phase is 'train' else val_imgdir
-
+            imgdir = osp.join(self.root, 'leftImg8bit', phase)
+            matfile = osp.join(self.root, 'shanshanzhang-citypersons/annotations/anno_{}.mat'.format(phase))
+            annos_mat = loadmat(matfile)
+            self.count_read(matfile)
+            cities = {}
             for anno in annos_mat['anno_{}_aligned'.format(phase)][0]:
-                t.update()
-
                 cityname = str(anno[0][0][0][0])
                 imgname = str(anno[0][0][1][0])
-                imgfile = osp.join(imgdir, cityname, imgname)
+                if cityname not in cities:
+                    cities[cityname] = (phase, cityname, [])
+                    units.append(cities[cityname])
+                cities[cityname][2].append((osp.join(imgdir, cityname, imgname), anno[0][0][2]))
 
-                anno_dict = {}
-                anno_dict['id'] = '{:0>6}'.format(ind)
-                anno_dict['bboxes'] = []
-
-                for bbox_anno in anno[0][0][2]:
-                    clsname = self.index_to_class[bbox_anno[0]]
-                    bbox = bbox_anno[1:5] # using (x1, y1, w, h) rather than (x1_vis, ...)
-                    bbox[2:] += bbox[:2] # (x,y,w,h) -> (x1,y1,x2,y2)
+        # craete ImageSets JPEGImage for testset
+        test_imgdir = osp.join(self.root, 'leftImg8bit/test')
+        for cityname in sorted(os.listdir(test_imgdir)):
+            test_imgs = sorted(glob.glob(osp.join(test_imgdir, cityname, '*.png')))
+            units.append(('test', cityname, [(x, None) for x in test_imgs]))
+        return units
+
+
+    def unit_stamp(self, unit):
+        """Digest of image names and boxes of a unit"""
+        md5 = hashlib.md5()
+        for imgfile, bbs in unit[2]:
+            md5.update(imgfile.encode('utf-8'))
+            if bbs is not None:
+                md5.update(np.ascontiguousarray(bbs, dtype=np.float64).tobytes())
+        return {'anno': md5.hexdigest()}
+
+
+    def convert2voc(self, xml_writer=None, shard=None):
+        """Convert to voc format
+
+        Args:
+            shard (tuple): (index, count), convert only cities of this shard,
+                see set_shard and merge_shards
+        """
+        if shard is not None:
+            self.set_shard(*shard)
+        manifest = self.open_manifest()
+        if manifest is None:
+            return False
+        if xml_writer is not None:
+            self.set_xml_writer(xml_writer)
+        voc_root, jpgdir, annodir, splitdir = self.create_voc()
 
-                    bbox_checked = self.check_anno(np.array([bbox]), imgfile, imagemagick=True)
-                    if bbox_checked.shape[0] < 1:
-                        continue
-                    bbox_checked = bbox_checked[0]
+        if not os.path.exists(os.path.join(self.root, 'leftImg8bit')):
+            raise IOError('Image not found, please download and unzip')
 
-                    anno_dict['bboxes'].append({'name':clsname, 'xyxy': bbox_checked.tolist()})
+        self.stats.reset()
+        with self.stats.timer('read_anno'):
+            units = self.city_units()
+        keys = [phase + '/' + cityname for phase, cityname, _ in units]
+        mine = set(self.shard_keys(keys))
+        units = [x for key, x in zip(keys, units) if key in mine]
+        keys = [x for x in keys if x in mine]
+        self.drop_stale_units(manifest, keys)
 
-                if len(anno_dict['bboxes']) == 0:
+        t = tqdm.tqdm()
+        t.total = sum(len(x[2]) for x in units)
+
+        self.start_profile()
+        for key, unit in zip(keys, units):
+            phase, cityname, items = unit
+            stamp = self.unit_stamp(unit)
+            if manifest.is_done(key, stamp):
+                t.update(len(items))
+                continue
+
+            records = []
+            for imgfile, bbs in items:
+                t.update()
+                if bbs is None:
+                    records.append((imgfile, None))
                     continue
 
-                anno_tree = self.anno2xml(imgfile, anno_dict)
-                etree.ElementTree(anno_tree).write(
-                    osp.join(annodir, '{:0>6}.xml'.format(ind)),
-                    pretty_print=True)
-
-                cmd = 'ln -s {} {}'.format(
-                        imgfile,
-                        osp.join(jpgdir, '{:0>6}.jpg'.format(ind)))
-                (status, output) = commands.getstatusoutput(cmd)
+                bboxes_list = []
+                if bbs.shape[0] > 0:
+                    bboxes = np.array(bbs[:, 1:5]) # using (x1, y1, w, h) rather than (x1_vis, ...)
+                    bboxes[:, 2:] += bboxes[:, :2] # (x,y,w,h) -> (x1,y1,x2,y2)
 
-                if phase is 'train':
-                    train_list.append('{:0>6}'.format(ind))
-                else:
-                    val_list.append('{:0>6}'.format(ind))
-                ind += 1
-
-        # craete ImageSets JPEGImage for testset
-        phase = 'test'
-        test_imgs = glob.glob(test_imgdir+'/*/*.png')
-        for imgfile in test_imgs:
-            cmd = 'ln -s {} {}'.format(
-                    imgfile,
-                    osp.join(jpgdir, '{:0>6}.jpg'.format(ind)))
-            (status, output) = commands.getstatusoutput(cmd)
-            test_list.append('{:0>6}'.format(ind))
-            ind += 1
+                    # check all boxes of the image at once
+                    bboxes, keep = self.check_anno(bboxes, imgfile, imagemagick=True, return_mask=True)
+                    for cls_ind, bbox in zip(bbs[keep, 0], bboxes.tolist()):
+                        clsname = self.index_to_class[cls_ind]
+                        bboxes_list.append({'name':clsname, 'xyxy': bbox})
 
+                if len(bboxes_list) == 0:
+                    continue
+                records.append((imgfile, bboxes_list))
+
+            ids, released = manifest.assign(key, len(records))
+            self.remove_outputs(released)
+            for ind, (imgfile, bboxes_list) in zip(ids, records):
+                if bboxes_list is not None:
+                    anno_dict = {}
+                    anno_dict['id'] = '{:0>6}'.format(ind)
+                    anno_dict['bboxes'] = bboxes_list
+                    self.write_anno(imgfile, anno_dict, osp.join(annodir, '{:0>6}.xml'.format(ind)), phase)
+
+                self.link(imgfile, osp.join(jpgdir, '{:0>6}.jpg'.format(ind)))
+            self.finish_unit(manifest, key, stamp, ids, [phase] * len(ids))
+        self.stop_profile()
+
+        lists = manifest.split_lists(keys)
+        train_list, val_list, test_list = lists['train'], lists['val'], lists['test']
         trainval_list = train_list + val_list
         self.create_split(splitdir, None, 
                 trainval_list, test_list,
                 train_list, val_list)
 
+        self.close_outputs()
+        self.save_size_cache()
+        self.write_report()
         print("===> Successfully.")
         print("Caltech in voc-format is saved in {}".format(voc_root))
         return True
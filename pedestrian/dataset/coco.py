@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming COCO json writer.
+
+Records are appended to a json-lines log as they come, the COCO files are
+stitched from the log at close, one image at a time, so neither step holds
+the whole document in memory. A later record of the same image replaces
+the earlier one, which makes the log safe to append across resumed runs.
+"""
+
+import os
+import json
+
+
+class CocoWriter(object):
+
+    """Write anno_dict records as COCO instances json
+
+    Output, in out_dir:
+        instances_<split>.json, one per split if by_split, else instances.json,
+            file_name of images is relative to JPEGImages
+        records.jsonl, the log they are stitched from
+
+    Args:
+        categories (list): category names, id is position + 1, names not
+            listed get ids after them in order of appearance
+        crowd (list): category names written with iscrowd=1, e.g. ignore
+            regions and groups of people
+    """
+
+    def __init__(self, out_dir, categories=('person',), crowd=(), by_split=True):
+        self.out_dir = out_dir
+        self.categories = list(categories)
+        self.crowd = set(crowd)
+        self.by_split = by_split
+        self.log_file = os.path.join(out_dir, 'records.jsonl')
+        self._fid = None
+        self.bytes_written = 0
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+
+    def _log(self, record):
+        if self._fid is None:
+            self._fid = open(self.log_file, 'a')
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        self._fid.write(line)
+        self.bytes_written += len(line)
+
+
+    def add(self, image_id, width, height, bboxes, split=None):
+        """
+        Args:
+            image_id (str): e.g. '000001', image is <image_id>.jpg
+            bboxes (list): [{'name':'person', 'xyxy':[], 'occlusion':0}, ...]
+        """
+        self._log({'id': image_id, 'split': split or 'all', 'width': int(width), 'height': int(height),
+                   'bboxes': [[b['name']] + [int(x) for x in b['xyxy']] for b in bboxes]})
+
+
+    def remove(self, image_id):
+        self._log({'id': image_id, 'removed': True})
+
+
+    def flush(self):
+        if self._fid is not None:
+            self._fid.flush()
+
+
+    def _index(self):
+        """{image id: offset of its latest record in the log}"""
+        index = {}
+        if not os.path.exists(self.log_file):
+            return index
+        with open(self.log_file, 'rb') as fid:
+            offset = 0
+            for line in fid:
+                record = json.loads(line.decode('utf-8'))
+                if record.get('removed'):
+                    index.pop(record['id'], None)
+                else:
+                    index[record['id']] = offset
+                offset += len(line)
+        return index
+
+
+    def close(self):
+        """Stitch COCO files from the log, and compact the log"""
+        if self._fid is not None:
+            self._fid.close()
+            self._fid = None
+        index = self._index()
+        ids = sorted(index.keys())
+        categories = list(self.categories)
+
+        tmpfile = self.log_file + '.tmp'
+        writers = {}
+        with open(self.log_file, 'rb') as log, open(tmpfile, 'wb') as compact:
+            for image_id in ids:
+                log.seek(index[image_id])
+                line = log.readline()
+                compact.write(line)
+                record = json.loads(line.decode('utf-8'))
+                split = record['split'] if self.by_split else 'all'
+                if split not in writers:
+                    writers[split] = SplitWriter(self._split_file(split))
+                writers[split].add(record, categories, self.crowd)
+        os.rename(tmpfile, self.log_file)
+        self.bytes_written += os.path.getsize(self.log_file)
+
+        files = []
+        for split in sorted(writers):
+            files.append(writers[split].close(categories))
+            self.bytes_written += os.path.getsize(files[-1])
+        # splits left without images
+        for f in os.listdir(self.out_dir):
+            f = os.path.join(self.out_dir, f)
+            if f.endswith('.json') and f not in files:
+                os.remove(f)
+        return files
+
+
+    def _split_file(self, split):
+        name = 'instances.json' if split == 'all' else 'instances_{}.json'.format(split)
+        return os.path.join(self.out_dir, name)
+
+
+class SplitWriter(object):
+
+    """Images and annotations of one COCO file, each in a temp file until close"""
+
+    def __init__(self, jsonfile):
+        self.jsonfile = jsonfile
+        self.images = open(jsonfile + '.images.tmp', 'w')
+        self.annotations = open(jsonfile + '.annotations.tmp', 'w')
+        self.ann_id = 0
+
+
+    def add_image(self, image, annotations=()):
+        """Write COCO dicts of one image and its annotations as they are"""
+        self.images.write(',\n' if self.images.tell() else '')
+        self.images.write(json.dumps(image))
+        for ann in annotations:
+            self.annotations.write(',\n' if self.annotations.tell() else '')
+            self.annotations.write(json.dumps(ann))
+
+
+    def add(self, record, categories, crowd):
+        image_id = int(record['id'])
+        annotations = []
+        for name, x1, y1, x2, y2 in record['bboxes']:
+            if name not in categories:
+                categories.append(name)
+            self.ann_id += 1
+            w, h = x2 - x1, y2 - y1
+            annotations.append({'id': self.ann_id,
+                                'image_id': image_id,
+                                'category_id': categories.index(name) + 1,
+                                'bbox': [x1, y1, w, h],
+                                'area': w * h,
+                                'iscrowd': int(name in crowd)})
+        self.add_image({'id': image_id,
+                        'file_name': '{}.jpg'.format(record['id']),
+                        'width': record['width'],
+                        'height': record['height']}, annotations)
+
+
+    def close(self, categories):
+        """Stitch the COCO file, categories are names, id is position + 1, or COCO dicts"""
+        tmpfile = self.jsonfile + '.tmp'
+        with open(tmpfile, 'w') as fid:
+            fid.write('{"images": [\n')
+            for part in (self.images, self.annotations):
+                part.close()
+                with open(part.name, 'r') as src:
+                    for line in src:
+                        fid.write(line)
+                os.remove(part.name)
+                fid.write('\n],\n"annotations": [\n' if part is self.images else '\n],\n')
+            fid.write('"categories": ')
+            json.dump([x if isinstance(x, dict) else {'id': i + 1, 'name': x}
+                       for i, x in enumerate(categories)], fid)
+            fid.write('}\n')
+        os.rename(tmpfile, self.jsonfile)
+        return self.jsonfile
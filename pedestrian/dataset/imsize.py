@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Get image size from file header, without decoding pixels.
+"""
+
+import os
+import json
+import struct
+from PIL import Image
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# SOFn markers, except DHT(C4), JPG(C8) and DAC(CC)
+JPEG_SOF = set([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+
+def _jpeg_size(fid):
+    fid.seek(2)
+    while True:
+        byte = fid.read(1)
+        while byte and byte != b'\xff':
+            byte = fid.read(1)
+        while byte == b'\xff':
+            byte = fid.read(1)
+        if not byte:
+            return None
+        marker = ord(byte)
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue # markers without length
+        if marker == 0xD9 or marker == 0xDA:
+            return None # EOI or start of scan before any SOF
+        length = struct.unpack('>H', fid.read(2))[0]
+        if marker in JPEG_SOF:
+            h, w = struct.unpack('>xHH', fid.read(5))
+            return w, h
+        fid.seek(length - 2, 1)
+
+
+def image_size(imgfile):
+    """Return (w, h) of image by reading its header only
+
+    PNG and JPEG are parsed directly, other formats fall back to PIL, which
+    also stops at the header.
+    """
+    with open(imgfile, 'rb') as fid:
+        head = fid.read(26)
+        if head[:8] == PNG_SIGNATURE and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'\xff\xd8':
+            try:
+                size = _jpeg_size(fid)
+            except struct.error as e:
+                size = None
+            if size is not None:
+                return size
+    img = Image.open(imgfile)
+    return img.size
+
+
+class SizeCache(object):
+
+    """On-disk cache of image size, keyed by path and mtime"""
+
+    def __init__(self, cachefile):
+        self.cachefile = cachefile
+        self._sizes = {}
+        self._dirty = False
+        if os.path.exists(cachefile):
+            try:
+                with open(cachefile, 'r') as fid:
+                    self._sizes = json.load(fid)
+            except ValueError as e:
+                self._sizes = {}
+
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+    def get(self, imgfile):
+        """Return (w, h) of imgfile"""
+        mtime = os.stat(imgfile).st_mtime
+        item = self._sizes.get(imgfile)
+        if item is not None and item[0] == mtime:
+            return item[1], item[2]
+        w, h = image_size(imgfile)
+        self._sizes[imgfile] = [mtime, w, h]
+        self._dirty = True
+        return w, h
+
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmpfile = self.cachefile + '.tmp'
+        with open(tmpfile, 'w') as fid:
+            json.dump(self._sizes, fid)
+        os.rename(tmpfile, self.cachefile)
+        self._dirty = False
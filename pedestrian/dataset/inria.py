@@ -3,6 +3,7 @@
 import os
 import os.path as osp
 from base import Pedestrian, default_root
+from manifest import Manifest
 import re
 from lxml import etree
 import tqdm
@@ -62,14 +63,16 @@ class INRIAPerson(Pedestrian):
         return output
 
 
-    def convert2voc(self):
-        if os.path.exists(osp.join(self.root, self.voc_name)):
-            return
+    def convert2voc(self, xml_writer=None):
+        """Convert to voc format, an interrupted conversion is resumed"""
+        manifest = self.open_manifest()
+        if manifest is None:
+            print('{} already exists'.format(self.voc_name))
+            return False
+        if xml_writer is not None:
+            self.set_xml_writer(xml_writer)
         voc_root, jpgdir, annodir, splitdir = self.create_voc()
 
-        trainval_list = []
-        test_list = []
-
         train_pos_img_list = osp.join(self.root, 'Train/pos.lst')
         train_anno_list = osp.join(self.root, 'Train/annotations.lst')
 
@@ -88,37 +91,52 @@ class INRIAPerson(Pedestrian):
         if len(jpgfiles) != len(annofiles):
             raise (ValueError, "len of image({}) != len of anno({})".format(len(jpgfiles), len(annofiles)))
 
+        # each image is a unit, its id is always ind+1
+        keys = ['{}/{:0>6}'.format('train' if ind < sum_train else 'test', ind) for ind in range(len(jpgfiles))]
+        self.drop_stale_units(manifest, keys)
+
+        self.stats.reset()
         t = tqdm.tqdm()
         t.total = len(jpgfiles)
 
+        self.start_profile()
         for ind, (jpg, xml) in enumerate(zip(jpgfiles, annofiles)):
+            t.update()
+            if ind % 1000 == 0:
+                self.save_manifest(manifest)
+            key = keys[ind]
+            split = 'test' if ind >= sum_train else 'trainval'
+            stamp = Manifest.mtimes(jpg, xml)
+            stamp['split'] = split
+            if manifest.is_done(key, stamp):
+                continue
+            self.remove_outputs(manifest.ids(key))
+
             ind += 1
-            cmd = 'ln -s {} {}'.format(
-                    jpg,
-                    osp.join(jpgdir, '{:0>6}.jpg'.format(ind)))
-            (status, output) = commands.getstatusoutput(cmd)
+            self.link(jpg, osp.join(jpgdir, '{:0>6}.jpg'.format(ind)))
 
-            bboxes = self._parse_lst(xml)
+            with self.stats.timer('read_anno'):
+                bboxes = self._parse_lst(xml)
+            self.count_read(xml)
             anno_dict = {}
             anno_dict['id'] = '{:0>6}'.format(ind)
             anno_dict['bboxes'] = []
             for box in bboxes:
                 anno_dict['bboxes'].append({'name':'person', 'xyxy': box})
-            anno_tree = self.anno2xml(jpg, anno_dict)
-            etree.ElementTree(anno_tree).write(
-                osp.join(annodir, '{:0>6}.xml'.format(ind)),
-                pretty_print=True)
-
-            if ind > sum_train:
-                test_list.append('{:0>6}'.format(ind))
-            else:
-                trainval_list.append('{:0>6}'.format(ind))
-            t.update()
+            self.write_anno(jpg, anno_dict, osp.join(annodir, '{:0>6}.xml'.format(ind)), split)
+            self.finish_unit(manifest, key, stamp, [ind], [split], save=False)
+        self.save_manifest(manifest)
+        self.stop_profile()
 
-        self.create_split(splitdir, None, trainval_list, test_list)
+        lists = manifest.split_lists(keys, ('trainval', 'test'))
+        self.create_split(splitdir, None, lists['trainval'], lists['test'])
 
+        self.close_outputs()
+        self.save_size_cache()
+        self.write_report()
         print("===> Successfully.")
         print("Caltech in voc-format is saved in {}".format(voc_root))
+        return True
 
 
     def eval(self):
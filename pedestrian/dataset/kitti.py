@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from base import Pedestrian, default_root
+from manifest import Manifest
 import os
 import os.path as osp
 from scipy.io import loadmat
@@ -32,19 +33,26 @@ class Kitti(Pedestrian):
         print("Do it by yourself.")
 
 
-    def convert2voc(self):
-        if os.path.exists(osp.join(self.root, self.voc_name)):
-            print('kitti_voc already exists')
+    def convert2voc(self, xml_writer=None, shard=None):
+        """Convert to voc format
+
+        Args:
+            shard (tuple): (index, count), convert only images of this shard,
+                see set_shard and merge_shards
+        """
+        if shard is not None:
+            self.set_shard(*shard)
+        manifest = self.open_manifest()
+        if manifest is None:
+            print('{} already exists'.format(self.voc_name))
             return False
+        if xml_writer is not None:
+            self.set_xml_writer(xml_writer)
         voc_root, jpgdir, annodir, splitdir = self.create_voc()
 
         if not os.path.exists(os.path.join(self.root, 'training/image_2')):
             raise IOError('Image not found, please download and unzip')
 
-        train_list = []
-        val_list = []
-        test_list = []
-
         train_img = osp.join(self.root, 'training/image_2/{:0>6}.png')
         train_anno = osp.join(self.root, 'training/label_2/{:0>6}.txt')
         test_img = osp.join(self.root, 'testing/image_2/{:0>6}.png')
@@ -52,56 +60,88 @@ class Kitti(Pedestrian):
         sum_train = len(os.listdir(osp.join(self.root, 'training/image_2')))
         sum_test = len(os.listdir(osp.join(self.root, 'testing/image_2')))
 
+        # each image is a unit, its id is always ind+1
+        keys = ['training/{:0>6}'.format(ind) if ind < sum_train else \
+                'testing/{:0>6}'.format(ind-sum_train) for ind in range(sum_train + sum_test)]
+        mine = set(self.shard_keys(keys, global_ids=True))
+        self.drop_stale_units(manifest, mine)
+
+        self.stats.reset()
         t = tqdm.tqdm()
         t.total = sum_train + sum_test
 
+        self.start_profile()
         for ind in range(sum_train + sum_test):
             t.update()
+            if ind % 1000 == 0:
+                self.save_manifest(manifest)
+            key = keys[ind]
+            if key not in mine:
+                continue
             imgfile = train_img.format(ind) if ind < sum_train else \
                       test_img.format(ind-sum_train)
+            # ImageSets/Main
+            if ind < int(sum_train * self.train_val_ratio):
+                split = 'train'
+            elif ind < sum_train:
+                split = 'val'
+            else:
+                split = 'test'
+            sources = [imgfile, train_anno.format(ind)] if ind < sum_train else [imgfile]
+            stamp = Manifest.mtimes(*sources)
+            stamp['split'] = split
+            if manifest.is_done(key, stamp):
+                continue
+            self.remove_outputs(manifest.ids(key))
+
             # Annotations
             if ind < sum_train:
                 annofile = train_anno.format(ind)
-                anno_lines = [x.strip() for x in open(annofile, 'r').readlines()]
+                with self.stats.timer('read_anno'):
+                    anno_lines = [x.strip() for x in open(annofile, 'r').readlines()]
+                self.count_read(annofile)
 
                 anno_dict = {}
                 anno_dict['id'] = '{:0>6}'.format(ind+1)
                 anno_dict['bboxes'] = []
 
+                clsnames = []
+                bboxes = []
+                occls = []
                 for anno in anno_lines:
                     anno = anno.split(' ')
                     clsname = anno[0].lower()
                     if clsname not in self.classes:
                         continue
-                    
-                    bbox = [int(float(x)) for x in anno[4:8]] 
-                    bbox_checked = self.check_anno(np.array([bbox]), imgfile, imagemagick=True)
-                    if bbox_checked.shape[0] < 1:
-                        continue
-                    bbox_checked = bbox_checked[0]
-                    anno_dict['bboxes'].append({'name':clsname, 'xyxy': bbox_checked.tolist()})
+                    clsnames.append(clsname)
+                    bboxes.append([int(float(x)) for x in anno[4:8]])
+                    occls.append(int(anno[2]))
+
+                # check all boxes of the image at once
+                if len(bboxes) > 0:
+                    bboxes, keep = self.check_anno(np.array(bboxes), imgfile, imagemagick=True, return_mask=True)
+                    clsnames = [x for x, k in zip(clsnames, keep) if k]
+                    occls = [x for x, k in zip(occls, keep) if k]
+                    for clsname, bbox, occl in zip(clsnames, bboxes.tolist(), occls):
+                        anno_dict['bboxes'].append({'name':clsname, 'xyxy': bbox, 'occlusion': occl})
                 if len(anno_dict['bboxes']) == 0:
+                    self.finish_unit(manifest, key, stamp, [], [], save=False)
                     continue
-                anno_tree = self.anno2xml(imgfile, anno_dict)
-                etree.ElementTree(anno_tree).write(
-                    osp.join(annodir, '{:0>6}.xml'.format(ind+1)),
-                    pretty_print=True)
+                self.write_anno(imgfile, anno_dict, osp.join(annodir, '{:0>6}.xml'.format(ind+1)), split)
             # JPEGImages
-            cmd = 'ln -s {} {}'.format(
-                    imgfile,
-                    osp.join(jpgdir, '{:0>6}.jpg'.format(ind+1)))
-            (status, output) = commands.getstatusoutput(cmd)
-            # ImageSets/Main
-            if ind < int(sum_train * self.train_val_ratio):
-                train_list.append('{:0>6}'.format(ind+1))
-            elif ind < sum_train:
-                val_list.append('{:0>6}'.format(ind+1))
-            else:
-                test_list.append('{:0>6}'.format(ind+1))
-        
+            self.link(imgfile, osp.join(jpgdir, '{:0>6}.jpg'.format(ind+1)))
+            self.finish_unit(manifest, key, stamp, [ind+1], [split], save=False)
+        self.save_manifest(manifest)
+        self.stop_profile()
+
+        lists = manifest.split_lists(keys)
+        train_list, val_list, test_list = lists['train'], lists['val'], lists['test']
         trainval_list = train_list + val_list
         self.create_split(splitdir, None, trainval_list, test_list, train_list, val_list)
 
+        self.close_outputs()
+        self.save_size_cache()
+        self.write_report()
         print("===> Successfully.")
         print("Kitti in voc-format is saved in {}".format(voc_root))
         return True
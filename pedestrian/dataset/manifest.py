@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of converted source units, used to resume convert2voc.
+"""
+
+import os
+import json
+
+
+class Manifest(object):
+
+    """Record which source units are converted, from which sources and to which ids
+
+    Saved as json:
+        {'next_id': int,
+         'units': {key: {'stamp': {...}, 'ids': [int, ...], 'splits': [str, ...]}}}
+
+    A unit is done if its stamp (e.g. source mtimes) is unchanged. Ids of a
+    redone unit are reused, so the ids of other units never move.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.next_id = 1
+        self.units = {}
+        if os.path.exists(path):
+            with open(path, 'r') as fid:
+                data = json.load(fid)
+            self.next_id = data['next_id']
+            self.units = data['units']
+
+
+    def __contains__(self, key):
+        return key in self.units
+
+
+    def __len__(self):
+        return len(self.units)
+
+
+    @staticmethod
+    def mtimes(*files):
+        return dict((f, os.stat(f).st_mtime) for f in files)
+
+
+    def is_done(self, key, stamp):
+        unit = self.units.get(key)
+        return unit is not None and unit['stamp'] == json.loads(json.dumps(stamp))
+
+
+    def ids(self, key):
+        return self.units[key]['ids'] if key in self.units else []
+
+
+    def assign(self, key, count):
+        """Ids for count outputs of unit key
+
+        Returns:
+            (ids, released): released are old ids of the unit no longer used
+        """
+        old = self.units[key]['ids'] if key in self.units else []
+        if count <= len(old):
+            return old[:count], old[count:]
+        ids = old + list(range(self.next_id, self.next_id + count - len(old)))
+        self.next_id += count - len(old)
+        return ids, []
+
+
+    def update(self, key, stamp, ids, splits):
+        ids = [int(x) for x in ids]
+        self.units[key] = {'stamp': stamp, 'ids': ids, 'splits': list(splits)}
+        if ids:
+            self.next_id = max(self.next_id, max(ids) + 1)
+
+
+    def remove(self, key):
+        """Forget unit key, return its ids"""
+        return self.units.pop(key)['ids']
+
+
+    def split_lists(self, keys, names=('train', 'val', 'test')):
+        """Ids of each split, units in order of keys"""
+        out = dict((x, []) for x in names)
+        for key in keys:
+            unit = self.units.get(key)
+            if unit is None:
+                continue
+            for ind, split in zip(unit['ids'], unit['splits']):
+                out[split].append('{:0>6}'.format(ind))
+        return out
+
+
+    def save(self):
+        tmpfile = self.path + '.tmp'
+        with open(tmpfile, 'w') as fid:
+            json.dump({'next_id': self.next_id, 'units': self.units}, fid)
+        os.rename(tmpfile, self.path)
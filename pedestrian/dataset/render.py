@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Headless output of rendered frames: a video file or an image sequence.
+"""
+
+import os
+import multiprocessing
+import cv2
+import tqdm
+
+
+video_exts = ('.mp4', '.avi', '.mkv')
+
+
+class FrameSink(object):
+
+    """Write frames to out, a video if it ends with a video extension,
+    otherwise a directory of <index>.jpg
+
+    Usage:
+        with FrameSink('reel/V000.mp4', fps=30) as sink:
+            for img in frames:
+                sink.write(img)
+    """
+
+    def __init__(self, out, fps=30, fourcc='mp4v', ext='.jpg'):
+        self.out = out
+        self.fps = fps
+        self.fourcc = fourcc
+        self.ext = ext
+        self.count = 0
+        self._writer = None
+        self.is_video = out.lower().endswith(video_exts)
+        dirname = os.path.dirname(out) if self.is_video else out
+        if dirname and not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def write(self, img, index=None):
+        """Append img, index names the image of a sequence, default the count"""
+        if self.is_video:
+            if self._writer is None:
+                # frame size is known at the first frame
+                h, w = img.shape[:2]
+                self._writer = cv2.VideoWriter(self.out + '.tmp' + os.path.splitext(self.out)[1],
+                                               cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+            self._writer.write(img)
+        else:
+            index = self.count if index is None else index
+            cv2.imwrite(os.path.join(self.out, '{:0>6}{}'.format(index, self.ext)), img)
+        self.count += 1
+
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+            os.rename(self.out + '.tmp' + os.path.splitext(self.out)[1], self.out)
+
+
+def render_all(render, jobs, workers=8):
+    """Run render(job) for every job in a process pool, one job per task
+
+    Returns:
+        results in the order of jobs
+    """
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        results = list(tqdm.tqdm(pool.imap(render, jobs, chunksize=1), total=len(jobs)))
+        pool.close()
+        pool.join()
+    else:
+        results = [render(x) for x in tqdm.tqdm(jobs)]
+    return results
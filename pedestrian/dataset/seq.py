@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for Norpix .seq container used by Caltech Pedestrian Dataset.
+Header layout follows seqIo.m in Piotr's Matlab Toolbox.
+"""
+
+import os
+import mmap
+import struct
+import numpy as np
+import cv2
+from tarindex import TarIndex
+
+
+SEQ_MAGIC = 0xFEED
+SEQ_HEADER_SIZE = 1024
+JPEG_SOI = b'\xff\xd8'
+
+# imageFormat field in header -> file extension of each frame
+image_ext = {100: 'raw', 200: 'raw', 101: 'brgb8', 102: 'jpg', 201: 'jpg', 1: 'png', 2: 'png'}
+
+
+class SeqReader(object):
+
+    """Random access to encoded frames in a .seq file
+
+    Frames are located by a per-frame byte offset index, which is built once
+    and cached next to the seq file. read(i) returns the raw encoded bytes of
+    i-th frame (0-based) from mmap, without decoding.
+    """
+
+    def __init__(self, seq_file, cache_file=None, offset=0, size=None):
+        """
+        Args:
+            seq_file (str): path of .seq file, or a container holding it
+            cache_file (str): where to cache the frame index, default is
+                seq_file + '.idx.npz'. False to disable the cache.
+            offset (int): byte offset of the seq data in seq_file
+            size (int): byte size of the seq data, default to end of file
+        """
+        self.seq_file = seq_file
+        self.cache_file = seq_file + '.idx.npz' if cache_file is None else cache_file
+        self._fid = open(seq_file, 'rb')
+        self._mm = mmap.mmap(self._fid.fileno(), 0, access=mmap.ACCESS_READ)
+        self._base = offset
+        self._end = len(self._mm) if size is None else offset + size
+        self.header = self._read_header()
+        self.offsets, self.sizes = self._load_index()
+
+
+    @classmethod
+    def from_tar(cls, tar_file, name, index=None):
+        """Reader of member name of an uncompressed tar, read in place
+
+        index (TarIndex): index of tar_file, built or loaded if None
+        """
+        index = TarIndex(tar_file) if index is None else index
+        offset, size = index.offset(name)
+        return cls(tar_file, index.cache_path(name, '.idx.npz'), offset, size)
+
+
+    def __len__(self):
+        return self.offsets.shape[0]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._fid.close()
+            self._mm = None
+
+
+    @property
+    def ext(self):
+        return image_ext.get(self.header['format'], 'raw')
+
+
+    def _read_header(self):
+        mm, base = self._mm, self._base
+        magic = struct.unpack_from('<I', mm, base)[0]
+        if magic != SEQ_MAGIC:
+            raise IOError('{} is not a seq file'.format(self.seq_file))
+        version, header_size = struct.unpack_from('<iI', mm, base + 28)
+        params = struct.unpack_from('<9I', mm, base + 548)
+        fps = struct.unpack_from('<d', mm, base + 584)[0]
+        return {'version': version,
+                'header_size': header_size,
+                'width': params[0],
+                'height': params[1],
+                'bit_depth': params[2],
+                'image_size': params[4],
+                'format': params[5],
+                'num_frames': params[6],
+                'true_image_size': params[8],
+                'fps': fps}
+
+
+    def _stamp(self):
+        st = os.stat(self.seq_file)
+        return np.array([st.st_size, int(st.st_mtime * 1e6), self._base, self._end], dtype=np.int64)
+
+
+    def _load_index(self):
+        stamp = self._stamp()
+        if self.cache_file and os.path.exists(self.cache_file):
+            try:
+                cache = np.load(self.cache_file)
+                if np.array_equal(cache['stamp'], stamp):
+                    return cache['offsets'], cache['sizes']
+            except Exception as e:
+                pass
+        offsets, sizes = self._build_index()
+        if self.cache_file:
+            tmpfile = self.cache_file + '.tmp.npz'
+            try:
+                np.savez(tmpfile, offsets=offsets, sizes=sizes, stamp=stamp)
+                os.rename(tmpfile, self.cache_file)
+            except (IOError, OSError) as e:
+                pass
+        return offsets, sizes
+
+
+    def _build_index(self):
+        h = self.header
+        n = h['num_frames']
+        start = self._base + SEQ_HEADER_SIZE
+        if self.ext == 'raw':
+            offsets = start + np.arange(n, dtype=np.int64) * h['true_image_size']
+            sizes = np.full(n, h['image_size'], dtype=np.int64)
+            return offsets, sizes
+
+        # each frame: uint32 nbytes (including itself), image data, timestamp.
+        # the length of timestamp block is not in header, guess it from the
+        # second frame and resync on next SOI if it ever goes wrong.
+        mm = self._mm
+        offsets = np.zeros(n, dtype=np.int64)
+        sizes = np.zeros(n, dtype=np.int64)
+        extra = None
+        pos = start
+        for i in range(n):
+            if pos + 4 > self._end:
+                offsets, sizes = offsets[:i], sizes[:i]
+                break
+            nbytes = struct.unpack_from('<I', mm, pos)[0]
+            offsets[i] = pos + 4
+            sizes[i] = nbytes - 4
+            nxt = pos + nbytes
+            if extra is None:
+                extra = 8
+                for guess in (8, 16, 0, 24):
+                    if mm[nxt + guess + 4:nxt + guess + 6] == JPEG_SOI:
+                        extra = guess
+                        break
+            pos = nxt + extra
+            if i + 1 < n and self.ext == 'jpg' and mm[pos + 4:pos + 6] != JPEG_SOI:
+                soi = mm.find(JPEG_SOI, nxt, self._end)
+                if soi < 0:
+                    offsets, sizes = offsets[:i+1], sizes[:i+1]
+                    break
+                pos = soi - 4
+        return offsets, sizes
+
+
+    def read(self, i):
+        """Encoded bytes of i-th frame (0-based)"""
+        off = int(self.offsets[i])
+        return self._mm[off:off + int(self.sizes[i])]
+
+
+    def decode(self, i):
+        """Decoded BGR image of i-th frame (0-based)"""
+        h = self.header
+        if self.ext == 'raw':
+            buf = np.frombuffer(self.read(i), dtype=np.uint8)
+            channel = max(h['bit_depth'] // 8, 1)
+            img = buf[:h['width'] * h['height'] * channel].reshape(h['height'], h['width'], channel)
+            return img if channel == 3 else cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        return cv2.imdecode(np.frombuffer(self.read(i), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read(i)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Pack samples into tar shards, webdataset style.
+
+A sample is a key and its files, e.g. ('000001', {'jpg': path, 'json': bytes}),
+stored as members 000001.jpg, 000001.json next to each other. A file is a
+path, bytes, or (archive, name) read by archive.read(name). Shards are cut
+at maxsize bytes or maxcount samples, written by a pool of workers, and
+listed in index.json with the offset of every sample:
+
+    {'shards': [{'name': 'shard-000000.tar', 'count': n, 'bytes': n,
+                 'keys': [...], 'offsets': [...]}, ...]}
+"""
+
+import os
+import io
+import json
+import tarfile
+import multiprocessing
+
+
+def _size(src):
+    if isinstance(src, bytes):
+        return len(src)
+    if isinstance(src, tuple):
+        return src[0].size(src[1])
+    return os.path.getsize(src)
+
+
+def _read(src):
+    if isinstance(src, bytes):
+        return src
+    if isinstance(src, tuple):
+        return src[0].read(src[1])
+    with open(src, 'rb') as fid:
+        return fid.read()
+
+
+def plan_shards(samples, maxsize=256 << 20, maxcount=10000):
+    """Split samples in order into shards of at most maxsize bytes or maxcount samples"""
+    shards, shard, nbytes = [], [], 0
+    for key, files in samples:
+        size = sum(_size(x) for x in files.values())
+        if shard and (nbytes + size > maxsize or len(shard) >= maxcount):
+            shards.append(shard)
+            shard, nbytes = [], 0
+        shard.append((key, files))
+        nbytes += size
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def write_shard(args):
+    """Write one tar shard, return its index entry"""
+    tarpath, samples = args
+    keys, offsets = [], []
+    tmpfile = tarpath + '.tmp'
+    with tarfile.open(tmpfile, 'w', format=tarfile.USTAR_FORMAT) as tar:
+        for key, files in samples:
+            keys.append(key)
+            offsets.append(tar.offset)
+            for ext in sorted(files):
+                src = _read(files[ext])
+                # fixed metadata, same input gives the same bytes
+                info = tarfile.TarInfo('{}.{}'.format(key, ext))
+                info.size = len(src)
+                info.mode = 0o644
+                info.mtime = 0
+                tar.addfile(info, io.BytesIO(src))
+    os.rename(tmpfile, tarpath)
+    return {'name': os.path.basename(tarpath), 'count': len(keys),
+            'bytes': os.path.getsize(tarpath), 'keys': keys, 'offsets': offsets}
+
+
+def write_shards(samples, out_dir, prefix='shard', maxsize=256 << 20, maxcount=10000, workers=4):
+    """Write samples as shards in out_dir, return the index also saved as index.json"""
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    shards = plan_shards(samples, maxsize, maxcount)
+    jobs = [(os.path.join(out_dir, '{}-{:0>6}.tar'.format(prefix, i)), x) for i, x in enumerate(shards)]
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        entries = pool.map(write_shard, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        entries = [write_shard(x) for x in jobs]
+
+    # shards of an earlier, larger export
+    names = set(x['name'] for x in entries)
+    for f in os.listdir(out_dir):
+        if f.startswith(prefix + '-') and f.endswith('.tar') and f not in names:
+            os.remove(os.path.join(out_dir, f))
+
+    index = {'shards': entries, 'count': sum(x['count'] for x in entries)}
+    tmpfile = os.path.join(out_dir, 'index.json.tmp')
+    with open(tmpfile, 'w') as fid:
+        json.dump(index, fid)
+    os.rename(tmpfile, os.path.join(out_dir, 'index.json'))
+    return index
+
+
+def iter_shard(tarpath):
+    """Stream samples of a shard as (key, {ext: bytes})"""
+    key, files = None, {}
+    with tarfile.open(tarpath, 'r|') as tar:
+        for member in tar:
+            name, ext = member.name.split('.', 1)
+            if key is not None and name != key:
+                yield key, files
+                files = {}
+            key = name
+            files[ext] = tar.extractfile(member).read()
+    if key is not None:
+        yield key, files
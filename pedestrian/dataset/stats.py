@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Stage timers and counters for dataset conversion.
+"""
+
+import sys
+import time
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError as e:
+    resource = None
+
+
+def peak_rss():
+    """Peak resident memory in bytes of this process and of its children"""
+    if resource is None:
+        return 0, 0
+    # ru_maxrss is in KB on linux, in bytes on mac
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+class Stats(object):
+
+    """Per-stage wall time and counters
+
+    Usage:
+        with stats.timer('check_anno'):
+            ...
+        stats.count('boxes', n)
+    """
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self._start = time.time()
+
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.time() - start
+            self.calls[stage] += 1
+
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+
+    def state(self):
+        return {'seconds': dict(self.seconds),
+                'calls': dict(self.calls),
+                'counters': dict(self.counters)}
+
+
+    def merge(self, state):
+        """Add stats collected elsewhere, e.g. by worker processes"""
+        for k, v in state['seconds'].items():
+            self.seconds[k] += v
+        for k, v in state['calls'].items():
+            self.calls[k] += v
+        for k, v in state['counters'].items():
+            self.counters[k] += v
+
+
+    def report(self, name=None):
+        wall = time.time() - self._start
+        rss_self, rss_children = peak_rss()
+        rate = lambda n: n / wall if wall > 0 else 0.0
+        return {'dataset': name,
+                'wall_seconds': wall,
+                'stages': dict((k, {'seconds': self.seconds[k], 'calls': self.calls[k]}) for k in self.seconds),
+                'counters': dict(self.counters),
+                'throughput': {'images_per_second': rate(self.counters.get('images', 0)),
+                               'boxes_per_second': rate(self.counters.get('boxes', 0)),
+                               'bytes_read_per_second': rate(self.counters.get('bytes_read', 0)),
+                               'bytes_written_per_second': rate(self.counters.get('bytes_written', 0))},
+                'peak_rss': {'self': rss_self, 'children': rss_children}}
+
+
+    def dump(self, path, name=None):
+        with open(path, 'w') as fid:
+            json.dump(self.report(name), fid, indent=2, sort_keys=True)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Index of members in an uncompressed tar, to read them in place.
+"""
+
+import os
+import json
+import tarfile
+
+
+class TarIndex(object):
+
+    """Byte offset and size of every regular file in an uncompressed tar
+
+    The index is built by walking the tar headers once and cached in
+    cache_dir/members.json, cache_dir defaults to tar_file + '.idx'.
+    Indexes of members, e.g. frame offsets of a seq, can be cached in
+    the same dir, see cache_path.
+    """
+
+    def __init__(self, tar_file, cache_dir=None):
+        self.tar_file = tar_file
+        self.cache_dir = tar_file + '.idx' if cache_dir is None else cache_dir
+        self.members = self._load()
+
+
+    def __contains__(self, name):
+        return name in self.members
+
+
+    def __len__(self):
+        return len(self.members)
+
+
+    def names(self, suffix=''):
+        """Sorted member names ending with suffix"""
+        return sorted(x for x in self.members if x.endswith(suffix))
+
+
+    def _stamp(self):
+        st = os.stat(self.tar_file)
+        return [st.st_size, int(st.st_mtime * 1e6)]
+
+
+    def _load(self):
+        stamp = self._stamp()
+        cache_file = os.path.join(self.cache_dir, 'members.json')
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as fid:
+                    cache = json.load(fid)
+                if cache['stamp'] == stamp:
+                    return cache['members']
+            except (IOError, OSError, ValueError, KeyError) as e:
+                pass
+        members = self._build()
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmpfile = cache_file + '.tmp'
+            with open(tmpfile, 'w') as fid:
+                json.dump({'stamp': stamp, 'members': members}, fid)
+            os.rename(tmpfile, cache_file)
+        except (IOError, OSError) as e:
+            pass
+        return members
+
+
+    def _build(self):
+        # 'r:' refuses compressed tars, whose members can not be mapped
+        members = {}
+        with tarfile.open(self.tar_file, 'r:') as tar:
+            for info in tar:
+                if info.isfile():
+                    members[info.name] = [info.offset_data, info.size, info.mtime]
+        return members
+
+
+    def offset(self, name):
+        """(byte offset, byte size) of member name in the tar"""
+        off, size, mtime = self.members[name]
+        return off, size
+
+
+    def mtime(self, name):
+        return self.members[name][2]
+
+
+    def read(self, name):
+        off, size = self.offset(name)
+        with open(self.tar_file, 'rb') as fid:
+            fid.seek(off)
+            return fid.read(size)
+
+
+    def cache_path(self, name, suffix):
+        """Where an index of member name is cached"""
+        return os.path.join(self.cache_dir, name.replace('/', '_') + suffix)
@@ -5,73 +5,286 @@ https://github.com/CasiaFan/Dataset_to_VOC_converter/blob/master/vbb2voc.py
 
 
 import os, glob
+import io
+import struct
+import zipfile
 import cv2
 from scipy.io import loadmat
 from collections import defaultdict
 import numpy as np
 from lxml import etree, objectify
+from seq import SeqReader
 
 
-class SeqVbb(object):
+def source_name(source):
+    """Name of a source given as a path or an (archive, member name) pair"""
+    return source[1] if isinstance(source, tuple) else source
 
-    """Parser for vbb/seq format in Caltech Pedestrian Dataset"""
 
-    def __init__(self):
-        pass
+class VbbAnno(object):
 
+    """Columnar annotations of one vbb file
 
-    def readvbb(self, vbb_file, cam_id):
-        filename = os.path.splitext(os.path.basename(vbb_file))[0]
-        annos = defaultdict(dict)
+    Boxes of all frames are kept in flat arrays, sorted by frame:
+        frame (int32): 0-based frame index
+        obj_id (int32): 0-based object id
+        bbox (float64, Nx4): x, y, w, h
+        occl (uint8): occlusion flag
+        label (int16): index into labels
+    Boxes of frame f are rows offsets[f]:offsets[f+1].
+    """
+
+    fields = ('frame', 'obj_id', 'bbox', 'occl', 'label', 'offsets', 'labels')
+
+    def __init__(self, frame, obj_id, bbox, occl, label, offsets, labels):
+        self.frame = frame
+        self.obj_id = obj_id
+        self.bbox = bbox
+        self.occl = occl
+        self.label = label
+        self.offsets = offsets
+        self.labels = labels
+
+
+    def __len__(self):
+        return self.frame.shape[0]
+
+
+    @property
+    def num_frames(self):
+        return self.offsets.shape[0] - 1
+
+
+    @classmethod
+    def from_mat(cls, vbb_file):
         vbb = loadmat(vbb_file)
         # object info in each frame: id, pos, occlusion, lock, posv
         objLists = vbb['A'][0][0][1][0]
         objLbl = [str(v[0]) for v in vbb['A'][0][0][4][0]]
-        # person index
-        person_index_list = np.where(np.array(objLbl) == "person")[0]
+
+        counts = np.zeros(len(objLists), dtype=np.int64)
+        ids, bboxes, occls = [], [], []
         for frame_id, obj in enumerate(objLists):
             if len(obj) > 0:
-                frame_name = str(cam_id) + "_" + str(filename) + "_" + str(frame_id+1) + ".jpg"
-                annos[frame_name] = defaultdict(list)
-                annos[frame_name]["id"] = frame_name
-                annos[frame_name]["label"] = "person"
-                for id, pos, occl in zip(obj['id'][0], obj['pos'][0], obj['occl'][0]):
-                    id = int(id[0][0]) - 1  # for matlab start from 1 not 0
-                    if not id in person_index_list:  # only use bbox whose label is person
-                        continue
-                    pos = pos[0].tolist()
-                    occl = int(occl[0][0])
-                    annos[frame_name]["occlusion"].append(occl)
-                    annos[frame_name]["bbox"].append(pos)
-                if not annos[frame_name]["bbox"]:
-                    del annos[frame_name]
+                counts[frame_id] = obj['id'][0].shape[0]
+                ids.extend(int(x[0][0]) - 1 for x in obj['id'][0]) # for matlab start from 1 not 0
+                bboxes.extend(x[0] for x in obj['pos'][0])
+                occls.extend(int(x[0][0]) for x in obj['occl'][0])
+
+        obj_id = np.array(ids, dtype=np.int32)
+        labels = np.array(objLbl + ['unknown'])
+        # objects without label point to the trailing 'unknown'
+        obj_label = np.where((obj_id >= 0) & (obj_id < len(objLbl)), obj_id, len(objLbl))
+        return cls(frame=np.repeat(np.arange(len(objLists), dtype=np.int32), counts),
+                   obj_id=obj_id,
+                   bbox=np.array(bboxes, dtype=np.float64).reshape(-1, 4),
+                   occl=np.array(occls, dtype=np.uint8),
+                   label=obj_label.astype(np.int16),
+                   offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                   labels=labels)
+
+
+    @classmethod
+    def load(cls, vbb_file, cache_file=None):
+        """Load from cache if vbb_file is unchanged, otherwise parse and cache it"""
+        cache_file = vbb_file + '.npz' if cache_file is None else cache_file
+        st = os.stat(vbb_file)
+        stamp = np.array([st.st_size, int(st.st_mtime * 1e6)], dtype=np.int64)
+        return cls._load_cached(cache_file, stamp, lambda: cls.from_mat(vbb_file))
+
+
+    @classmethod
+    def load_zip(cls, zip_file, name, cache_file=None):
+        """Load member name of zip_file without extracting it, cached like load
+
+        Default cache_file is zip_file.idx/<name>.npz
+        """
+        if cache_file is None:
+            cache_file = os.path.join(zip_file + '.idx', name.replace('/', '_') + '.npz')
+            if not os.path.exists(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+        with zipfile.ZipFile(zip_file, 'r') as zf:
+            info = zf.getinfo(name)
+            stamp = np.array([info.file_size, info.CRC], dtype=np.int64)
+            return cls._load_cached(cache_file, stamp, lambda: cls.from_mat(io.BytesIO(zf.read(name))))
+
+
+    @classmethod
+    def _load_cached(cls, cache_file, stamp, parse):
+        if os.path.exists(cache_file):
+            try:
+                cache = np.load(cache_file)
+                if np.array_equal(cache['stamp'], stamp):
+                    return cls(**dict((k, cache[k]) for k in cls.fields))
+            except Exception as e:
+                pass
+        anno = parse()
+        tmpfile = cache_file + '.tmp.npz'
+        try:
+            np.savez(tmpfile, stamp=stamp, **dict((k, getattr(anno, k)) for k in cls.fields))
+            os.rename(tmpfile, cache_file)
+        except (IOError, OSError) as e:
+            pass
+        return anno
+
+
+    def select(self, index, label='person'):
+        """Row slice of 1-based frame index, only rows of given label"""
+        if index < 1 or index > self.num_frames:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.arange(self.offsets[index-1], self.offsets[index])
+        if label is not None:
+            rows = rows[self.labels[self.label[rows]] == label]
+        return rows
+
+
+    def frames(self, label='person'):
+        """1-based indexes of frames which have boxes of given label"""
+        mask = np.ones(len(self), dtype=bool) if label is None else self.labels[self.label] == label
+        return np.unique(self.frame[mask]) + 1
+
+
+    def getbbox(self, index, label='person'):
+        """(x1, y1, x2, y2) boxes of 1-based frame index"""
+        bboxes = self.bbox[self.select(index, label)].astype(int)
+        bboxes[:, 2] += bboxes[:, 0]
+        bboxes[:, 3] += bboxes[:, 1]
+        return bboxes
+
+
+class SeqVbb(object):
+
+    """Parser for vbb/seq format in Caltech Pedestrian Dataset"""
+
+    def __init__(self):
+        pass
+
+
+    def loadvbb(self, vbb_file):
+        """Columnar annotations, cached in vbb_file.npz
+
+        vbb_file (str or tuple): path, or (zip_file, member name)
+        """
+        if isinstance(vbb_file, tuple):
+            return VbbAnno.load_zip(*vbb_file)
+        return VbbAnno.load(vbb_file)
+
+
+    def readvbb(self, vbb_file, cam_id):
+        filename = os.path.splitext(os.path.basename(source_name(vbb_file)))[0]
+        anno = self.loadvbb(vbb_file)
+        annos = defaultdict(dict)
+        # only use bbox whose label is person
+        person = anno.labels[anno.label] == "person"
+        for frame_id in np.unique(anno.frame[person]):
+            rows = np.arange(anno.offsets[frame_id], anno.offsets[frame_id+1])
+            rows = rows[person[rows]]
+            frame_name = str(cam_id) + "_" + str(filename) + "_" + str(frame_id+1) + ".jpg"
+            annos[frame_name] = defaultdict(list)
+            annos[frame_name]["id"] = frame_name
+            annos[frame_name]["label"] = "person"
+            annos[frame_name]["occlusion"] = anno.occl[rows].astype(int).tolist()
+            annos[frame_name]["bbox"] = anno.bbox[rows].tolist()
         return annos
 
 
-    def readseq(self, seq_file, cam_id, anno_dict=None):
+    def readseq(self, seq_file, cam_id, anno_dict=None, stream=False, frame_index=None, raw=False):
+        """Read frames from seq file.
+
+        Args:
+            seq_file (str or tuple): path of .seq video, or (tar_file, member
+                name) to read it from an uncompressed tar in place
+            cam_id (str): set id, e.g. 'set00'
+            anno_dict (dict): if given, only frames with annotation are read
+            stream (bool): return a generator of (frame_name, frame) instead of
+                a dict holding every decoded frame
+            frame_index (container or callable): optional 1-based frame filter
+            raw (bool): give encoded jpg bytes instead of decoded frames
+
+        Returns:
+            dict {frame_name: frame}, or generator if stream is True
+        """
+        if anno_dict is not None and frame_index is None:
+            frame_index = set([int(os.path.splitext(id)[0].split("_")[2]) for id in anno_dict.keys()])
+        frames = self.iterseq(seq_file, cam_id, frame_index, raw)
+        if stream:
+            return frames
+        return dict(frames)
+
+
+    def iterseq(self, seq_file, cam_id, frame_index=None, raw=False):
+        """Yield (frame_name, frame) one by one, frames in video order.
+
+        Only one frame is alive at a time, so memory does not grow with the
+        length of the video. Frames are read from the seq container directly
+        if possible, and cv2.VideoCapture is used otherwise.
+        """
+        v_id = os.path.splitext(os.path.basename(source_name(seq_file)))[0]
+        if isinstance(seq_file, tuple):
+            # no fallback, cv2 can not open a tar member
+            reader = SeqReader.from_tar(*seq_file)
+        else:
+            try:
+                reader = SeqReader(seq_file)
+            except (IOError, ValueError, struct.error) as e:
+                reader = None
+
+        if reader is None:
+            frames = self._iter_capture(seq_file, frame_index, raw)
+        else:
+            frames = self._iter_reader(reader, frame_index, raw)
+        for index, frame in frames:
+            yield str(cam_id)+"_"+v_id+"_"+str(index)+".jpg", frame
+
+
+    def _iter_reader(self, reader, frame_index, raw):
+        with reader:
+            n = len(reader)
+            if frame_index is None:
+                indexes = range(1, n+1)
+            elif callable(frame_index):
+                indexes = (x for x in range(1, n+1) if frame_index(x))
+            else:
+                indexes = sorted(x for x in set(frame_index) if 1 <= x <= n)
+            for index in indexes:
+                if not raw:
+                    yield index, reader.decode(index-1)
+                elif reader.ext == 'jpg':
+                    yield index, reader.read(index-1)
+                else:
+                    yield index, cv2.imencode('.jpg', reader.decode(index-1))[1].tobytes()
+
+
+    def _iter_capture(self, seq_file, frame_index, raw):
         cap = cv2.VideoCapture(seq_file)
-        v_id = os.path.splitext(os.path.basename(seq_file))[0]
 
-        # captured frame list if annd_dict given
-        if anno_dict is not None:
-            cap_frames_index = np.sort([int(os.path.splitext(id)[0].split("_")[2]) for id in anno_dict.keys()])
+        if frame_index is None:
+            keep = lambda index: True
+            last = None
+        elif callable(frame_index):
+            keep = frame_index
+            last = None
         else:
-            cap_frames_index = np.array([])
+            frame_index = set(frame_index)
+            keep = frame_index.__contains__
+            last = max(frame_index) if frame_index else 0
 
         index = 1
-        out_imgs = {}
-        while True:
-            ret, frame = cap.read()
-            if ret:
-                if cap_frames_index.shape[0] > 0  and not index in cap_frames_index:
-                    index += 1
-                    continue
-                frameid = str(cam_id)+"_"+v_id+"_"+str(index)+".jpg"
-                out_imgs[frameid] = frame
-            else:
-                break
-            index += 1
-        return out_imgs
+        try:
+            while last is None or index <= last:
+                # grab() skips the decode of frames we do not want
+                if not cap.grab():
+                    break
+                if keep(index):
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    if raw:
+                        frame = cv2.imencode('.jpg', frame)[1].tobytes()
+                    yield index, frame
+                index += 1
+        finally:
+            cap.release()
 
 
     def getbbox(self, anno):
@@ -82,45 +295,50 @@ class SeqVbb(object):
 
 
     def show(self, imgs, annos, index=None):
+        """Show frames with gt boxes.
+
+        Args:
+            imgs: dict from readseq, or iterable of (frame_name, frame)
+                such as readseq(..., stream=True)
+            annos: dict from readvbb
+            index (int): only show the index-th frame
+        """
+        if isinstance(imgs, dict):
+            total = len(imgs.keys())
+            frames = sorted(imgs.items(), key=lambda x: int(x[0].split('.')[0].split('_')[-1]))
+        else:
+            total = None
+            frames = imgs
 
         if index is not None:
-            assert index >= 0 and index < len(imgs.keys())
-            key = sorted(imgs.keys())[index]
-            img = imgs[key]
-            if key in annos.keys():
-                bboxes = self.getbbox(annos[key])
-                for bbox in bboxes:
-                    img = cv2.rectangle(imgs[key], (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2)
-            cv2.imshow('img', img)
-            ch = cv2.waitKey(0) & 0xff
+            assert index >= 0 and (total is None or index < total)
+            for ind, (key, img) in enumerate(frames):
+                if ind < index:
+                    continue
+                if key in annos.keys():
+                    bboxes = self.getbbox(annos[key])
+                    for bbox in bboxes:
+                        img = cv2.rectangle(img, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2)
+                cv2.imshow('img', img)
+                ch = cv2.waitKey(0) & 0xff
+                return
             return
 
-        keyinds = sorted(['{:0>6}'.format(x.split('.')[0].split('_')[-1]) for x in imgs.keys()])
-        
-        def fetch_head():
-            keyname = list(imgs.keys())[0] 
-            keyid = keyname.split('.')[0].split('_')[-1]
-            key_loc = keyname.find(keyid)
-            return keyname[:key_loc]
-
-        key_head = fetch_head() 
-
-        for ind in range(len(imgs.keys())):
-            key = key_head + str(int(keyinds[ind])) + '.jpg'
-            img = imgs[key]
+        ind = -1
+        for ind, (key, img) in enumerate(frames):
             if key in annos.keys():
                 bboxes = self.getbbox(annos[key])
                 for bbox in bboxes:
-                    img = cv2.rectangle(imgs[key], (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2)
+                    img = cv2.rectangle(img, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2)
 
-            cv2.putText(img, '{}/{}'.format(ind, len(imgs.keys())), 
+            cv2.putText(img, '{}/{}'.format(ind, total if total is not None else '-'), 
                     (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,255),2)
             cv2.imshow('img', img)
 
             ch = cv2.waitKey(5) & 0xff
             if ch == 27: #ord('q')
                 break
-        print('frame sum: %d' % len(imgs.keys()))
+        print('frame sum: %d' % (ind+1))
     
 
 if __name__ == "__main__":
@@ -139,7 +357,7 @@ if __name__ == "__main__":
     print('parsing vbb...')
     annos = parser.readvbb(vbb, cameraID)
     print('parsing seq...')
-    #imgs = parser.readseq(seq, cameraID, annos) # only show frame with target
-    imgs = parser.readseq(seq, cameraID) # show all frames
+    #imgs = parser.readseq(seq, cameraID, annos, stream=True) # only show frame with target
+    imgs = parser.readseq(seq, cameraID, stream=True) # show all frames
 
     parser.show(imgs, annos)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Random access to a converted *_voc tree.
+"""
+
+import os
+import os.path as osp
+from collections import OrderedDict
+import numpy as np
+import cv2
+from lxml import etree
+
+
+class LRUCache(object):
+
+    """Dict keeping at most maxsize most recently used items"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+
+    def put(self, key, value):
+        if key in self._data:
+            self._data.pop(key)
+        elif self.maxsize > 0 and len(self._data) >= self.maxsize:
+            self._data.popitem(last=False)
+        if self.maxsize > 0:
+            self._data[key] = value
+
+
+def parse_voc_xml(xmlfile):
+    """Annotation of a VOC xml file
+
+    Returns:
+        {'id', 'width', 'height', 'bboxes' (Nx4 int32 x1 y1 x2 y2),
+         'names' (list), 'difficult' (N uint8), 'occlusion' (N uint8)}
+    """
+    root = etree.parse(xmlfile).getroot()
+    names, bboxes, difficult, occlusion = [], [], [], []
+    for obj in root.iter('object'):
+        names.append(obj.findtext('name'))
+        box = obj.find('bndbox')
+        bboxes.append([int(float(box.findtext(x))) for x in ('xmin', 'ymin', 'xmax', 'ymax')])
+        difficult.append(int(obj.findtext('difficult') or 0))
+        occlusion.append(int(obj.findtext('occlusion') or 0))
+    return {'id': root.findtext('filename'),
+            'width': int(root.findtext('size/width')),
+            'height': int(root.findtext('size/height')),
+            'bboxes': np.array(bboxes, dtype=np.int32).reshape(-1, 4),
+            'names': names,
+            'difficult': np.array(difficult, dtype=np.uint8),
+            'occlusion': np.array(occlusion, dtype=np.uint8)}
+
+
+class VocDataset(object):
+
+    """One split of a voc tree created by Pedestrian.convert2voc
+
+    Image ids are read once from ImageSets/Main/<split>.txt. Annotations are
+    parsed on first access and kept in an LRU cache of cache_size items,
+    images are decoded on every access and never cached.
+
+    Annotations come from the xml files unless use_store is set, then from
+    voc_root/annostore if it was written. The backends differ in occlusion:
+    the store keeps the occlusion of the source labels, e.g. KITTI, while
+    the xml always has 0.
+
+    Usage:
+        ds = VocDataset('~/data/pedestrian/caltech/caltech_voc', 'trainval')
+        sample = ds[0] # {'id', 'imgfile', 'image', 'bboxes', 'names', ...}
+        anno = ds.anno(0) # without decoding the image
+    """
+
+    def __init__(self, voc_root, split='trainval', cache_size=1024, use_store=False):
+        self.voc_root = osp.expanduser(voc_root)
+        self.split = split
+        self.jpgdir = osp.join(self.voc_root, 'JPEGImages')
+        self.annodir = osp.join(self.voc_root, 'Annotations')
+        splitfile = osp.join(self.voc_root, 'ImageSets/Main', split + '.txt')
+        if not osp.exists(splitfile):
+            raise ValueError("{} not exist.".format(splitfile))
+        with open(splitfile, 'r') as fid:
+            self.ids = [x.strip() for x in fid if x.strip()]
+        self._cache = LRUCache(cache_size)
+
+        # annotations of the memory-mapped store, if converted with it
+        self.store = None
+        store_dir = osp.join(self.voc_root, 'annostore')
+        if use_store and osp.exists(osp.join(store_dir, 'meta.json')):
+            from annostore import AnnoStore
+            self.store = AnnoStore(store_dir)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def __getitem__(self, i):
+        anno = dict(self.anno(i))
+        anno['imgfile'] = self.imgfile(i)
+        anno['image'] = self.image(i)
+        return anno
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def imgfile(self, i):
+        return osp.join(self.jpgdir, self.ids[i] + '.jpg')
+
+
+    def image(self, i):
+        """Decoded BGR image of i-th sample"""
+        img = cv2.imread(self.imgfile(i))
+        if img is None:
+            raise IOError("Can not read {}".format(self.imgfile(i)))
+        return img
+
+
+    def anno(self, i):
+        """Annotation of i-th sample, see parse_voc_xml
+
+        Images without annotation, e.g. a test split, have no boxes and
+        width, height of 0.
+        """
+        image_id = self.ids[i]
+        anno = self._cache.get(image_id)
+        if anno is None:
+            anno = self._load_anno(image_id)
+            self._cache.put(image_id, anno)
+        return anno
+
+
+    def _load_anno(self, image_id):
+        if self.store is not None:
+            try:
+                a = self.store.get(image_id)
+            except KeyError as e:
+                a = None
+            if a is not None:
+                return {'id': image_id, 'width': a['width'], 'height': a['height'],
+                        'bboxes': np.array(a['boxes']),
+                        'names': [self.store.class_names[c] for c in a['classes']],
+                        'difficult': np.zeros(a['boxes'].shape[0], dtype=np.uint8),
+                        'occlusion': np.array(a['occlusion'])}
+        xmlfile = osp.join(self.annodir, image_id + '.xml')
+        if not osp.exists(xmlfile):
+            return {'id': image_id, 'width': 0, 'height': 0,
+                    'bboxes': np.zeros((0, 4), dtype=np.int32), 'names': [],
+                    'difficult': np.zeros(0, dtype=np.uint8),
+                    'occlusion': np.zeros(0, dtype=np.uint8)}
+        return parse_voc_xml(xmlfile)
@@ -6,18 +6,12 @@ import argparse
 import os, sys
 sys.path.append(os.path.join(os.path.dirname(__file__), "../dataset"))
 from vbb import SeqVbb
+from render import FrameSink, render_all
 import os.path as osp
 import numpy as np
 import cv2
 
 
-def fetch_head(imgs):
-    keyname = list(imgs.keys())[0] 
-    keyid = keyname.split('.')[0].split('_')[-1]
-    key_loc = keyname.find(keyid)
-    return keyname[:key_loc]
-
-
 def draw_detections(img, detections, ind, score_th=0.5):
     for key, detection in detections.items():
         cur_dets = detection[np.where(detection[:, 0] == ind)[0]]
@@ -32,56 +26,46 @@ def draw_detections(img, detections, ind, score_th=0.5):
     return img
 
 
-def display(args):
-    if not os.path.exists(args.caltech_root):
-        print("Caltech dataset not found. Please download.")
-        return
-
-    res_path = osp.join(args.caltech_root, 'res')
-    if not os.path.exists(res_path):
-        print("detection results not found, please downloand or create your own.")
-        return
+def load_detections(res_path, methods, setid, videoid):
+    """{method: (N, 6) frame x y w h score} of a video, methods without results are skipped"""
+    detections = {}
+    for method in methods:
+        det_file = os.path.join(res_path, method, setid, videoid+'.txt')
+        if not os.path.exists(det_file):
+            continue
+        det = np.loadtxt(det_file, delimiter=',', dtype=np.float32, ndmin=2)
+        detections[method] = det.reshape(-1, 6)
+    return detections
 
-    setid = 'set{:0>2}'.format(args.setid)
-    videoid = "V{:0>3}".format(args.videoid)
-    print('parsing '+ setid + "/" + videoid)
 
-    # get images and gt
-    seqdir = osp.join(args.caltech_root, setid)
-    vbbdir = osp.join(args.caltech_root, "annotations", setid)
+def video_files(caltech_root, setid):
+    """Sorted seq and vbb files of a set, the i-th of each is video i"""
+    seqdir = osp.join(caltech_root, setid)
+    vbbdir = osp.join(caltech_root, "annotations", setid)
     vbbs = sorted([osp.join(vbbdir, x) for x in sorted(os.listdir(vbbdir)) if x.endswith('.vbb')])
     seqs = sorted([osp.join(seqdir, x) for x in sorted(os.listdir(seqdir)) if x.endswith('.seq')])
-    assert args.videoid >= 0 and args.videoid < len(seqs), "Unknown video id: {}".format(args.videoid)
-    seq = seqs[args.videoid]
-    vbb = vbbs[args.videoid]
-    parser = SeqVbb() 
+    return seqs, vbbs
+
+
+def draw_frames(caltech_root, setid, videoid, x30, methods):
+    """Yield (frame index, img) of a video with gt and detections drawn, decoded one by one"""
+    seqs, vbbs = video_files(caltech_root, setid)
+    assert videoid >= 0 and videoid < len(seqs), "Unknown video id: {}".format(videoid)
+    seq = seqs[videoid]
+    vbb = vbbs[videoid]
+    parser = SeqVbb()
     annos = parser.readvbb(vbb, setid)
-    imgs = parser.readseq(seq, setid)
+    if x30:
+        frame_index = lambda index: index % 30 == 0
+    else:
+        frame_index = None
+    imgs = parser.readseq(seq, setid, stream=True, frame_index=frame_index)
 
     # get detections
-    methods = [x for x in os.listdir(res_path) if not x.endswith('.zip')]
-    #methods = ['SDS-RCNN']
-    methods = ['FasterRCNN']
-    print(methods)
-    detections = {}
-    for method in methods:
-        det_file = os.path.join(res_path, method, setid, videoid+'.txt')
-        lines = [x.strip() for x in open(det_file, 'r').readlines()]
-        det = np.zeros((len(lines), 6)).astype(np.float32)
-        for line_ind, line in enumerate(lines):
-            line = [float(x) for x in line.split(',')]
-            det[line_ind] = line
-        detections[method] = det
-
-    # loop imgs
-    keyinds = sorted(['{:0>6}'.format(x.split('.')[0].split('_')[-1]) for x in imgs.keys()])
-    key_head = fetch_head(imgs) 
-    for ind in range(len(imgs.keys())):
-        if args.x30 and (ind+1) % 30 != 0:
-            continue
+    detections = load_detections(osp.join(caltech_root, 'res'), methods, setid, "V{:0>3}".format(videoid))
 
-        key = key_head + str(int(keyinds[ind])) + '.jpg'
-        img = imgs[key]
+    for key, img in imgs:
+        ind = int(key.split('.')[0].split('_')[-1]) - 1
 
         # draw gt
         if key in annos.keys():
@@ -89,26 +73,83 @@ def display(args):
             for bbox in bboxes:
                 img = cv2.rectangle(img, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), 2)
         # draw detections
-        if args.x30 and (ind+1) % 30 == 0:
+        if x30 and (ind+1) % 30 == 0:
             img = draw_detections(img, detections, ind+1, score_th=0.7)
 
-        cv2.putText(img, '{}/{}'.format(ind+1, len(imgs.keys())), 
+        cv2.putText(img, '{}'.format(ind+1),
                 (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,255),2)
+        yield ind, img
+
+
+def display(args):
+    if not os.path.exists(args.caltech_root):
+        print("Caltech dataset not found. Please download.")
+        return
+
+    res_path = osp.join(args.caltech_root, 'res')
+    if not os.path.exists(res_path):
+        print("detection results not found, please downloand or create your own.")
+        return
+
+    setid = 'set{:0>2}'.format(args.setid)
+    videoid = "V{:0>3}".format(args.videoid)
+    print('parsing '+ setid + "/" + videoid)
+
+    #methods = [x for x in os.listdir(res_path) if not x.endswith('.zip')]
+    #methods = ['SDS-RCNN']
+    methods = ['FasterRCNN']
+    print(methods)
+
+    for ind, img in draw_frames(args.caltech_root, setid, args.videoid, args.x30, methods):
         cv2.imshow('img', img)
         ch = cv2.waitKey(1000 if args.x30 else 5) & 0xff
         if ch == 27: #ord('q')
             break
 
 
+def render_video(job):
+    """Write the frames of one video to out, see FrameSink"""
+    caltech_root, setid, videoid, x30, methods, out, fps = job
+    with FrameSink(out, fps) as sink:
+        for ind, img in draw_frames(caltech_root, setid, videoid, x30, methods):
+            sink.write(img, ind+1)
+    return sink.count
+
+
+def render(args):
+    """Render videos of the sets in args.setid to args.out, videos in parallel"""
+    methods = args.methods.split(',') if args.methods else []
+    jobs = []
+    for s in args.setid.split(','):
+        setid = 'set{:0>2}'.format(s)
+        seqs, vbbs = video_files(args.caltech_root, setid)
+        videoids = range(len(seqs)) if args.videoid < 0 else [args.videoid]
+        for videoid in videoids:
+            name = "V{:0>3}".format(videoid)
+            out = osp.join(args.out, setid, name + args.format if args.format.startswith('.') else name)
+            jobs.append((args.caltech_root, setid, videoid, args.x30, methods, out, args.fps))
+    counts = render_all(render_video, jobs, args.workers)
+    print("{} frames of {} videos are saved in {}".format(sum(counts), len(jobs), args.out))
+
+
 def main(args):
-    display(args)
+    if args.out is not None:
+        render(args)
+    else:
+        args.setid = int(args.setid)
+        display(args)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Display detection results in caltech format.')
     parser.add_argument('--caltech_root', default=os.environ['HOME']+'/data/pedestrian/caltech', type=str, help='detection results path')
-    parser.add_argument('--setid', default=6, type=int, help='video set index, [6,7,8,9,10]')
-    parser.add_argument('--videoid', default=0, type=int, help='video index, start from 0')
+    parser.add_argument('--setid', default='6', type=str, help='video set index, [6,7,8,9,10], comma separated with --out')
+    parser.add_argument('--videoid', default=0, type=int, help='video index, start from 0, -1 for all videos with --out')
     parser.add_argument('--x30', default=1, type=int, help='only show 30-th frame')
+    parser.add_argument('--out', default=None, type=str, help='render to this dir instead of a window')
+    parser.add_argument('--format', default='.mp4', type=str, help='.mp4 | .avi video, or jpg for an image sequence per video')
+    parser.add_argument('--fps', default=30, type=float, help='fps of rendered videos')
+    parser.add_argument('--methods', default='FasterRCNN', type=str, help='detection results in res/ to draw, comma separated')
+    parser.add_argument('--workers', default=8, type=int, help='videos rendered in parallel')
     args = parser.parse_args()
     main(args)
@@ -4,23 +4,28 @@
 from __future__ import print_function
 import argparse
 import os
+import multiprocessing
+import numpy as np
 import tqdm
-try:
-    import commands
-except Exception as e:
-    import subprocess as commands
+
+
+def caltech_name(imgfile):
+    """[setXX, VYYY, frame] of a JPEGImages file, from the name its link points to"""
+    target = os.readlink(imgfile) if os.path.islink(imgfile) else imgfile
+    return os.path.splitext(os.path.basename(target))[0].split('_')
 
 
 def map_id(voc_id, imgdir):
-    imgfile = os.path.join(imgdir, "{}.jpg".format(voc_id))
-    
-    cmd = "ls -lh {}".format(imgfile)
-    (status, output) = commands.getstatusoutput(cmd)
-    filename = output.split('\n')[0]\
-                     .split(' ')[-1]\
-                     .split('/')[-1]\
-                     .split('.')[0]
-    return filename.split('_')
+    return caltech_name(os.path.join(imgdir, "{}.jpg".format(voc_id)))
+
+
+def build_id_map(imgdir):
+    """{voc id: [setXX, VYYY, frame]} of all images, one readlink each"""
+    id_map = {}
+    for x in os.listdir(imgdir):
+        if x.endswith('.jpg'):
+            id_map[x[:-len('.jpg')]] = caltech_name(os.path.join(imgdir, x))
+    return id_map
 
 
 def fetch_txtname(outdir, setID_videoID):
@@ -31,56 +36,55 @@ def fetch_txtname(outdir, setID_videoID):
     return os.path.join(txtdir, videoID+'.txt')
 
 
-def convert(args):
-    results = [x.strip() for x in open(args.det_txt, 'r').readlines()]
+def parse_detections(det_txt):
+    """Columns of 'voc_id score x1 y1 x2 y2' lines, as string arrays (N,)"""
+    with open(det_txt, 'r') as fid:
+        tokens = np.array(fid.read().split())
+    tokens = tokens.reshape(-1, 6)
+    return [tokens[:, i] for i in range(6)]
 
 
-    import pickle
-    if os.path.exists('tmp.pkl'):
-        with open('tmp.pkl', 'r') as fid:
-            transform = pickle.load(fid)
-    else:
+def write_video(job):
+    """Write frame,x1,y1,w,h,score lines of one video, rows are sorted by frame"""
+    filename, frames, x1, y1, w, h, score = job
+    with open(filename, 'w') as f:
+        for row in zip(frames, x1, y1, w, h, score):
+            f.write('{},{},{},{},{},{}\n'.format(row[0], row[1], row[2], repr(float(row[3])), repr(float(row[4])), row[5]))
+    return len(frames)
+
 
-        t = tqdm.tqdm()
-        t.total = len(results) 
-
-        print('parsing...')
-        transform = {} 
-        for res in results:
-            t.update()
-            res = res.split(' ')
-            voc_id = res[0]
-            cal_id = map_id(voc_id, args.imgdir)
-            key = cal_id[0]+'_'+cal_id[1]
-
-            if key not in transform.keys():
-                transform[key] = {}
-            if cal_id[2] not in transform[key].keys():
-                transform[key][cal_id[2]] = []
-            transform[key][cal_id[2]].append(res[1:])
-
-        with open('tmp.pkl', 'w') as fid:
-            pickle.dump(transform, fid)
-
-
-    # saving to txt 
-    for k, v in transform.items():
-        filename = fetch_txtname(args.output, k)
-        f = open(filename, 'w')
-        frameids = sorted(map(int, v.keys())) 
-        for frameid in frameids:
-            for box in v[str(frameid)]:
-                f.write(str(frameid) + ',')
-                f.write(box[1]) 
-                f.write(',')
-                f.write(box[2])
-                f.write(',')
-                f.write(str(float(box[3]) - float(box[1])))
-                f.write(',')
-                f.write(str(float(box[4]) - float(box[2])))
-                f.write(',')
-                f.write(box[0] + '\n')
-        f.close()
+def convert(args):
+    voc_ids, score, x1, y1, x2, y2 = parse_detections(args.det_txt)
+    print('{} detections'.format(len(voc_ids)))
+
+    # each distinct image is resolved once
+    id_map = build_id_map(args.imgdir)
+    uniq, inverse = np.unique(voc_ids, return_inverse=True)
+    names = [id_map[x] if x in id_map else map_id(x, args.imgdir) for x in uniq]
+    videos = ['{}_{}'.format(x[0], x[1]) for x in names]
+    video_keys, video_of_uniq = np.unique(videos, return_inverse=True)
+    video = video_of_uniq[inverse]
+    frame = np.array([int(x[2]) for x in names], dtype=np.int64)[inverse]
+
+    # stable, detections of a frame keep their order in det_txt
+    order = np.lexsort((frame, video))
+    bounds = np.searchsorted(video[order], np.arange(len(video_keys) + 1))
+    w = x2.astype(np.float64) - x1.astype(np.float64)
+    h = y2.astype(np.float64) - y1.astype(np.float64)
+
+    jobs = []
+    for i, key in enumerate(video_keys):
+        rows = order[bounds[i]:bounds[i+1]]
+        jobs.append((fetch_txtname(args.output, key), frame[rows], x1[rows], y1[rows],
+                     w[rows], h[rows], score[rows]))
+    if args.workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.workers, len(jobs)))
+        counts = list(tqdm.tqdm(pool.imap_unordered(write_video, jobs), total=len(jobs)))
+        pool.close()
+        pool.join()
+    else:
+        counts = [write_video(x) for x in tqdm.tqdm(jobs)]
+    print("{} detections of {} videos are saved in {}".format(sum(counts), len(jobs), args.output))
 
 
 def main(args):
@@ -92,6 +96,7 @@ if __name__ == "__main__":
     parser.add_argument('--det_txt', default='', type=str, help='detection result txt')
     parser.add_argument('--imgdir', default='', type=str, help='test image path')
     parser.add_argument('--output', default='output', type=str, help='output path')
+    parser.add_argument('--workers', default=8, type=int, help='videos written in parallel')
     
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+SURREAL clips converted once from .mat files into per-frame .npy arrays.
+
+A clip is the files sharing a stem, e.g. run0/seq000/seq000_c0001:
+    seq000_c0001.mp4, _segm.mat, _depth.mat, _info.mat
+
+Layout of a clip directory in a store, <store_root>/<stem>/:
+    segm.npy       (F, H, W) uint8, body part labels
+    depth.npy      (F, H, W) float32 or float16, background is 1e10
+                   (inf in float16)
+    <info>.npy     per-frame variables of _info.mat, frame axis first:
+                   joints2D (F, J, 2), joints3D (F, J, 3), pose (F, 72),
+                   shape (F, 10), light (F, 9), zrot (F,), gender (F,)
+    meta.json      {'frames': F, 'stamp': ..., 'info': constants of
+                   _info.mat, e.g. camLoc, sequence}
+
+Arrays are opened with mmap, so frame i is read without loading the clip.
+"""
+
+import os
+import re
+import json
+import glob
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+import scipy.io as sio
+
+
+_suffixes = (('_segm.mat', 'segm'), ('_depth.mat', 'depth'), ('_info.mat', 'info'), ('.mp4', 'mp4'))
+# per-frame variables of _info.mat, frame axis last, e.g. joints2D (2, J, F)
+_frame_arrays = ('joints2D', 'joints3D', 'pose', 'shape', 'light')
+# one value per frame, e.g. zrot (F, 1)
+_frame_values = ('zrot', 'gender')
+
+
+def index_clips(root, split='train'):
+    """{stem: {kind: path}} of clips in root/split, stem is relative to root/split
+
+    Files are paired by stem, a clip missing a kind has no entry for it.
+    """
+    base = os.path.join(root, split)
+    clips = {}
+    for f in glob.glob(os.path.join(base, '*/*/*')):
+        for suffix, kind in _suffixes:
+            if f.endswith(suffix):
+                stem = os.path.relpath(f[:-len(suffix)], base)
+                clips.setdefault(stem, {})[kind] = f
+                break
+    return OrderedDict(sorted(clips.items()))
+
+
+def _frame_keys(mat_file, prefix):
+    # whosmat reads headers only, keys are segm_1 ... segm_F in file order
+    keys = {}
+    for name, shape, dtype in sio.whosmat(mat_file):
+        m = re.match(prefix + r'_(\d+)$', name)
+        if m:
+            keys[int(m.group(1))] = (name, shape)
+    return [keys[i] for i in sorted(keys)]
+
+
+def _stamp(clip):
+    return [[os.path.getsize(clip[k]), int(os.path.getmtime(clip[k]))]
+            for k in ('segm', 'depth', 'info') if k in clip]
+
+
+def _convert_frames(mat_file, prefix, out_file, dtype, chunk):
+    keys = _frame_keys(mat_file, prefix)
+    if not keys:
+        return 0
+    shape = (len(keys),) + tuple(keys[0][1])
+    tmpfile = out_file + '.tmp.npy'
+    out = np.lib.format.open_memmap(tmpfile, mode='w+', dtype=dtype, shape=shape)
+    # only chunk frames are decompressed at a time
+    for i in range(0, len(keys), chunk):
+        names = [x[0] for x in keys[i:i + chunk]]
+        data = sio.loadmat(mat_file, variable_names=names)
+        with np.errstate(over='ignore'):
+            # float16 depth, background 1e10 becomes inf
+            for j, name in enumerate(names):
+                out[i + j] = data[name]
+    out.flush()
+    del out
+    os.rename(tmpfile, out_file)
+    return shape[0]
+
+
+def _convert_info(mat_file, clip_dir, frames):
+    data = sio.loadmat(mat_file)
+    consts = {}
+    for name, value in data.items():
+        if name.startswith('__'):
+            continue
+        if value.dtype.kind in 'US':
+            consts[name] = str(value.ravel()[0]) if value.size else ''
+        elif name in _frame_arrays:
+            np.save(os.path.join(clip_dir, name + '.npy'), np.ascontiguousarray(value.T[:frames]))
+        elif name in _frame_values:
+            np.save(os.path.join(clip_dir, name + '.npy'), value.reshape(-1)[:frames])
+        else:
+            # by name, not shape: camLoc (3, 1) looks per-frame in a 3 frame clip
+            consts[name] = value.tolist()
+    return consts
+
+
+def convert_clip(clip, clip_dir, depth_dtype=np.float32, chunk=32):
+    """Convert the .mat files of a clip into clip_dir, skipped if already done"""
+    meta_file = os.path.join(clip_dir, 'meta.json')
+    stamp = _stamp(clip)
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r') as fid:
+            meta = json.load(fid)
+        if meta['stamp'] == stamp and meta['depth_dtype'] == np.dtype(depth_dtype).name:
+            return meta
+    if not os.path.exists(clip_dir):
+        os.makedirs(clip_dir)
+    frames = 0
+    if 'segm' in clip:
+        frames = _convert_frames(clip['segm'], 'segm', os.path.join(clip_dir, 'segm.npy'), np.uint8, chunk)
+    if 'depth' in clip:
+        frames = _convert_frames(clip['depth'], 'depth', os.path.join(clip_dir, 'depth.npy'),
+                                 depth_dtype, chunk) or frames
+    info = {}
+    if 'info' in clip:
+        if not frames:
+            # info only clip, frames from the pose
+            frames = dict((x[0], x[1]) for x in sio.whosmat(clip['info'])).get('pose', (0, 0))[-1]
+        info = _convert_info(clip['info'], clip_dir, frames)
+    # meta.json last, a clip without it is converted again
+    meta = {'frames': frames, 'stamp': stamp, 'depth_dtype': np.dtype(depth_dtype).name, 'info': info}
+    with open(meta_file + '.tmp', 'w') as fid:
+        json.dump(meta, fid)
+    os.rename(meta_file + '.tmp', meta_file)
+    return meta
+
+
+def _convert_job(args):
+    clip, clip_dir, depth_dtype, chunk = args
+    convert_clip(clip, clip_dir, depth_dtype, chunk)
+
+
+class ClipStore(object):
+
+    """Frames of one converted clip
+
+    Usage:
+        clip = ClipStore('store/run0/seq000/seq000_c0001')
+        clip.segm(3), clip.depth(3), clip.info('joints2D', 3)
+    """
+
+    def __init__(self, clip_dir):
+        self.clip_dir = clip_dir
+        with open(os.path.join(clip_dir, 'meta.json'), 'r') as fid:
+            self.meta = json.load(fid)
+        self.frames = self.meta['frames']
+        self._arrays = {}
+
+
+    def __len__(self):
+        return self.frames
+
+
+    def array(self, name):
+        """Whole (F, ...) array name, memory-mapped"""
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.clip_dir, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+
+    def segm(self, frame):
+        return self.array('segm')[frame]
+
+
+    def depth(self, frame):
+        return self.array('depth')[frame]
+
+
+    def info(self, name, frame=None):
+        """Per-frame variable of _info.mat at frame, or a constant, e.g. camLoc"""
+        if name in self.meta['info']:
+            return self.meta['info'][name]
+        value = self.array(name)
+        return value if frame is None else value[frame]
+
+
+class SurrealClips(object):
+
+    """Clips of a SURREAL split, converted on demand into store_root
+
+    Usage:
+        clips = SurrealClips('~/data/cmu', 'train', '~/data/cmu_store')
+        clips.convert(workers=8)
+        clips.open(clips.stems[0]).segm(0)
+    """
+
+    def __init__(self, root, split='train', store_root=None, depth_dtype=np.float32, chunk=32):
+        self.root = root
+        self.split = split
+        self.store_root = os.path.join(root, split + '_store') if store_root is None else store_root
+        self.depth_dtype = depth_dtype
+        self.chunk = chunk
+        self.clips = index_clips(root, split)
+        self.stems = list(self.clips.keys())
+
+
+    def __len__(self):
+        return len(self.stems)
+
+
+    def clip_dir(self, stem):
+        return os.path.join(self.store_root, stem)
+
+
+    def convert(self, workers=8):
+        """Convert all clips, one clip per task"""
+        jobs = [(self.clips[x], self.clip_dir(x), self.depth_dtype, self.chunk) for x in self.stems]
+        if workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(workers)
+            pool.map(_convert_job, jobs, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            for x in jobs:
+                _convert_job(x)
+
+
+    def open(self, stem):
+        """ClipStore of stem, converted first if needed"""
+        convert_clip(self.clips[stem], self.clip_dir(stem), self.depth_dtype, self.chunk)
+        return ClipStore(self.clip_dir(stem))
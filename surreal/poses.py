@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Export joints, camera and shape of SURREAL _info.mat files.
+
+All clips of a split go into contiguous arrays, row r is frame
+frame[r] of clip clip[r], rows of clip c are offsets[c]:offsets[c+1].
+
+Layout of an export directory:
+    clips.json     {'stems': [...], 'joints': [...]}
+    offsets.npy    (C+1,) int64
+    clip.npy       (N,) int32
+    frame.npy      (N,) int32, 0-based
+    joints2D.npy   (N, 24, 2) float32, pixels
+    joints3D.npy   (N, 24, 3) float32, meters
+    pose.npy       (N, 72) float32, SMPL pose
+    shape.npy      (N, 10) float32, SMPL shape
+    zrot.npy       (N,) float32
+    gender.npy     (N,) uint8
+    camLoc.npy     (C, 3) float32
+    camDist.npy    (C,) float32
+    sizes.npy      (C, 2) int32, width height of the video
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import multiprocessing
+import numpy as np
+import scipy.io as sio
+import cv2
+import tqdm
+from clipstore import index_clips
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../pedestrian/dataset"))
+from coco import SplitWriter
+
+
+joint_names = ('pelvis', 'left_hip', 'right_hip', 'spine1', 'left_knee', 'right_knee',
+               'spine2', 'left_ankle', 'right_ankle', 'spine3', 'left_foot', 'right_foot',
+               'neck', 'left_collar', 'right_collar', 'head', 'left_shoulder', 'right_shoulder',
+               'left_elbow', 'right_elbow', 'left_wrist', 'right_wrist', 'left_hand', 'right_hand')
+# SMPL kinematic tree, parent of each joint
+joint_parents = (-1, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 12, 13, 14, 16, 17, 18, 19, 20, 21)
+
+frame_fields = (('joints2D', np.float32), ('joints3D', np.float32), ('pose', np.float32),
+                ('shape', np.float32), ('zrot', np.float32), ('gender', np.uint8))
+clip_fields = (('camLoc', np.float32, (3,)), ('camDist', np.float32, ()), ('sizes', np.int32, (2,)))
+
+
+def _num_frames(info_file):
+    # whosmat reads headers only
+    shapes = dict((x[0], x[1]) for x in sio.whosmat(info_file))
+    return shapes['pose'][-1] if 'pose' in shapes else 0
+
+
+def video_size(mp4, default=(320, 240)):
+    """(width, height) of a video, default if it can not be opened"""
+    if mp4 is None:
+        return default
+    cap = cv2.VideoCapture(mp4)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    return size if size[0] > 0 else default
+
+
+def load_info(args):
+    """Fields of one _info.mat, frame axis first and cut to frames"""
+    info_file, mp4, frames = args
+    data = sio.loadmat(info_file)
+    out = {'joints2D': data['joints2D'].T[:frames],    # (2, J, F) -> (F, J, 2)
+           'joints3D': data['joints3D'].T[:frames],
+           'pose': data['pose'].T[:frames],            # (72, F) -> (F, 72)
+           'shape': data['shape'].T[:frames],
+           'zrot': data['zrot'].reshape(-1)[:frames],
+           'gender': data['gender'].reshape(-1)[:frames],
+           'camLoc': data['camLoc'].reshape(-1)[:3],
+           'camDist': data['camDist'].reshape(-1)[0],
+           'sizes': video_size(mp4)}
+    return out
+
+
+def export_poses(root, split='train', out_dir=None, workers=8, coco=True):
+    """Export all clips of root/split with an _info.mat to out_dir
+
+    Frame counts come from the mat headers, so the arrays are allocated
+    once and filled clip by clip as workers finish, in clip order.
+    coco (bool): also write person_keypoints_<split>.json, see KeypointWriter
+    """
+    out_dir = os.path.join(root, split + '_poses') if out_dir is None else out_dir
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    clips = index_clips(root, split)
+    stems = [x for x in clips if 'info' in clips[x]]
+    frames = [_num_frames(clips[x]['info']) for x in stems]
+    offsets = np.concatenate([[0], np.cumsum(frames)]).astype(np.int64)
+    n, c = int(offsets[-1]), len(stems)
+
+    def open_array(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy.tmp'), mode='w+',
+                                         dtype=dtype, shape=shape)
+    arrays = {'clip': open_array('clip', np.int32, (n,)), 'frame': open_array('frame', np.int32, (n,))}
+    shapes = {'joints2D': (n, len(joint_names), 2), 'joints3D': (n, len(joint_names), 3),
+              'pose': (n, 72), 'shape': (n, 10), 'zrot': (n,), 'gender': (n,)}
+    for name, dtype in frame_fields:
+        arrays[name] = open_array(name, dtype, shapes[name])
+    for name, dtype, shape in clip_fields:
+        arrays[name] = open_array(name, dtype, (c,) + shape)
+
+    jobs = [(clips[x]['info'], clips[x].get('mp4'), f) for x, f in zip(stems, frames)]
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(load_info, jobs, chunksize=1)
+    else:
+        pool = None
+        results = (load_info(x) for x in jobs)
+
+    writer = KeypointWriter(os.path.join(out_dir, 'person_keypoints_{}.json'.format(split))) if coco else None
+    for i, info in enumerate(tqdm.tqdm(results, total=len(jobs))):
+        s, e = offsets[i], offsets[i + 1]
+        arrays['clip'][s:e] = i
+        arrays['frame'][s:e] = np.arange(e - s)
+        for name, dtype in frame_fields:
+            arrays[name][s:e] = info[name]
+        for name, dtype, shape in clip_fields:
+            arrays[name][i] = info[name]
+        if writer is not None:
+            writer.add_clip(stems[i], s, info)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if writer is not None:
+        writer.close()
+
+    for name in arrays:
+        arrays[name].flush()
+    arrays = None
+    for name in ['clip', 'frame'] + [x[0] for x in frame_fields + clip_fields]:
+        os.rename(os.path.join(out_dir, name + '.npy.tmp'), os.path.join(out_dir, name + '.npy'))
+    np.save(os.path.join(out_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(out_dir, 'clips.json'), 'w') as fid:
+        json.dump({'stems': stems, 'joints': list(joint_names)}, fid)
+    print("{} frames of {} clips are saved in {}".format(n, c, out_dir))
+    return PoseArrays(out_dir)
+
+
+class KeypointWriter(object):
+
+    """COCO person keypoints json, written frame by frame through coco.SplitWriter
+
+    Images are <stem>/<frame+1:06d>.jpg, as rendered by vis.py with
+    --format jpg, image id is the row in the export + 1. Joints outside
+    the image get visibility 0.
+    """
+
+    def __init__(self, jsonfile):
+        self.writer = SplitWriter(jsonfile)
+
+
+    def add_clip(self, stem, row, info):
+        width, height = info['sizes']
+        for frame, joints in enumerate(info['joints2D']):
+            image_id = int(row) + frame + 1
+            x, y = joints[:, 0], joints[:, 1]
+            visible = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+            keypoints = np.zeros((len(joints), 3))
+            keypoints[visible, :2] = joints[visible]
+            keypoints[visible, 2] = 2
+            image = {'id': image_id,
+                     'file_name': '{}/{:0>6}.jpg'.format(stem, frame + 1),
+                     'width': int(width),
+                     'height': int(height)}
+            if not visible.any():
+                self.writer.add_image(image)
+                continue
+            x1, y1 = float(x[visible].min()), float(y[visible].min())
+            w, h = float(x[visible].max()) - x1, float(y[visible].max()) - y1
+            self.writer.add_image(image, [{'id': image_id,
+                                           'image_id': image_id,
+                                           'category_id': 1,
+                                           'keypoints': [round(float(v), 2) for v in keypoints.ravel()],
+                                           'num_keypoints': int(visible.sum()),
+                                           'bbox': [round(x1, 2), round(y1, 2), round(w, 2), round(h, 2)],
+                                           'area': round(w * h, 2),
+                                           'iscrowd': 0}])
+
+
+    def close(self):
+        skeleton = [[i + 1, p + 1] for i, p in enumerate(joint_parents) if p >= 0]
+        return self.writer.close([{'id': 1, 'name': 'person', 'supercategory': 'person',
+                                   'keypoints': list(joint_names), 'skeleton': skeleton}])
+
+
+class PoseArrays(object):
+
+    """Read-only access to an export, arrays are memory-mapped
+
+    Usage:
+        poses = PoseArrays('~/data/cmu/train_poses')
+        poses.get('run0/seq000/seq000_c0001', 3)['joints2D']
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, 'clips.json'), 'r') as fid:
+            meta = json.load(fid)
+        self.stems = meta['stems']
+        self.joint_names = meta['joints']
+        self._clip_index = dict((x, i) for i, x in enumerate(self.stems))
+        for name in ['offsets', 'clip', 'frame'] + [x[0] for x in frame_fields + clip_fields]:
+            setattr(self, name, np.load(os.path.join(out_dir, name + '.npy'), mmap_mode='r'))
+
+
+    def __len__(self):
+        return self.clip.shape[0]
+
+
+    def row(self, clip, frame):
+        """Row of frame of clip, clip is an index or a stem"""
+        if not isinstance(clip, (int, np.integer)):
+            clip = self._clip_index[clip]
+        if not 0 <= frame < self.offsets[clip + 1] - self.offsets[clip]:
+            raise IndexError('frame {} out of clip {}'.format(frame, self.stems[clip]))
+        return int(self.offsets[clip]) + frame
+
+
+    def get(self, clip, frame):
+        """All fields of one frame"""
+        r = self.row(clip, frame)
+        c = int(self.clip[r])
+        out = dict((name, getattr(self, name)[r]) for name, dtype in frame_fields)
+        out.update((name, getattr(self, name)[c]) for name, dtype, shape in clip_fields)
+        return out
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Export SURREAL joints and camera to arrays and COCO keypoints')
+    parser.add_argument('--surreal_root', default=os.path.expanduser('~/data/cmu'), type=str, help='surreal dataset root')
+    parser.add_argument('--split', default='train', type=str, help='image split, train | val | test')
+    parser.add_argument('--out', default=None, type=str, help='export dir, default <root>/<split>_poses')
+    parser.add_argument('--workers', default=8, type=int, help='clips loaded in parallel')
+    args = parser.parse_args()
+    export_poses(args.surreal_root, args.split, args.out, args.workers)
@@ -4,10 +4,19 @@
 from __future__ import print_function
 import argparse
 import os
+import sys
 import glob
+import threading
+try:
+    import Queue as queue
+except ImportError as e:
+    import queue
 import scipy.io as sio
 import cv2
 import numpy as np
+from clipstore import SurrealClips, ClipStore
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../pedestrian/dataset"))
+from render import FrameSink, render_all
 
 default_root = os.path.expanduser('~/data/cmu')
 
@@ -102,19 +111,75 @@ def colormap(rgb=False):
     return color_list
 
 
+def _put(out, item, done):
+    # gives up once the consumer is gone, a full queue would block forever
+    while not done.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _read_frames(f, start, stop, step, out, done):
+    cap = cv2.VideoCapture(f)
+    try:
+        index = 0
+        while stop is None or index < stop:
+            if done.is_set():
+                break
+            # grab() skips frames out of range and stride without retrieving them
+            if not cap.grab():
+                break
+            if index >= start and (index - start) % step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                _put(out, (index, frame), done)
+            index += 1
+    finally:
+        cap.release()
+        _put(out, None, done)
+
+
+def iter_mp4(f, start=0, stop=None, step=1, prefetch=8):
+    """Yield (frame index, BGR frame) of frames start:stop:step of a video
+
+    Frames are decoded by a background thread at most prefetch frames
+    ahead, so memory does not grow with the length of the clip.
+    """
+    if step < 1:
+        raise ValueError('step must be positive')
+    out = queue.Queue(max(prefetch, 1))
+    done = threading.Event()
+    reader = threading.Thread(target=_read_frames, args=(f, start, stop, step, out, done))
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            item = out.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        # consumer may stop early, let the reader finish
+        done.set()
+        reader.join()
+
+
 def parse_mp4(f):
+    """All frames of a video in one (frameCount, H, W, 3) array, see iter_mp4 to stream them"""
     cap = cv2.VideoCapture(f)
     frameCount = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     frameWidth = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frameHeight = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fc = 0
-    ret = True
-    buf = np.empty((frameCount, frameHeight, frameWidth, 3), np.dtype('uint8'))
-    while (fc < frameCount  and ret):
-        ret, buf[fc] = cap.read()
-        fc += 1
     cap.release()
-    return buf
+    buf = np.empty((frameCount, frameHeight, frameWidth, 3), np.dtype('uint8'))
+    fc = 0
+    for ind, frame in iter_mp4(f, stop=frameCount):
+        buf[ind] = frame
+        fc = ind + 1
+    return buf[:fc]
 
 
 def vis_mask(img, mask, color, index=-1, alpha=0.4, show_border=True, border_thick=1):
@@ -137,41 +202,77 @@ def vis_mask(img, mask, color, index=-1, alpha=0.4, show_border=True, border_thi
     return img.astype(np.uint8)
 
 
+_color_luts = {}
+
+def color_lut(rgb=False):
+    """(256, 3) uint8 color of each label, colormap repeated, built once"""
+    if rgb not in _color_luts:
+        colors = colormap(rgb)
+        lut = colors[np.arange(256) % len(colors)]
+        _color_luts[rgb] = np.round(lut).astype(np.uint8)
+    return _color_luts[rgb]
+
+
+def label_edges(mask):
+    """Pixels whose left or top neighbour has another label, a one pixel border"""
+    edges = np.zeros(mask.shape, dtype=bool)
+    edges[:, 1:] |= mask[:, 1:] != mask[:, :-1]
+    edges[1:, :] |= mask[1:, :] != mask[:-1, :]
+    return edges
+
+
+def overlay_labels(img, mask, alpha=0.4, show_border=True, border_thick=1, rgb=True):
+    """Blend all labels > 0 of mask onto img in one pass, see vis_mask for one label
+
+    Colors come from a cached lookup table indexed by label, borders are
+    drawn in white along edges between labels.
+    """
+    assert img.shape[:2] == mask.shape[:2], 'Not same shape of img and mask'
+    color = color_lut(rgb)[mask]
+    blended = cv2.addWeighted(img, 1.0 - alpha, color, alpha, 0)
+    out = img.copy()
+    np.copyto(out, blended, where=(mask > 0)[:, :, None])
+    if show_border:
+        edges = label_edges(mask)
+        if border_thick > 1:
+            kernel = np.ones((border_thick, border_thick), np.uint8)
+            edges = cv2.dilate(edges.view(np.uint8), kernel) > 0
+        out[edges] = 255
+    return out
+
+
 def draw_mask_on_img(img, mask):
-    assert img.shape[0] == mask.shape[0], 'Not same shape of img and mask'
-    for i in np.unique(mask):
-        if i == 0:
-            continue
-        color = colormap(True)[i]
-        img = vis_mask(img, mask, color, index=i)
-    return img
+    return overlay_labels(img, mask)
+
+
+def load_segm(files, clip_dir=None):
+    """Masks of a clip by frame, from a converted clip_dir, or from _segm.mat"""
+    if clip_dir is not None:
+        # converted once, a frame is read from the mmap
+        return ClipStore(clip_dir).array('segm')
+    seg_dict = sio.loadmat(files['segm'])
+    # segm_1 is the first frame
+    return [seg_dict['segm_{}'.format(i+1)] for i in range(len(seg_dict))
+            if 'segm_{}'.format(i+1) in seg_dict]
 
 
 def vis(args):
-    videos = sorted(glob.glob(os.path.join(args.surreal_root, args.split, '*/*/*.mp4')))
-    depths = sorted(glob.glob(os.path.join(args.surreal_root, args.split, '*/*/*_depth.mat')))
-    infos = sorted(glob.glob(os.path.join(args.surreal_root, args.split, '*/*/*_info.mat')))
-    segms = sorted(glob.glob(os.path.join(args.surreal_root, args.split, '*/*/*_segm.mat')))
-
-    cnt = 0
-    
-    for cnt in range(len(videos)):
-        video = videos[cnt]
-        segm = segms[cnt]
-
-    #for video, segm in zip(videos, segms):
-        imgs = parse_mp4(video)
-
-        seg_dict = sio.loadmat(segm)
-        # rewrite key
-        for i, key in enumerate([ x for x in seg_dict.keys() if 'segm_' in x]):
-            new_key = 'segm_{:0>2}'.format(key.split('_')[-1])
-            seg_dict[new_key] = seg_dict.pop(key)
-        seg_keys = sorted([ x for x in seg_dict.keys() if 'segm_' in x])
-
-        for ind, img in enumerate(imgs):
-            seg = seg_dict[seg_keys[ind+1]]
-            img = draw_mask_on_img(img, seg)
+    clips = SurrealClips(args.surreal_root, args.split, args.store)
+
+    # videos and segms are paired by clip stem
+    for cnt, stem in enumerate(clips.stems):
+        files = clips.clips[stem]
+        if 'mp4' not in files or 'segm' not in files:
+            continue
+        if args.store is not None:
+            clips.open(stem)
+        segm = load_segm(files, clips.clip_dir(stem) if args.store is not None else None)
+
+        # frames are shown while the rest of the clip is decoded
+        for ind, img in iter_mp4(files['mp4'], args.start, args.stop, args.step):
+            if ind >= len(segm):
+                break
+            img = draw_mask_on_img(img, segm[ind])
 
             cv2.imshow('img', img)
             ch = cv2.waitKey(20)
@@ -181,12 +282,50 @@ def vis(args):
             break
 
 
+def render_clip(job):
+    """Write the overlays of one clip to out, see FrameSink"""
+    files, clip_dir, out, start, stop, step, fps = job
+    segm = load_segm(files, clip_dir)
+    with FrameSink(out, fps) as sink:
+        for ind, img in iter_mp4(files['mp4'], start, stop, step):
+            if ind >= len(segm):
+                break
+            sink.write(draw_mask_on_img(img, segm[ind]), ind+1)
+    return sink.count
+
+
+def render(args):
+    """Render overlays of all clips of a split to args.out, clips in parallel"""
+    clips = SurrealClips(args.surreal_root, args.split, args.store)
+    stems = [x for x in clips.stems if 'mp4' in clips.clips[x] and 'segm' in clips.clips[x]]
+    if args.store is not None:
+        clips.convert(args.workers)
+    jobs = []
+    for stem in stems:
+        out = os.path.join(args.out, stem + args.format if args.format.startswith('.') else stem)
+        clip_dir = clips.clip_dir(stem) if args.store is not None else None
+        jobs.append((clips.clips[stem], clip_dir, out, args.start, args.stop, args.step, args.fps))
+    counts = render_all(render_clip, jobs, args.workers)
+    print("{} frames of {} clips are saved in {}".format(sum(counts), len(jobs), args.out))
+
+
 def main(args):
-    vis(args)
+    if args.out is not None:
+        render(args)
+    else:
+        vis(args)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Visualize human data in SURREAL')
     parser.add_argument('--surreal_root', default=default_root, type=str, help='surreal dataset root')
     parser.add_argument('--split', default='train', type=str, help='image split, train | val | test')
+    parser.add_argument('--store', default=None, type=str, help='clip store root, .mat files are converted once')
+    parser.add_argument('--start', default=0, type=int, help='first frame of each clip')
+    parser.add_argument('--stop', default=None, type=int, help='stop before this frame')
+    parser.add_argument('--step', default=1, type=int, help='show every step-th frame')
+    parser.add_argument('--out', default=None, type=str, help='render to this dir instead of a window')
+    parser.add_argument('--format', default='.mp4', type=str, help='.mp4 | .avi video, or jpg for an image sequence per clip')
+    parser.add_argument('--fps', default=30, type=float, help='fps of rendered videos')
+    parser.add_argument('--workers', default=8, type=int, help='clips rendered in parallel')
     args = parser.parse_args()
     main(args)